@@ -98,6 +98,9 @@ EXTRAS_REQUIRE = {
 
         # visualize geo-location data
         "geopy == 2.3.0",
+
+        # run FPR queries locally on parquet files (offline tests)
+        "duckdb == 0.3.2",
     ],
 
     "cpu_eda": [
@@ -8,7 +8,7 @@ In the long term, maybe we can add some automation or tooling around it?
 - e.g., similar to the tagging system or mechanical Turk to verify clusters.
 """
 from logging import info
-from typing import List
+from typing import Dict, List, Tuple
 
 import numpy as np
 import pandas as pd
@@ -17,6 +17,22 @@ from tqdm.auto import tqdm
 from ..utils.eda import reorder_array
 
 
+L_COLS_CLUSTER_FOR_QA = [
+    'subreddit_name',  # merge on this column
+    'cluster_id_agg_ward_cosine_200',
+    'german_subs_in_cluster',
+    'cluster_has_german_subs_and_mostly_sfw',
+    'German_posts_percent',
+
+    'subreddit_title',
+    'subreddit_public_description',
+    'subreddit_url',
+    'subreddit_url_with_google_translate',
+    'users_l28',
+    'posts_l28',
+]
+
+
 def reshape_for_distance_qa(
         df_subs_distance: pd.DataFrame,
         df_geo: pd.DataFrame,
@@ -34,7 +50,7 @@ def reshape_for_distance_qa(
         col_subs_in_same_cluster: str = 'subreddit_a_and_b_in_same_cluster',
         col_cluster_users_l28_sum: str = 'users_l28_for_cluster',
         col_cluster_primary_topics: str = 'primary_topics_in_cluster',
-
+        method: str = 'arrays',
 ) -> pd.DataFrame:
     """Take input dfs and reshape them to create a df that we can use for manual QA.
 
@@ -43,7 +59,28 @@ def reshape_for_distance_qa(
 
     The original process took around 34 seconds to run for first N steps. With this fxn
     I brought it down to ~28 seconds.
+
+    method:
+        'arrays': (default) see `reshape_for_distance_qa_arrays()`. One sort of the
+            distance pairs & integer takes instead of merges
+        'merge': original method. Sort, groupby.head() & merges for sub-A & sub-B
     """
+    if method == 'arrays':
+        return reshape_for_distance_qa_arrays(
+            df_subs_distance=df_subs_distance,
+            df_geo=df_geo,
+            df_ambassador=df_ambassador,
+            df_subs_cluster=df_subs_cluster,
+            top_n_subs_by_distance=top_n_subs_by_distance,
+            top_n_subs_in_cluster=top_n_subs_in_cluster,
+            top_n_subs_not_german=top_n_subs_not_german,
+            col_cluster_id=col_cluster_id,
+            col_ger_or_ambassador=col_ger_or_ambassador,
+            col_subs_in_same_cluster=col_subs_in_same_cluster,
+        )
+    elif method != 'merge':
+        raise NotImplementedError(f"method not implemented: {method}")
+
     n_subs_to_limit = min([(top_n_subs_not_german + top_n_subs_by_distance + top_n_subs_in_cluster) * 5,
                            1000])
 
@@ -166,7 +203,22 @@ def reshape_for_distance_qa(
 
     info(f"Add seed counterpart subs...")
 
-    l_cols_to_front = [
+    l_cols_to_front = get_cols_to_front_for_qa(col_subs_in_same_cluster, col_ger_or_ambassador)
+    df_subs_distance_qa_final = df_subs_distance_qa_final[
+        reorder_array(l_cols_to_front, df_subs_distance_qa_final.columns)
+    ]
+
+    # maybe only keep to 25 instead of top 50?
+
+    return df_subs_distance_qa_final
+
+
+def get_cols_to_front_for_qa(
+        col_subs_in_same_cluster: str = 'subreddit_a_and_b_in_same_cluster',
+        col_ger_or_ambassador: str = 'german_or_ambassador_sub',
+) -> List[str]:
+    """Columns to show first in the QA spreadsheet"""
+    return [
         'cosine_distance',
         'subreddit_name_a',
         'subreddit_name_b',
@@ -199,13 +251,6 @@ def reshape_for_distance_qa(
         'subreddit_url_with_google_translate_b',
 
     ]
-    df_subs_distance_qa_final = df_subs_distance_qa_final[
-        reorder_array(l_cols_to_front, df_subs_distance_qa_final.columns)
-    ]
-
-    # maybe only keep to 25 instead of top 50?
-
-    return df_subs_distance_qa_final
 
 
 def append_german_relevant_cols_to_distance_df(
@@ -248,20 +293,7 @@ def append_german_relevant_cols_to_distance_df(
     if df_subs_cluster is not None:
         if cols_cluster_to_merge is None:
             # TODO(djb): define the cluster columns to merge
-            cols_cluster_to_merge = [
-                'subreddit_name',  # merge on this column
-                'cluster_id_agg_ward_cosine_200',
-                'german_subs_in_cluster',
-                'cluster_has_german_subs_and_mostly_sfw',
-                'German_posts_percent',
-
-                'subreddit_title',
-                'subreddit_public_description',
-                'subreddit_url',
-                'subreddit_url_with_google_translate',
-                'users_l28',
-                'posts_l28',
-            ]
+            cols_cluster_to_merge = L_COLS_CLUSTER_FOR_QA
         for sub_x in tqdm(cols_sub_name_to_merge):
             sub_suffix = sub_x.split('_')[-1]
             df_subs_distance_qa = df_subs_distance_qa.merge(
@@ -273,6 +305,380 @@ def append_german_relevant_cols_to_distance_df(
 
     return df_subs_distance_qa
 
+
+def reshape_for_distance_qa_arrays(
+        df_subs_distance: pd.DataFrame,
+        df_geo: pd.DataFrame,
+        df_ambassador: pd.DataFrame,
+        df_subs_cluster: pd.DataFrame,
+        top_n_subs_by_distance: int = 10,
+        top_n_subs_in_cluster: int = 20,
+        top_n_subs_not_german: int = 5,
+        country_code: str = 'DE',
+
+        col_cluster_id: str = 'cluster_id_agg_ward_cosine_200',
+        col_ger_or_ambassador: str = 'german_or_ambassador_sub',
+        col_subs_in_same_cluster: str = 'subreddit_a_and_b_in_same_cluster',
+) -> pd.DataFrame:
+    """Same output as `reshape_for_distance_qa(method='merge')`, but with arrays:
+    - flags & cluster IDs are computed once per subreddit & indexed by integer code
+    - ONE sort of the pairs (sub-A, distance) gives the rank of each sub-B
+    - top N by distance, top N not-relevant & top N in same cluster are masks on that sort
+    - we only attach columns to the rows we keep
+
+    Difference: flags are per subreddit. If a sub has multiple rows in df_geo (one per country),
+    the merge method creates one row per (pair, country), this method creates one row per pair.
+    """
+    return reshape_for_distance_qa_multi_country(
+        df_subs_distance=df_subs_distance,
+        df_geo=df_geo,
+        df_ambassador=df_ambassador,
+        df_subs_cluster=df_subs_cluster,
+        target_countries=[country_code],
+        top_n_subs_by_distance=top_n_subs_by_distance,
+        top_n_subs_in_cluster=top_n_subs_in_cluster,
+        top_n_subs_not_relevant=top_n_subs_not_german,
+        col_cluster_id=col_cluster_id,
+        col_relevant_or_ambassador=col_ger_or_ambassador,
+        col_subs_in_same_cluster=col_subs_in_same_cluster,
+    )[country_code]
+
+
+def reshape_for_distance_qa_multi_country(
+        df_subs_distance: pd.DataFrame,
+        df_geo: pd.DataFrame,
+        df_ambassador: pd.DataFrame,
+        df_subs_cluster: pd.DataFrame,
+        target_countries: List[str],
+        top_n_subs_by_distance: int = 10,
+        top_n_subs_in_cluster: int = 20,
+        top_n_subs_not_relevant: int = 5,
+
+        col_cluster_id: str = 'cluster_id_agg_ward_cosine_200',
+        col_relevant_or_ambassador: str = 'relevant_or_ambassador_sub',
+        col_subs_in_same_cluster: str = 'subreddit_a_and_b_in_same_cluster',
+) -> Dict[str, pd.DataFrame]:
+    """Create the distance QA df for each country in one run.
+    Use the same countries as `CreateFPRs.target_countries`.
+
+    The expensive steps only run once for all countries:
+    - sort the pairs for every sub-A that's relevant to ANY country
+    - flags & cluster metadata per subreddit
+    Relevance is a boolean matrix (subreddits x countries), so the masks to select
+    top subs for every country are columns of one (pairs x countries) matrix.
+
+    A sub is relevant to a country if it's geo-relevant to it OR it's an ambassador sub.
+    For each country, `{col_relevant_or_ambassador}_a|b` has the flag for that country.
+
+    Returns:
+        dict with one df per country: {country_code: df_qa}
+    """
+    n_subs_to_limit = min([(top_n_subs_not_relevant + top_n_subs_by_distance + top_n_subs_in_cluster) * 5,
+                           1000])
+    info(f"{df_subs_distance.shape}  <- Original df_distance shape")
+
+    d_relevant_names = get_relevant_subreddit_names(df_geo, df_ambassador, target_countries)
+    d_pairs = get_sorted_pairs_for_qa(
+        df_subs_distance=df_subs_distance,
+        seed_subreddit_names=set().union(*d_relevant_names.values()),
+        n_subs_to_limit=n_subs_to_limit,
+    )
+    info(f"{len(d_pairs['ix_rows']):,.0f}  <- Pairs after keeping only top {n_subs_to_limit} per relevant sub-a")
+
+    geo_country_code, ambassador, relevant = get_subreddit_relevance_arrays(
+        d_pairs['subreddit_names'], df_geo, df_ambassador, target_countries,
+    )
+    df_cluster_meta, mask_same_cluster = get_cluster_meta_for_codes(
+        d_pairs, df_subs_cluster, col_cluster_id=col_cluster_id,
+    )
+
+    # (pairs x countries): only keep seeds that are relevant to each country
+    mask_keep = relevant[d_pairs['code_a']] & get_mask_qa_pairs_to_keep(
+        d_pairs,
+        mask_same_cluster=mask_same_cluster,
+        mask_not_relevant_b=~relevant[d_pairs['code_b']],
+        top_n_subs_by_distance=top_n_subs_by_distance,
+        top_n_subs_not_relevant=top_n_subs_not_relevant,
+        top_n_subs_in_cluster=top_n_subs_in_cluster,
+    )
+
+    d_df_qa = dict()
+    for j_, country_code in enumerate(target_countries):
+        d_df_qa[country_code] = get_df_qa_pairs(
+            df_subs_distance=df_subs_distance,
+            d_pairs=d_pairs,
+            mask_keep=mask_keep[:, j_],
+            geo_country_code=geo_country_code[:, j_],
+            ambassador=ambassador,
+            relevant=relevant[:, j_],
+            df_cluster_meta=df_cluster_meta,
+            mask_same_cluster=mask_same_cluster,
+            col_ger_or_ambassador=col_relevant_or_ambassador,
+            col_subs_in_same_cluster=col_subs_in_same_cluster,
+        )
+        info(f"  {country_code}: {d_df_qa[country_code].shape}  <- "
+             f"Shape after keeping only top {top_n_subs_by_distance} by distance and"
+             f" {top_n_subs_in_cluster} subs in cluster per sub-a")
+    return d_df_qa
+
+
+def get_relevant_subreddit_names(
+        df_geo: pd.DataFrame,
+        df_ambassador: pd.DataFrame,
+        country_codes: List[str],
+) -> dict:
+    """Set of relevant subreddit names for each country: geo-relevant OR ambassador sub"""
+    set_ambassador = set(df_ambassador['subreddit_name'])
+    return {
+        c_: set(df_geo.loc[df_geo['geo_country_code'] == c_, 'subreddit_name']) | set_ambassador
+        for c_ in country_codes
+    }
+
+
+def get_sorted_pairs_for_qa(
+        df_subs_distance: pd.DataFrame,
+        seed_subreddit_names: set,
+        n_subs_to_limit: int,
+) -> dict:
+    """Sort the pairs for the seeds (sub-A) ONCE by (sub-A, distance desc) & keep
+    the top `n_subs_to_limit` per seed.
+
+    Returns dict of arrays (one value per kept pair, in sorted order):
+        ix_rows: row position in df_subs_distance
+        code_a, code_b: integer code for sub-A & sub-B (index into `subreddit_names`)
+        rank: rank of sub-B for sub-A (0 = closest)
+        group: index of sub-A's group
+        starts: position where each group starts
+        subreddit_names: names for each code
+    """
+    # Factorize sub-A for all rows once: we get the seed mask & sub-A codes from the same hash pass
+    #  (if it's a categorical we already have the codes)
+    name_a_all = df_subs_distance['subreddit_name_a']
+    if pd.api.types.is_categorical_dtype(name_a_all):
+        codes_a_all = name_a_all.cat.codes.to_numpy()
+        subreddit_names = pd.Index(name_a_all.cat.categories)
+    else:
+        codes_a_all, subreddit_names = pd.factorize(name_a_all)
+        subreddit_names = pd.Index(subreddit_names)
+    ix_rows = np.flatnonzero(
+        np.r_[subreddit_names.isin(seed_subreddit_names), False][codes_a_all]
+    )
+    code_a = codes_a_all[ix_rows]
+    n_rows = len(ix_rows)
+
+    name_b = np.asarray(df_subs_distance['subreddit_name_b'].to_numpy()[ix_rows], dtype=object)
+    code_b = subreddit_names.get_indexer(name_b)
+    mask_b_new = code_b == -1
+    if mask_b_new.any():
+        # sub-B names that are never a sub-A get codes after the sub-A names
+        codes_b_new, names_b_new = pd.factorize(name_b[mask_b_new])
+        code_b[mask_b_new] = codes_b_new + len(subreddit_names)
+        subreddit_names = subreddit_names.append(pd.Index(names_b_new))
+    distance = df_subs_distance['cosine_distance'].to_numpy()[ix_rows]
+
+    # Sort by distance, then stable sort by sub-A code. Faster than np.lexsort
+    #  because we can use radix sort for the codes when they fit in int16.
+    #  Both sorts are stable so ties keep the input row order, same as sort_values() in the merge
+    ix_sort = np.argsort(-distance, kind='stable')
+    dtype_codes_ = np.int16 if len(subreddit_names) <= np.iinfo(np.int16).max else np.int32
+    ix_sort = ix_sort[np.argsort(code_a[ix_sort].astype(dtype_codes_), kind='stable')]
+    code_a_sorted = code_a[ix_sort]
+    mask_new_group = np.r_[True, code_a_sorted[1:] != code_a_sorted[:-1]] if n_rows else np.array([], dtype=bool)
+    group = np.cumsum(mask_new_group) - 1
+    starts = np.flatnonzero(mask_new_group)
+    rank = np.arange(n_rows) - starts[group]
+
+    # Limit to the top N per seed. Each group is still a prefix, so `group` stays valid
+    mask_limit = rank < n_subs_to_limit
+    rank = rank[mask_limit]
+    ix_sort = ix_sort[mask_limit]
+    return {
+        'ix_rows': ix_rows[ix_sort],
+        'code_a': code_a[ix_sort],
+        'code_b': code_b[ix_sort],
+        'rank': rank,
+        'group': group[mask_limit],
+        'starts': np.flatnonzero(rank == 0),
+        'subreddit_names': subreddit_names,
+    }
+
+
+def get_rank_in_group(
+        mask: np.ndarray,
+        group: np.ndarray,
+        starts: np.ndarray,
+) -> np.ndarray:
+    """Rank of each True row among the True rows of its group (only valid where mask is True).
+    If mask is 2D (rows x countries), get the rank for each column.
+    """
+    cumsum_ = np.cumsum(mask, axis=0)
+    cumsum_before_group = np.concatenate([np.zeros((1,) + mask.shape[1:], dtype=cumsum_.dtype), cumsum_])[starts]
+    return cumsum_ - cumsum_before_group[group] - 1
+
+
+def get_mask_qa_pairs_to_keep(
+        d_pairs: dict,
+        mask_same_cluster: np.ndarray,
+        mask_not_relevant_b: np.ndarray,
+        top_n_subs_by_distance: int = 10,
+        top_n_subs_not_relevant: int = 5,
+        top_n_subs_in_cluster: int = 20,
+) -> np.ndarray:
+    """Keep a pair if sub-B is in any of these lists for sub-A:
+    - the closest subs
+    - the closest subs that are NOT relevant (so we get counterparts even if a cluster is mostly relevant subs)
+    - the closest subs in the same cluster
+
+    mask_not_relevant_b can be 2D (pairs x countries), then the output is 2D too.
+    """
+    group, starts = d_pairs['group'], d_pairs['starts']
+    mask_by_distance_and_cluster = (
+        (d_pairs['rank'] < top_n_subs_by_distance) |
+        (
+            mask_same_cluster &
+            (get_rank_in_group(mask_same_cluster, group, starts) < top_n_subs_in_cluster)
+        )
+    )
+    if mask_not_relevant_b.ndim == 2:
+        mask_by_distance_and_cluster = mask_by_distance_and_cluster[:, None]
+    return mask_by_distance_and_cluster | (
+        mask_not_relevant_b &
+        (get_rank_in_group(mask_not_relevant_b, group, starts) < top_n_subs_not_relevant)
+    )
+
+
+def get_subreddit_relevance_arrays(
+        subreddit_names: pd.Index,
+        df_geo: pd.DataFrame,
+        df_ambassador: pd.DataFrame,
+        country_codes: List[str],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Flags for each subreddit code (rows) & country (columns).
+
+    Returns:
+        geo_country_code: (n_subs, n_countries) the country if the sub is geo-relevant to it,
+            otherwise the sub's first country in df_geo (NaN if it's not in df_geo, same as the merge)
+        ambassador: (n_subs,) True if it's an ambassador sub
+        relevant: (n_subs, n_countries) True if geo-relevant to the country OR ambassador sub
+    """
+    ambassador = subreddit_names.isin(df_ambassador['subreddit_name'])
+
+    df_geo_ = df_geo[df_geo['subreddit_name'].isin(subreddit_names)]
+    ix_geo_ = subreddit_names.get_indexer(df_geo_['subreddit_name'])
+    country_geo_ = df_geo_['geo_country_code'].to_numpy()
+
+    geo_first_ = np.full(len(subreddit_names), np.nan, dtype=object)
+    # reverse so that the first row for each sub is the last one assigned
+    geo_first_[ix_geo_[::-1]] = country_geo_[::-1]
+
+    geo_country_code = np.repeat(geo_first_[:, None], len(country_codes), axis=1)
+    relevant = np.zeros((len(subreddit_names), len(country_codes)), dtype=bool)
+    for j_, c_ in enumerate(country_codes):
+        ix_country_ = ix_geo_[country_geo_ == c_]
+        geo_country_code[ix_country_, j_] = c_
+        relevant[ix_country_, j_] = True
+    relevant |= ambassador[:, None]
+    return geo_country_code, ambassador, relevant
+
+
+def get_cluster_meta_for_codes(
+        d_pairs: dict,
+        df_subs_cluster: pd.DataFrame,
+        col_cluster_id: str = 'cluster_id_agg_ward_cosine_200',
+        cols_cluster_to_merge: List = None,
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Cluster metadata with one row per subreddit code & mask for pairs in the same cluster"""
+    if cols_cluster_to_merge is None:
+        # the German cluster cols might not exist for other countries
+        cols_cluster_to_merge = [c for c in L_COLS_CLUSTER_FOR_QA if c in df_subs_cluster.columns]
+    df_cluster_meta = (
+        df_subs_cluster[cols_cluster_to_merge]
+        .drop_duplicates(subset=['subreddit_name'])
+        .set_index('subreddit_name')
+        .reindex(d_pairs['subreddit_names'])
+        .reset_index(drop=True)
+    )
+    # NaN != NaN, so subs without a cluster are never in the same cluster (same as the merge)
+    cluster_id_ = df_cluster_meta[col_cluster_id].to_numpy()
+    mask_same_cluster = cluster_id_[d_pairs['code_a']] == cluster_id_[d_pairs['code_b']]
+    return df_cluster_meta, mask_same_cluster
+
+
+def _assign_cols_like_merge(
+        df: pd.DataFrame,
+        d_new_cols: dict,
+) -> pd.DataFrame:
+    """Add new columns to df. Like a merge, if a column already exists
+    the old one gets the suffix `_x` & the new one `_y`
+    """
+    for col_, vals_ in d_new_cols.items():
+        if col_ in df.columns:
+            df = df.rename(columns={col_: f"{col_}_x"})
+            col_ = f"{col_}_y"
+        df[col_] = vals_
+    return df
+
+
+def get_df_qa_pairs(
+        df_subs_distance: pd.DataFrame,
+        d_pairs: dict,
+        mask_keep: np.ndarray,
+        geo_country_code: np.ndarray,
+        ambassador: np.ndarray,
+        relevant: np.ndarray,
+        df_cluster_meta: pd.DataFrame,
+        mask_same_cluster: np.ndarray,
+        col_ger_or_ambassador: str = 'german_or_ambassador_sub',
+        col_subs_in_same_cluster: str = 'subreddit_a_and_b_in_same_cluster',
+) -> pd.DataFrame:
+    """Attach flags & cluster metadata to the pairs we keep, sort & order columns for QA.
+    All per-subreddit inputs (geo_country_code, ambassador, relevant, df_cluster_meta) are
+    indexed by subreddit code.
+    """
+    code_a = d_pairs['code_a'][mask_keep]
+    code_b = d_pairs['code_b'][mask_keep]
+    df_qa = df_subs_distance.iloc[d_pairs['ix_rows'][mask_keep]].reset_index(drop=True)
+
+    d_new_cols = dict()
+    for sub_suffix, code_ in [('a', code_a), ('b', code_b)]:
+        d_new_cols[f'geo_country_code_{sub_suffix}'] = geo_country_code[code_]
+        d_new_cols[f'ambassador_sub_{sub_suffix}'] = np.where(ambassador[code_], 'yes', 'no')
+        d_new_cols[f"{col_ger_or_ambassador}_{sub_suffix}"] = np.where(relevant[code_], 'yes', 'no')
+    for sub_suffix, code_ in [('a', code_a), ('b', code_b)]:
+        for col_ in df_cluster_meta.columns:
+            d_new_cols[f'{col_}_{sub_suffix}'] = df_cluster_meta[col_].take(code_).reset_index(drop=True)
+    d_new_cols[col_subs_in_same_cluster] = mask_same_cluster[mask_keep]
+    df_qa = _assign_cols_like_merge(df_qa, d_new_cols)
+
+    info(f"Sort rows before output")
+    # want to keep subreddits in similar clusters next to each other
+    #  skip sort columns that aren't in the cluster metadata
+    l_sort_cols_and_ascending = [
+        c_ for c_ in [
+            ('cluster_has_german_subs_and_mostly_sfw_a', False),
+            ('users_l28_a', False),
+            ('german_subs_in_cluster_a', False),
+            ('cluster_id_agg_ward_cosine_200_a', True),
+            ('subreddit_name_a', True),
+            (col_subs_in_same_cluster, True),
+            (f"{col_ger_or_ambassador}_b", True),
+            ('cosine_distance', False),
+        ]
+        if c_[0] in df_qa.columns
+    ]
+    df_qa = (
+        df_qa
+        .sort_values(
+            by=[c_ for c_, _ in l_sort_cols_and_ascending],
+            ascending=[asc_ for _, asc_ in l_sort_cols_and_ascending],
+        )
+        .reset_index(drop=True)
+    )
+    return df_qa[
+        reorder_array(get_cols_to_front_for_qa(col_subs_in_same_cluster, col_ger_or_ambassador), df_qa.columns)
+    ]
+
+
 #
-# ~fin
+# ~ fin
 #
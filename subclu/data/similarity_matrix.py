@@ -0,0 +1,233 @@
+"""
+Memory-mapped subreddit similarity matrix + lookup API.
+
+The "full" pair-wise table (N^2 rows with metadata for both subs) is huge & we rarely
+query all of it. Instead, save the N x N matrix as a float16/float32 .npy file
+plus a parquet with the key (e.g., subreddit_name) & IDs for each row.
+`SimilarityMatrix.load()` attaches to the .npy as a read-only memmap, so each lookup
+only reads the pages it needs.
+
+Example:
+    sim = SimilarityMatrix.load('data/similarity/df_subs_similarity-167_by_167')
+    sim.similarity('de', 'fragreddit')
+    sim.row('de')
+    sim.top_k('de', k=20, filter_mask=df_subs['geo_relevant_de'])
+
+    # or use the subreddit IDs as keys:
+    sim_ids = SimilarityMatrix.load(path, key_col='subreddit_id')
+"""
+import hashlib
+import json
+import logging
+from logging import info
+import os
+from pathlib import Path
+import tempfile
+from typing import Iterable, Union
+
+import numpy as np
+import pandas as pd
+
+
+log = logging.getLogger(__name__)
+
+F_SIMILARITY = 'similarity.npy'
+F_INDEX = 'df_index.parquet'
+F_META = 'meta.json'
+
+
+def save_similarity_matrix(
+        path: Union[str, Path],
+        similarity: Union[np.ndarray, pd.DataFrame],
+        df_index: pd.DataFrame,
+        dtype: str = 'float16',
+        block_size: int = 2048,
+) -> Path:
+    """Save a square similarity matrix so we can memmap it.
+
+    Args:
+        path: local folder for the outputs
+        similarity: N x N array or df (can be a memmap)
+        df_index: N rows, the key & IDs for each row/column of the matrix,
+            e.g., subreddit_name & subreddit_id
+        dtype: float16 is half the size & has ~3 significant digits, which is enough
+            to rank subreddits. Use float32 if we need more precision.
+        block_size: copy this many rows at a time so we never hold a second
+            copy of the full matrix in memory
+
+    The .npy file is written last (tmp file + rename) so readers only see complete outputs.
+    """
+    if isinstance(similarity, pd.DataFrame):
+        similarity = similarity.to_numpy()
+    n_rows, n_cols = similarity.shape
+    if (n_rows != n_cols) or (n_rows != len(df_index)):
+        raise ValueError(
+            f"Expected a square matrix with one row per df_index row."
+            f" Got {similarity.shape} & {len(df_index)} index rows"
+        )
+
+    path = Path(path)
+    Path.mkdir(path, exist_ok=True, parents=True)
+    df_index.reset_index(drop=True).to_parquet(path / F_INDEX)
+    with open(path / F_META, 'w') as f_:
+        json.dump({'shape': [n_rows, n_cols], 'dtype': str(np.dtype(dtype))}, f_)
+
+    f_tmp_ = path / f"{F_SIMILARITY}.tmp-{os.getpid()}"
+    X_out = np.lib.format.open_memmap(f_tmp_, mode='w+', dtype=dtype, shape=(n_rows, n_cols))
+    for i_ in range(0, n_rows, block_size):
+        X_out[i_:i_ + block_size] = similarity[i_:i_ + block_size]
+    X_out.flush()
+    del X_out
+    os.replace(f_tmp_, path / F_SIMILARITY)
+
+    info(f"{n_rows:9,.0f} | {n_cols:9,.0f} <- Similarity matrix SHAPE ({dtype}), saved to:\n  {path}")
+    return path
+
+
+def upload_similarity_matrix(
+        path_local: Union[str, Path],
+        uri: str,
+) -> None:
+    """Copy a saved similarity matrix folder to GCS (or any fsspec URI)"""
+    # import here, fsspec comes with gcsfs
+    import fsspec
+
+    fs_, path_remote = fsspec.core.url_to_fs(uri)
+    fs_.makedirs(path_remote, exist_ok=True)
+    for f_ in [F_INDEX, F_META, F_SIMILARITY]:
+        fs_.put(str(Path(path_local) / f_), f"{path_remote}/{f_}")
+    info(f"  Similarity matrix uploaded to:\n  {uri}")
+
+
+class SimilarityMatrix:
+    """Look up similarities from a (memmapped) N x N matrix by key.
+
+    Args:
+        X_similarity: N x N array, usually a read-only memmap from `load()`
+        df_index: N rows with the keys & IDs for each row/column of the matrix
+        key_col: column in df_index to use as key for lookups
+    """
+    def __init__(
+            self,
+            X_similarity: np.ndarray,
+            df_index: pd.DataFrame,
+            key_col: str = 'subreddit_name',
+    ):
+        self.X_similarity = X_similarity
+        self.df_index = df_index.reset_index(drop=True)
+        self.key_col = key_col
+        self.keys = pd.Index(self.df_index[key_col])
+        if not self.keys.is_unique:
+            raise ValueError(f"Keys in column `{key_col}` must be unique")
+
+    @classmethod
+    def load(
+            cls,
+            path: str,
+            key_col: str = 'subreddit_name',
+            mmap_mode: str = 'r',
+            local_cache_dir: str = None,
+    ) -> 'SimilarityMatrix':
+        """Attach to a saved similarity matrix.
+        If `path` is a URI (e.g., gs://...) we download it to `local_cache_dir` first
+        because we can only memmap local files. The local folder is keyed by the URI,
+        so calling `load()` again with the same URI re-uses the download.
+        """
+        if '://' in str(path):
+            # import here, fsspec comes with gcsfs
+            import fsspec
+
+            if local_cache_dir is None:
+                local_cache_dir = Path(tempfile.gettempdir()) / 'similarity_matrix'
+            fs_, path_remote = fsspec.core.url_to_fs(str(path))
+            key_ = hashlib.sha1(str(path).rstrip('/').encode()).hexdigest()[:12]
+            path_local = Path(local_cache_dir) / f"{Path(path_remote).name}-{key_}"
+            if not (path_local / F_SIMILARITY).exists():
+                info(f"  Downloading similarity matrix to:\n  {path_local}")
+                Path.mkdir(path_local, exist_ok=True, parents=True)
+                # get the .npy last & rename each file after it's downloaded
+                #  so an interrupted download doesn't look complete
+                for f_ in [F_INDEX, F_META, F_SIMILARITY]:
+                    f_tmp_ = path_local / f"{f_}.tmp-{os.getpid()}"
+                    fs_.get(f"{path_remote}/{f_}", str(f_tmp_))
+                    os.replace(f_tmp_, path_local / f_)
+            path = path_local
+
+        path = Path(path)
+        return cls(
+            X_similarity=np.load(path / F_SIMILARITY, mmap_mode=mmap_mode),
+            df_index=pd.read_parquet(path / F_INDEX),
+            key_col=key_col,
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get_ix(self, keys: Union[str, Iterable]) -> Union[int, np.ndarray]:
+        """Row index for one key or a list of keys. Raises KeyError for missing keys"""
+        if np.ndim(keys) == 0:
+            return self.keys.get_loc(keys)
+        ix_ = self.keys.get_indexer(keys)
+        if (ix_ == -1).any():
+            raise KeyError(f"Keys not found: {list(np.asarray(keys)[ix_ == -1])}")
+        return ix_
+
+    def similarity(
+            self,
+            a: Union[str, Iterable],
+            b: Union[str, Iterable],
+    ) -> Union[float, np.ndarray]:
+        """Similarity between a & b. If a & b are lists, get the similarity for each pair"""
+        sim_ = self.X_similarity[self.get_ix(a), self.get_ix(b)]
+        if np.ndim(sim_) == 0:
+            return float(sim_)
+        return np.asarray(sim_, dtype=np.float32)
+
+    def row(self, a: str) -> pd.Series:
+        """Similarity between `a` and all the keys (including itself)"""
+        return pd.Series(
+            np.asarray(self.X_similarity[self.get_ix(a)], dtype=np.float32),
+            index=self.keys,
+            name=a,
+        )
+
+    def top_k(
+            self,
+            a: str,
+            k: int = 20,
+            filter_mask: Union[np.ndarray, pd.Series] = None,
+    ) -> pd.Series:
+        """Top k most similar keys to `a` (excluding `a`), sorted descending.
+
+        Args:
+            a: key to look up
+            k: number of keys to return
+            filter_mask: only keep keys where this is True. Either a boolean
+                array in the same order as the matrix or a boolean Series indexed by key
+                (keys missing from the Series are dropped).
+        """
+        ix_a = self.get_ix(a)
+        sim_ = np.asarray(self.X_similarity[ix_a], dtype=np.float32)
+
+        mask_ = np.ones(len(sim_), dtype=bool)
+        if filter_mask is not None:
+            if isinstance(filter_mask, pd.Series):
+                filter_mask = filter_mask.reindex(self.keys, fill_value=False)
+            mask_ &= np.asarray(filter_mask, dtype=bool)
+        mask_[ix_a] = False
+        mask_ &= ~np.isnan(sim_)
+
+        ix_candidates = np.flatnonzero(mask_)
+        k_ = min(k, len(ix_candidates))
+        if k_ < len(ix_candidates):
+            ix_top_ = ix_candidates[np.argpartition(-sim_[ix_candidates], k_ - 1)[:k_]]
+        else:
+            ix_top_ = ix_candidates
+        ix_top_ = ix_top_[np.argsort(-sim_[ix_top_], kind='stable')]
+
+        return pd.Series(sim_[ix_top_], index=self.keys[ix_top_], name=a)
+
+
+#
+# ~ fin
+#
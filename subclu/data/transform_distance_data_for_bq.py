@@ -43,11 +43,14 @@ from subclu.utils.eda import reorder_array
 """
 from datetime import datetime
 from logging import info
-from typing import Tuple
+import tempfile
+from typing import Iterable, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
 from .data_loaders import LoadSubreddits
+from .similarity_matrix import save_similarity_matrix, upload_similarity_matrix
 from ..utils.eda import reorder_array
 
 
@@ -93,10 +96,21 @@ def reshape_distances_for_bigquery(
         col_manual_labels: str = 'manual_topic_and_rating',
         output_table_prefix: str = 'subreddit_distance_model_v002',
         top_subs_to_keep: int = 20,
+        full_pairs_format: str = 'parquet',
+        similarity_dtype: str = 'float16',
 ) -> Tuple[dict, pd.DataFrame, pd.DataFrame]:
     """Assumes we're always reading data from GCS
     Output in same location as distance matrix.
 
+    The top-only table is created from the similarity matrix with `argpartition`
+    (see `reshape_top_k_distances_to_pairwise_bq()`) instead of sorting all N^2 pairs.
+
+    full_pairs_format:
+        'parquet': save all N^2 pairs + metadata as a parquet file for a BigQuery table
+        'memmap': save the matrix as a `similarity_dtype` .npy file + index (much smaller)
+            & don't create the full pairs df (returns None for it).
+            Load it with `subclu.data.similarity_matrix.SimilarityMatrix.load()`
+
     # Testing values:
     path_distance_matrix = 'data/models/fse/manual_merge_2021-06-07_17/df_subs_similarity-name_index-167_by_167.parquet'
     path_outputs = 'data/models/fse/manual_merge_2021-06-07_17'
@@ -106,23 +120,15 @@ def reshape_distances_for_bigquery(
     output_table_prefix = 'subreddit_distance_model_v002'
     top_subs_to_keep = 20
     """
+    l_full_pairs_formats = ['parquet', 'memmap']
+    if full_pairs_format not in l_full_pairs_formats:
+        raise NotImplementedError(
+            f"full_pairs_format not implemented: {full_pairs_format}. Options: {l_full_pairs_formats}"
+        )
+
     info(f"Load distance matrix...")
     df_dist = pd.read_parquet(f"gs://{bucket_name}/{path_distance_matrix}")
 
-    # Reshape distances to pair-wise & rename columns
-    df_dist_pair = (
-        df_dist.unstack()
-        .reset_index()
-        .rename(
-            columns={'level_0': 'subreddit_name_a',
-                     'level_1': 'subreddit_name_b',
-                     0: 'cosine_distance',
-                     }
-        )
-        .sort_values(by=['subreddit_name_a', 'cosine_distance'], ascending=[True, False])
-    )
-    df_dist_pair = df_dist_pair[df_dist_pair['subreddit_name_a'] != df_dist_pair['subreddit_name_b']]
-
     info(f"Load subreddit metadata...")
     df_subs = LoadSubreddits(
         bucket_name=bucket_name,
@@ -131,77 +137,114 @@ def reshape_distances_for_bigquery(
         col_new_manual_topic=col_manual_labels,
     ).read_apply_transformations_and_merge_post_aggs()
 
-    # Merge meta with similarity dfs
-    # ===
-    info(f"Merge distance + metadata...")
-    l_meta_basic = [
-        'subreddit_name',
-        'subreddit_id',
-        col_manual_labels,
-        'German_posts_percent',
-        'post_median_word_count',
-    ]
-    df_dist_pair_meta = (
-        df_dist_pair
-        .merge(
-            df_subs[l_meta_basic].set_index('subreddit_name'),
-            left_on=['subreddit_name_a'],
-            right_index=True,
+    table_dt_stamp = datetime.utcnow().strftime('%Y%m%d')
+    d_map_file_meta = dict()
+
+    if full_pairs_format == 'parquet':
+        # Reshape distances to pair-wise & rename columns
+        df_dist_pair = (
+            df_dist.unstack()
+            .reset_index()
+            .rename(
+                columns={'level_0': 'subreddit_name_a',
+                         'level_1': 'subreddit_name_b',
+                         0: 'cosine_distance',
+                         }
+            )
+            .sort_values(by=['subreddit_name_a', 'cosine_distance'], ascending=[True, False])
         )
-        .merge(
-            df_subs[l_meta_basic].set_index('subreddit_name'),
-            left_on=['subreddit_name_b'],
-            right_index=True,
-            suffixes=('_a', '_b')
+        df_dist_pair = df_dist_pair[df_dist_pair['subreddit_name_a'] != df_dist_pair['subreddit_name_b']]
+
+        # Merge meta with similarity dfs
+        # ===
+        info(f"Merge distance + metadata...")
+        l_meta_basic = [
+            'subreddit_name',
+            'subreddit_id',
+            col_manual_labels,
+            'German_posts_percent',
+            'post_median_word_count',
+        ]
+        df_dist_pair_meta = (
+            df_dist_pair
+            .merge(
+                df_subs[l_meta_basic].set_index('subreddit_name'),
+                left_on=['subreddit_name_a'],
+                right_index=True,
+            )
+            .merge(
+                df_subs[l_meta_basic].set_index('subreddit_name'),
+                left_on=['subreddit_name_b'],
+                right_index=True,
+                suffixes=('_a', '_b')
+            )
+            .sort_values(by=['subreddit_name_a', 'cosine_distance'], ascending=[True, False])
         )
-        .sort_values(by=['subreddit_name_a', 'cosine_distance'], ascending=[True, False])
-    )
-    df_dist_pair_meta = df_dist_pair_meta[
-        reorder_array(
-            ['cosine_distance', 'subreddit_name_a', 'subreddit_name_b'],
-            sorted(df_dist_pair_meta.columns)
+        df_dist_pair_meta = df_dist_pair_meta[
+            reorder_array(
+                ['cosine_distance', 'subreddit_name_a', 'subreddit_name_b'],
+                sorted(df_dist_pair_meta.columns)
+            )
+        ]
+
+        shape_full = df_dist_pair_meta.shape
+        d_map_file_meta['df_dist_full'] = {
+            'table_name': f"{output_table_prefix}_full_{table_dt_stamp}",
+            'file_name': f"{path_outputs}/df_distance_pair_meta_full-{table_dt_stamp}-{shape_full[0]}_by_{shape_full[1]}.parquet",
+        }
+        # Bigquery will read the index as a column, so let's set our own rather than getting a weird
+        #  column like `__index_level_0__`
+        df_dist_pair_meta.set_index(['subreddit_id_a', 'subreddit_id_b']).to_parquet(
+            f"gs://{bucket_name}/{d_map_file_meta['df_dist_full']['file_name']}"
+        )
+        d_map_file_meta['df_dist_full']['sql'] = get_sql_to_create_table_from_parquet(
+            table_name=d_map_file_meta['df_dist_full']['table_name'],
+            file_path=d_map_file_meta['df_dist_full']['file_name'],
+            bucket_name=bucket_name,
+            data_format='PARQUET',
         )
-    ]
+
+    else:
+        info(f"Save similarity matrix as {similarity_dtype} memmap...")
+        df_dist_pair_meta = None
+        n_subs = len(df_dist)
+        d_map_file_meta['similarity_matrix'] = {
+            'file_name': f"{path_outputs}/similarity_matrix-{table_dt_stamp}-{n_subs}_by_{n_subs}",
+        }
+        df_index = (
+            pd.DataFrame({'subreddit_name': df_dist.index})
+            .merge(
+                df_subs[['subreddit_name', 'subreddit_id']].drop_duplicates(subset=['subreddit_name']),
+                how='left',
+                on='subreddit_name',
+            )
+        )
+        with tempfile.TemporaryDirectory() as path_tmp_:
+            save_similarity_matrix(
+                path_tmp_, similarity=df_dist, df_index=df_index, dtype=similarity_dtype,
+            )
+            upload_similarity_matrix(
+                path_tmp_, f"gs://{bucket_name}/{d_map_file_meta['similarity_matrix']['file_name']}"
+            )
 
     info(f"Create new df to keep only top {top_subs_to_keep} subs by distance...")
-    df_dist_pair_meta_top_only = (
-        df_dist_pair_meta
-        .sort_values(by=['cosine_distance'], ascending=False)
-        .groupby('subreddit_name_a')
-        .head(top_subs_to_keep)
-        .sort_values(by=['subreddit_name_a', 'cosine_distance'], ascending=[True, False])
+    df_dist_pair_meta_top_only = reshape_top_k_distances_to_pairwise_bq(
+        similarity=df_dist.to_numpy(),
+        subreddit_names=df_dist.index,
+        df_sub_metadata=df_subs,
+        col_new_manual_topic=col_manual_labels,
+        top_subs_to_keep=top_subs_to_keep,
+        set_index=False,
     )
 
-    shape_full = df_dist_pair_meta.shape
     shape_top = df_dist_pair_meta_top_only.shape
-    table_dt_stamp = datetime.utcnow().strftime('%Y%m%d')
-    d_map_file_meta = {
-        'df_dist_full': {
-            'table_name': f"{output_table_prefix}_full_{table_dt_stamp}",
-            'file_name': f"{path_outputs}/df_distance_pair_meta_full-{table_dt_stamp}-{shape_full[0]}_by_{shape_full[1]}.parquet",
-        },
-        'df_dist_top_only': {
-            'table_name': f"{output_table_prefix}_top_only_{table_dt_stamp}",
-            'file_name': f"{path_outputs}/df_distance_pair_meta_top_only-{table_dt_stamp}-{shape_top[0]}_by_{shape_top[1]}.parquet",
-        },
+    d_map_file_meta['df_dist_top_only'] = {
+        'table_name': f"{output_table_prefix}_top_only_{table_dt_stamp}",
+        'file_name': f"{path_outputs}/df_distance_pair_meta_top_only-{table_dt_stamp}-{shape_top[0]}_by_{shape_top[1]}.parquet",
     }
-
-    # Bigquery will read the index as a column, so let's set our own rather than getting a weird
-    #  column like `__index_level_0__`
-    df_dist_pair_meta.set_index(['subreddit_id_a', 'subreddit_id_b']).to_parquet(
-        f"gs://{bucket_name}/{d_map_file_meta['df_dist_full']['file_name']}"
-    )
     df_dist_pair_meta_top_only.set_index(['subreddit_id_a', 'subreddit_id_b']).to_parquet(
         f"gs://{bucket_name}/{d_map_file_meta['df_dist_top_only']['file_name']}"
     )
-
-    d_map_file_meta['df_dist_full']['sql'] = get_sql_to_create_table_from_parquet(
-        table_name=d_map_file_meta['df_dist_full']['table_name'],
-        file_path=d_map_file_meta['df_dist_full']['file_name'],
-        bucket_name=bucket_name,
-        data_format='PARQUET',
-    )
-
     d_map_file_meta['df_dist_top_only']['sql'] = get_sql_to_create_table_from_parquet(
         table_name=d_map_file_meta['df_dist_top_only']['table_name'],
         file_path=d_map_file_meta['df_dist_top_only']['file_name'],
@@ -209,7 +252,7 @@ def reshape_distances_for_bigquery(
         data_format='PARQUET',
     )
 
-    [print(d_['sql']) for d_ in d_map_file_meta.values()]
+    [print(d_['sql']) for d_ in d_map_file_meta.values() if 'sql' in d_]
 
     # TODO(djb) get permission to run sql from VM so I can update SQL from script
     return d_map_file_meta, df_dist_pair_meta, df_dist_pair_meta_top_only
@@ -221,6 +264,7 @@ def reshape_distances_to_pairwise_bq(
         col_new_manual_topic: str = 'manual_topic_and_rating',
         index_name: str = 'subreddit_name',
         top_subs_to_keep: int = 20,
+        method: str = 'unstack',
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     This function assumes that the distance and metadata dfs have already been loaded
@@ -228,10 +272,30 @@ def reshape_distances_to_pairwise_bq(
 
     This one is better suited for use in an mlflow job.
 
+    method:
+        'unstack': reshape all N^2 pairs, returns (all pairs, top pairs)
+        'top_k': only create the top pairs with `argpartition`, returns (None, top pairs).
+            Use it when we don't need all the pairs, it doesn't sort or merge N^2 rows
+
     NOTE:
     # Bigquery will read the index as a column, so let's set our own rather than getting a weird
     #  column like `__index_level_0__`
     """
+    if method == 'top_k':
+        info(f"Keep only top {top_subs_to_keep} subs by distance (argpartition)...")
+        df_dist_pair_top_only = reshape_top_k_distances_to_pairwise_bq(
+            similarity=df_distance_matrix.to_numpy(),
+            subreddit_names=df_distance_matrix.index,
+            df_sub_metadata=df_sub_metadata,
+            col_new_manual_topic=col_new_manual_topic,
+            index_name=index_name,
+            top_subs_to_keep=top_subs_to_keep,
+        )
+        info(f"  {df_dist_pair_top_only.shape} <- df_dist_pair_meta_top_only.shape")
+        return None, df_dist_pair_top_only
+    elif method != 'unstack':
+        raise NotImplementedError(f"method not implemented: {method}")
+
     # Rename index & column names, BEFORE .unstack() to prevent name collisions
     #  i.e., if they both have the same name, we'll get a ValueError
 
@@ -309,9 +373,161 @@ def reshape_distances_to_pairwise_bq(
         return df_dist_pair, df_dist_pair_top_only
 
 
+def get_top_k_similar_ix(
+        similarity: Union[np.ndarray, pd.DataFrame, Iterable[np.ndarray]],
+        top_subs_to_keep: int = 20,
+        block_size: int = 2048,
+        mask_candidates: np.ndarray = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Get the top-k most similar columns for each row of a square similarity matrix,
+    excluding the diagonal (self-similarity).
+
+    Args:
+        similarity: N x N array/df (can be a memmap), or an iterable of row blocks
+            (each block is n_rows x N, in row order). Blocks let us process matrices
+            that don't fit in memory.
+        top_subs_to_keep: k, number of columns to keep per row
+        block_size: rows to process at a time when `similarity` is an array
+        mask_candidates: optional boolean array (N), only keep columns where it's True
+
+    Returns:
+        ix_a: row index for each pair
+        ix_b: column index for each pair
+        sim: similarity for each pair (sorted descending within each row)
+
+    NaN similarities are ranked last but kept (same as sorting the unstacked pairs).
+    """
+    if isinstance(similarity, pd.DataFrame):
+        similarity = similarity.to_numpy()
+    if isinstance(similarity, np.ndarray):
+        l_blocks = (similarity[i_:i_ + block_size] for i_ in range(0, similarity.shape[0], block_size))
+    else:
+        l_blocks = similarity
+
+    l_ix_a, l_ix_b, l_sim = list(), list(), list()
+    row_offset = 0
+    for block_ in l_blocks:
+        block_ = np.asarray(block_)
+        n_rows_, n_cols_ = block_.shape
+        k_ = min(top_subs_to_keep, n_cols_ - 1)
+        if (n_rows_ == 0) or (k_ <= 0):
+            row_offset += n_rows_
+            continue
+
+        # Rank on the negative (float64 copy) so the top-k are the k smallest values.
+        #  NaN similarities rank after all values. Self & non-candidates are set to NaN
+        #  so they rank last, & we drop them if they make it into the top-k
+        neg_ranks_ = -np.array(block_, dtype=np.float64)
+        neg_ranks_[np.isnan(neg_ranks_)] = np.inf
+        if mask_candidates is not None:
+            neg_ranks_[:, ~mask_candidates] = np.nan
+        ix_self_ = np.arange(n_rows_) + row_offset
+        mask_diag_ = ix_self_ < n_cols_
+        neg_ranks_[np.arange(n_rows_)[mask_diag_], ix_self_[mask_diag_]] = np.nan
+
+        ix_top_ = np.argpartition(neg_ranks_, k_ - 1, axis=1)[:, :k_]
+        neg_ranks_top_ = np.take_along_axis(neg_ranks_, ix_top_, axis=1)
+        ix_sort_ = np.argsort(neg_ranks_top_, axis=1, kind='stable')
+        ix_top_ = np.take_along_axis(ix_top_, ix_sort_, axis=1)
+        mask_keep_ = ~np.isnan(np.take_along_axis(neg_ranks_top_, ix_sort_, axis=1))
+
+        l_ix_a.append(np.repeat(ix_self_, k_)[mask_keep_.ravel()])
+        l_ix_b.append(ix_top_[mask_keep_])
+        l_sim.append(np.take_along_axis(block_, ix_top_, axis=1)[mask_keep_])
+        row_offset += n_rows_
+
+    if not l_ix_a:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    return np.concatenate(l_ix_a), np.concatenate(l_ix_b), np.concatenate(l_sim)
+
+
+def reshape_top_k_distances_to_pairwise_bq(
+        similarity: Union[np.ndarray, pd.DataFrame, Iterable[np.ndarray]],
+        subreddit_names: Iterable,
+        df_sub_metadata: pd.DataFrame = None,
+        col_new_manual_topic: str = 'manual_topic_and_rating',
+        index_name: str = 'subreddit_name',
+        top_subs_to_keep: int = 20,
+        block_size: int = 2048,
+        set_index: bool = True,
+) -> pd.DataFrame:
+    """Same output as the top-only df from `reshape_distances_to_pairwise_bq()`, but
+    we never create the N^2 pairs:
+    1. select the top-k columns per row with argpartition (in blocks of rows)
+    2. attach names & metadata with integer takes (instead of merging N^2 rows twice)
+
+    Args:
+        similarity: N x N similarity matrix (array, df, memmap) or an iterable of row blocks
+        subreddit_names: names for the rows/columns of the matrix (same order)
+        df_sub_metadata: optional, metadata to append to both sides of each pair.
+            Like the merge in the unstack method, pairs where either side is missing
+            from the metadata are dropped.
+        set_index: set (subreddit_id_a, subreddit_id_b) as index for BigQuery
+    """
+    col_name_a = f'{index_name}_a'
+    col_name_b = f'{index_name}_b'
+    subreddit_names = np.asarray(subreddit_names)
+
+    df_meta_ = None
+    mask_candidates = None
+    if df_sub_metadata is not None:
+        l_meta_basic = [
+            'subreddit_name',
+            'subreddit_id',
+            col_new_manual_topic,
+            'German_posts_percent',
+            'post_median_word_count',
+        ]
+        l_meta_basic = [c for c in l_meta_basic if c in df_sub_metadata.columns]
+        df_meta_ = (
+            df_sub_metadata[l_meta_basic]
+            .drop_duplicates(subset=['subreddit_name'])
+            .reset_index(drop=True)
+        )
+        # Subs without metadata would get dropped by the merge before picking the top subs
+        ix_meta_ = pd.Index(df_meta_['subreddit_name']).get_indexer(subreddit_names)
+        mask_candidates = ix_meta_ != -1
+
+    ix_a, ix_b, sim = get_top_k_similar_ix(
+        similarity,
+        top_subs_to_keep=top_subs_to_keep,
+        block_size=block_size,
+        mask_candidates=mask_candidates,
+    )
+    if mask_candidates is not None:
+        mask_rows_ = mask_candidates[ix_a]
+        ix_a, ix_b, sim = ix_a[mask_rows_], ix_b[mask_rows_], sim[mask_rows_]
+
+    df_dist_pair = pd.DataFrame(
+        {
+            col_name_a: subreddit_names[ix_a],
+            col_name_b: subreddit_names[ix_b],
+            'cosine_distance': sim,
+        }
+    )
+
+    if df_meta_ is not None:
+        info(f"Append metadata to top pairs...")
+        for col_ in df_meta_.columns.drop('subreddit_name'):
+            df_dist_pair[f'{col_}_a'] = df_meta_[col_].take(ix_meta_[ix_a]).reset_index(drop=True)
+            df_dist_pair[f'{col_}_b'] = df_meta_[col_].take(ix_meta_[ix_b]).reset_index(drop=True)
+
+    df_dist_pair = df_dist_pair[
+        reorder_array(
+            ['cosine_distance', col_name_a, col_name_b],
+            sorted(df_dist_pair.columns)
+        )
+    ].sort_values(by=[col_name_a, 'cosine_distance'], ascending=[True, False])
+
+    if set_index and ('subreddit_id_a' in df_dist_pair.columns):
+        return df_dist_pair.set_index(['subreddit_id_a', 'subreddit_id_b'])
+    else:
+        return df_dist_pair
+
+
 # TODO(djb) make it a script to run from command line?
 
 
 #
-# ~fin
+# ~ fin
 #
@@ -15,7 +15,7 @@ from datetime import datetime, timedelta
 import logging
 import os
 from pathlib import Path
-from typing import Union
+from typing import Tuple, Union
 
 import joblib
 import mlflow
@@ -31,7 +31,7 @@ import pandas as pd
 import seaborn as sns
 from dask import dataframe as dd
 
-from scipy.cluster.hierarchy import fcluster, leaves_list
+from scipy.cluster.hierarchy import leaves_list
 from sklearn.pipeline import Pipeline
 
 from ..utils.tqdm_logger import LogTQDM
@@ -42,18 +42,24 @@ from ..utils.mlflow_logger import (
 )
 from ..utils import get_project_subfolder
 from ..utils.eda import elapsed_time
+from ..utils.embeddings_storage import iter_embeddings_parquet_chunks
 from ..data.data_loaders import LoadSubreddits  # , LoadPosts
 from ..utils.ml_metrics import (
-    log_precision_recall_fscore_support,
     log_classification_report_and_confusion_matrix,
 )
 from .clustering_utils import (
     create_linkage_for_dendrogram, fancy_dendrogram,
-    plot_elbow_and_get_k
+    plot_elbow_and_get_k, fcluster_multi_k,
+)
+from .clustering_metrics import evaluate_supervised_metrics_for_ks
+from .clustering_streaming import fit_pipeline_in_chunks
+from .clustering_reduce import CachedTransformer, PATH_REDUCE_CACHE
+from .clustering_sweep import (
+    get_shared_embeddings_path, is_shared_embeddings_ready, load_shared_embeddings,
+    PATH_SHARED_EMBEDDINGS,
 )
 from .clustering_registry import (
     D_CLUSTER_MODELS, D_CLUSTER_PIPELINE,
-    D_CLUSTER_METRICS_WITH_KNOWN_LABELS
 )
 
 
@@ -85,22 +91,7 @@ def cluster_embeddings(
     print(f"CFG keys: {cfg.keys()}")
 
     log.info(f"Define cluster class...")
-    cluster = ClusterEmbeddings(
-        data_embeddings_to_cluster=cfg['data_embeddings_to_cluster'],
-        clustering_algo=cfg['clustering_algo'],
-        data_text_and_metadata=cfg['data_text_and_metadata'],
-        embeddings_to_cluster=cfg['embeddings_to_cluster'],
-        mlflow_experiment_name=cfg['mlflow_experiment_name'],
-        mlflow_tracking_uri=cfg.get('mlflow_tracking_uri', 'sqlite'),
-        n_max_clusters_to_check_for_optimal_k=cfg.get('n_max_clusters_to_check_for_optimal_k', 2200),
-        n_sample_embedding_rows=cfg.get('n_sample_embedding_rows', None),
-        mlflow_run_name=(
-            f"{cfg.get('mlflow_run_name', 'embedding_clustering')}-{datetime.utcnow().strftime('%Y-%m-%d_%H%M%S')}"
-        ),
-        filter_embeddings=cfg.get('filter_embeddings', None),
-        pipeline_config=cfg.get('pipeline', cfg.get('pipeline_config', None)),
-        logs_path=cfg.get('logs_path', 'logs'),
-    )
+    cluster = ClusterEmbeddings(**get_cluster_embeddings_kwargs(cfg))
 
     cluster.run_clustering()
 
@@ -129,6 +120,33 @@ def cluster_embeddings(
     """
 
 
+def get_cluster_embeddings_kwargs(
+        cfg: DictConfig,
+) -> dict:
+    """Map the hydra config to ClusterEmbeddings kwargs.
+    Also used by the shared embeddings callback (parent process of a multirun).
+    """
+    return dict(
+        data_embeddings_to_cluster=cfg['data_embeddings_to_cluster'],
+        clustering_algo=cfg['clustering_algo'],
+        data_text_and_metadata=cfg['data_text_and_metadata'],
+        embeddings_to_cluster=cfg['embeddings_to_cluster'],
+        mlflow_experiment_name=cfg['mlflow_experiment_name'],
+        mlflow_tracking_uri=cfg.get('mlflow_tracking_uri', 'sqlite'),
+        n_max_clusters_to_check_for_optimal_k=cfg.get('n_max_clusters_to_check_for_optimal_k', 2200),
+        n_sample_embedding_rows=cfg.get('n_sample_embedding_rows', None),
+        mlflow_run_name=(
+            f"{cfg.get('mlflow_run_name', 'embedding_clustering')}-{datetime.utcnow().strftime('%Y-%m-%d_%H%M%S')}"
+        ),
+        filter_embeddings=cfg.get('filter_embeddings', None),
+        pipeline_config=cfg.get('pipeline', cfg.get('pipeline_config', None)),
+        logs_path=cfg.get('logs_path', 'logs'),
+        n_jobs_supervised_metrics=cfg.get('n_jobs_supervised_metrics', 4),
+        train_embeddings_in_chunks=cfg.get('train_embeddings_in_chunks', None),
+        shared_embeddings=cfg.get('shared_embeddings', None),
+    )
+
+
 class ClusterEmbeddings:
     """
     Class to orchestrate different strategies to cluster embeddings
@@ -151,9 +169,26 @@ class ClusterEmbeddings:
             logs_path: str = 'logs',
             col_model_leaves_order: str = 'model_sort_order',
             gcloud_project_id: str = "data-prod-165221",
+            n_jobs_supervised_metrics: int = 4,
+            train_embeddings_in_chunks: dict = None,
+            shared_embeddings: dict = None,
             # **kwargs
     ):
-        """"""
+        """
+        train_embeddings_in_chunks:
+            Set it to train the pipeline with partial_fit() on embeddings read in chunks
+            (e.g., post-level or user-level) instead of the `embeddings_to_cluster` matrix.
+            We still use `embeddings_to_cluster` to get the labels for each k.
+            Keys:
+            - embeddings_to_train: key in `data_embeddings_to_cluster` with the artifact folder
+            - run_uuid: (optional) mlflow run with the embeddings, default: data_embeddings_to_cluster run
+            - chunk_rows: (optional) max rows per chunk, default: 100,000
+
+        shared_embeddings:
+            For hydra multirun sweeps. If `enabled: true` & the parent process already saved
+            the embeddings (see `clustering_sweep.SharedEmbeddingsCallback`), attach to them
+            as a read-only memmap instead of loading & filtering them again in each job.
+        """
         self.data_embeddings_to_cluster = data_embeddings_to_cluster
         self.clustering_algo = clustering_algo
         self.data_text_and_metadata = data_text_and_metadata
@@ -180,6 +215,10 @@ class ClusterEmbeddings:
         self.df_accel = None
         self.optimal_ks = None
         self.col_model_leaves_order = col_model_leaves_order
+        self.n_jobs_supervised_metrics = n_jobs_supervised_metrics
+        self.train_embeddings_in_chunks = train_embeddings_in_chunks
+        self.shared_embeddings = shared_embeddings
+        self.X_embeddings_shared_ = None
 
         log.info(f"Setting google project ID: {gcloud_project_id}")
         # For some reason we've been getting errors from MLflow because it can't determine the project
@@ -212,25 +251,16 @@ class ClusterEmbeddings:
             self._create_pipeline()
 
             log.info(f"Loading embeddings...")
-            df_embeddings = self._load_embeddings()
-
-            if self.filter_embeddings is not None:
-                if any([
-                    self.filter_embeddings.get('filter_subreddits', False),
-                    self.filter_embeddings.get('filter_active_subreddits', False),
-                ]):
-                    df_subs = self._load_metadata_for_filtering(df_embeddings)
-
-                    df_embeddings = self._apply_filtering(
-                        df_embeddings=df_embeddings,
-                        df_subs=df_subs,
-                    )
+            df_embeddings, df_subs = self.load_and_filter_embeddings()
 
             log.info(f"-- Training clustering model --")
             t_start_model_fit = datetime.utcnow()
-            self.pipeline.fit(
-                df_embeddings[self.l_cols_embeddings]
-            )
+            if self.train_embeddings_in_chunks is not None:
+                self._fit_pipeline_in_chunks()
+            else:
+                self.pipeline.fit(
+                    self._get_embeddings_to_fit(df_embeddings)
+                )
             total_model_fit_time = elapsed_time(
                 start_time=t_start_model_fit,
                 log_label='Model fit() time', verbose=True
@@ -334,6 +364,17 @@ class ClusterEmbeddings:
                     else:
                         transformer_ = D_CLUSTER_PIPELINE[step_][trf_name]()
 
+                    # Cache the fitted step & its output so that sweeps over the same
+                    #  embeddings (e.g., only clustering params change) skip re-fitting it
+                    if self.pipeline_config[step_].get('cache', False):
+                        transformer_ = CachedTransformer(
+                            transformer_,
+                            cache_dir=self.pipeline_config[step_].get('cache_dir', PATH_REDUCE_CACHE),
+                            cache_key_prefix=(
+                                f"{self.data_embeddings_to_cluster['run_uuid']}-{self.embeddings_to_cluster}"
+                            ),
+                        )
+
                     self.pipeline.steps.insert(
                         0,
                         (step_, transformer_),
@@ -366,6 +407,90 @@ class ClusterEmbeddings:
             self.mlf.log_ram_stats(param=False, only_memory_used=True)
         return df_embeddings
 
+    def load_and_filter_embeddings(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Load embeddings & apply filters (if any)
+
+        Returns:
+            df_embeddings: with the shared embeddings, only the non-embedding cols,
+                the embeddings are in `self.X_embeddings_shared_`
+            df_subs: subreddit meta used for filtering (None if no filters)
+        """
+        if (self.shared_embeddings is not None) and self.shared_embeddings.get('enabled', False):
+            path_shared_ = get_shared_embeddings_path(
+                data_embeddings_to_cluster=self.data_embeddings_to_cluster,
+                embeddings_to_cluster=self.embeddings_to_cluster,
+                n_sample_embedding_rows=self.n_sample_embedding_rows,
+                filter_embeddings=self.filter_embeddings,
+                shared_dir=self.shared_embeddings.get('shared_dir', PATH_SHARED_EMBEDDINGS),
+            )
+            if is_shared_embeddings_ready(path_shared_):
+                log.info(f"  Attaching to shared embeddings:\n  {path_shared_}")
+                df_embeddings, self.X_embeddings_shared_, self.l_cols_embeddings, df_subs = (
+                    load_shared_embeddings(path_shared_)
+                )
+                self.l_ix_subs = ['subreddit_name', 'subreddit_id']
+                self.l_ix_post = ['subreddit_name', 'subreddit_id', 'post_id']
+
+                r_, c_ = self.X_embeddings_shared_.shape
+                log.info(f"{r_:9,.0f} | {c_:5,.0f} <- Shared embeddings SHAPE")
+                if mlflow.active_run() is not None:
+                    mlflow.log_metrics(
+                        {'filtered_embeddings-n_rows': r_,
+                         'filtered_embeddings-n_cols': c_}
+                    )
+                    mlflow.log_param('shared_embeddings_path', str(path_shared_))
+                return df_embeddings, df_subs
+            else:
+                log.warning(f"  Shared embeddings not found, loading embeddings in this job:\n  {path_shared_}")
+
+        df_embeddings = self._load_embeddings()
+
+        df_subs = None
+        if self.filter_embeddings is not None:
+            if any([
+                self.filter_embeddings.get('filter_subreddits', False),
+                self.filter_embeddings.get('filter_active_subreddits', False),
+            ]):
+                df_subs = self._load_metadata_for_filtering(df_embeddings)
+
+                df_embeddings = self._apply_filtering(
+                    df_embeddings=df_embeddings,
+                    df_subs=df_subs,
+                )
+        return df_embeddings, df_subs
+
+    def _get_embeddings_to_fit(
+            self,
+            df_embeddings: pd.DataFrame,
+    ) -> Union[pd.DataFrame, np.ndarray]:
+        """Use the shared memmap when we have it, so we don't copy the embeddings"""
+        if self.X_embeddings_shared_ is not None:
+            return self.X_embeddings_shared_
+        return df_embeddings[self.l_cols_embeddings]
+
+    def _fit_pipeline_in_chunks(self):
+        """Download the embeddings to train on & fit the pipeline one chunk at a time"""
+        d_train_ = self.train_embeddings_in_chunks
+        chunk_rows_ = d_train_.get('chunk_rows', 100000)
+        l_files_ = self.mlf.read_run_artifact(
+            run_id=d_train_.get('run_uuid', None) or self.data_embeddings_to_cluster['run_uuid'],
+            artifact_folder=self.data_embeddings_to_cluster[d_train_['embeddings_to_train']],
+            read_function='parquet_files',
+            cache_locally=True,
+        )
+        log.info(f"  Training in chunks of {chunk_rows_:,.0f} rows from {len(l_files_):,.0f} files")
+        if mlflow.active_run() is not None:
+            mlflow.log_params(
+                {'train_in_chunks-embeddings': d_train_['embeddings_to_train'],
+                 'train_in_chunks-chunk_rows': chunk_rows_}
+            )
+
+        def get_chunks():
+            for _, X_ in iter_embeddings_parquet_chunks(l_files_, chunk_rows=chunk_rows_):
+                yield X_
+
+        fit_pipeline_in_chunks(self.pipeline, get_chunks)
+
     def _load_metadata_for_filtering(
             self,
             df_embeddings: pd.DataFrame,
@@ -658,21 +783,43 @@ class ClusterEmbeddings:
                 .copy()
             )
 
+        # When the model's leaves are pre-clusters (not rows), map each row to its leaf
+        arr_row_leaves = None
+        model_ = self.pipeline.steps[-1][1]
+        if hasattr(model_, 'predict_leaves'):
+            log.info(f"  Get the model leaf (pre-cluster) for each row...")
+            X_ = np.asarray(self._get_embeddings_to_fit(df_embeddings))
+            for _, step_ in self.pipeline.steps[:-1]:
+                X_ = step_.transform(X_)
+            arr_row_leaves = model_.predict_leaves(X_)
+            del X_
+
         try:
             log.info(f"  Add the model's sort order (distances) to df_labels")
-            # NOTE: this join assumes that we've reset_index for df_labels_ before joining
-            df_leaves_order = pd.DataFrame(
-                {
-                    self.col_model_leaves_order: range(len(self.df_labels_))
-                },
-                index=leaves_list(self.X_linkage),
-            )
-            self.df_labels_ = df_leaves_order.merge(
-                self.df_labels_,
-                how='right',
-                left_index=True,
-                right_index=True,
-            )
+            if arr_row_leaves is None:
+                # NOTE: this join assumes that we've reset_index for df_labels_ before joining
+                df_leaves_order = pd.DataFrame(
+                    {
+                        self.col_model_leaves_order: range(len(self.df_labels_))
+                    },
+                    index=leaves_list(self.X_linkage),
+                )
+                self.df_labels_ = df_leaves_order.merge(
+                    self.df_labels_,
+                    how='right',
+                    left_index=True,
+                    right_index=True,
+                )
+            else:
+                # rows in the same leaf keep their input order
+                arr_leaves_ = leaves_list(self.X_linkage)
+                arr_leaf_rank = np.empty(len(arr_leaves_), dtype=np.int64)
+                arr_leaf_rank[arr_leaves_] = np.arange(len(arr_leaves_))
+                arr_sort_order = np.empty(len(arr_row_leaves), dtype=np.int64)
+                arr_sort_order[np.argsort(arr_leaf_rank[arr_row_leaves], kind='stable')] = (
+                    np.arange(len(arr_row_leaves))
+                )
+                self.df_labels_.insert(0, self.col_model_leaves_order, arr_sort_order)
         except Exception as e:
             log.error(f"Failed to append model leaves order\n  {e}")
 
@@ -711,18 +858,26 @@ class ClusterEmbeddings:
         log.info(f"Get cluster IDs for each designated k...")
         label_col_prefix = 'k_'
         label_col_suffix = '_label'
-        for k_ in LogTQDM(sorted(s_k_to_evaluate)):
-            self.df_labels_[f"{label_col_prefix}{k_:04d}{label_col_suffix}"] = fcluster(self.X_linkage, k_, criterion='maxclust')
+        l_k_to_evaluate = sorted(s_k_to_evaluate)
+        arr_k_labels = fcluster_multi_k(self.X_linkage, l_k_to_evaluate)
+        if arr_row_leaves is not None:
+            arr_k_labels = arr_k_labels[arr_row_leaves]
+        self.df_labels_ = pd.concat(
+            [
+                self.df_labels_,
+                pd.DataFrame(
+                    arr_k_labels,
+                    columns=[f"{label_col_prefix}{k_:04d}{label_col_suffix}" for k_ in l_k_to_evaluate],
+                    index=self.df_labels_.index,
+                )
+            ],
+            axis=1,
+        )
 
         log.info(self.df_labels_.shape)
 
         if df_subs is not None:
             # get named labels for each of the cols in l_cols_ground_truth
-            d_df_crosstab_labels = dict()
-            d_metrics = dict()
-            l_cols_predicted = list()
-            l_metrics_for_df = list()
-
             log.info(f"-- Get true labels & metrics --")
             # use list of optimal k's to log
             d_optimal_ks_lookup = dict()
@@ -735,123 +890,59 @@ class ClusterEmbeddings:
             folder_classifxn_ = 'df_classification_reports'
             folder_classifxn_full_ = self.path_local_model / folder_classifxn_
 
-            for col_cls_labels in LogTQDM(
-                    [c for c in self.df_labels_.columns if c.endswith(label_col_suffix)],
+            # Get majority topic & metrics for all k's at once (int codes + bincount)
+            #  then only log artifacts & mlflow metrics for optimal k's here
+            df_majority_labels, d_df_crosstab_labels, l_metrics_for_df = evaluate_supervised_metrics_for_ks(
+                self.df_labels_,
+                l_cols_labels=[c for c in self.df_labels_.columns if c.endswith(label_col_suffix)],
+                l_cols_ground_truth=l_cols_ground_truth,
+                label_col_prefix=label_col_prefix,
+                label_col_suffix=label_col_suffix,
+                beta=1,
+                n_jobs=self.n_jobs_supervised_metrics,
+            )
+            self.df_labels_ = pd.concat([self.df_labels_, df_majority_labels], axis=1)
+
+            for d_metrics_this_split in LogTQDM(
+                    l_metrics_for_df,
                     mininterval=.8,
-                    desc='select k-values',
+                    desc='log optimal k-values',
             ):
-                k_int = int(col_cls_labels.replace(label_col_suffix, '').replace(label_col_prefix, ''))
-                k_col_prefix = col_cls_labels.replace(label_col_suffix, '')
-                # log.info(f"  k: {k_col_prefix}")
-
-                d_df_crosstab_labels[col_cls_labels] = dict()
-                d_metrics[col_cls_labels] = dict()
-
-                for c_tl in l_cols_ground_truth:
-                    # to be on the safe side, sometimes nulls are filled as "null"
-                    mask_not_null_gt = ~(
-                            (self.df_labels_[c_tl].isnull()) |
-                            (self.df_labels_[c_tl] == 'null')
-                    )
-                    d_df_crosstab_labels[col_cls_labels][c_tl] = pd.crosstab(
-                        self.df_labels_[mask_not_null_gt][col_cls_labels],
-                        self.df_labels_[mask_not_null_gt][c_tl]
-                    )
-
-                    # Create new predicted column
-                    col_pred_ = f"{k_col_prefix}_majority_{c_tl}"
-                    l_cols_predicted.append(col_pred_)
-                    self.df_labels_ = self.df_labels_.merge(
-                        (
-                            d_df_crosstab_labels[col_cls_labels][c_tl]
-                            .idxmax(axis=1)
-                            .to_frame()
-                            .rename(columns={0: col_pred_})
-                        ),
-                        how='left',
-                        left_on=col_cls_labels,
-                        right_index=True,
-                    )
-
-                    # Should be rare, but fill just in case?
-                    # self.df_labels_[col_pred_] = self.df_labels_[col_pred_].fillna(val_fill_pred_nulls)
-
-                    # store metrics for this k in this dict & combine all of them in a df later
-                    d_metrics_this_split = {
-                        'predicted_col': col_cls_labels,
-                        'truth_col': c_tl,
-                        'k': k_int,
-                    }
-                    # =====================
-                    # Classification report
-                    # ===
-                    # Save confusion matrices & per-class metrics only for optimal K's
-                    if k_int in d_optimal_ks_lookup.keys():
-                        data_fold_name_ = f"{c_tl}-{d_optimal_ks_lookup[k_int]}"
-                        log_clf_metrics_to_mlflow_ = True
-                        log_classification_report_and_confusion_matrix(
-                            y_true=self.df_labels_[mask_not_null_gt][c_tl],
-                            y_pred=self.df_labels_[mask_not_null_gt][col_pred_],
-                            data_fold_name=f"{c_tl}-{d_optimal_ks_lookup[k_int]}-{k_int}",
-                            beta=1,
-                            class_labels=None,
-                            sort_labels_by_support=True,
-                            save_path=folder_classifxn_full_,
-                            log_metrics_to_console=False,
-                            log_df_to_console=False,
-                            log_metrics_to_mlflow=False,
-                            log_artifacts_to_mlflow=False,
-                            log_support_avg=True,
-                            log_support_per_class=True,
-                        )
-                    else:
-                        data_fold_name_ = f"{c_tl}-{k_int}"
-                        log_clf_metrics_to_mlflow_ = False
-
-                    # Save aggregate classification scores for all K's so we can compare & plot them
-                    #  Only log to mlflow optimal k's (see check above)
-                    d_metrics_this_split.update(
-                        log_precision_recall_fscore_support(
-                            y_true=self.df_labels_[mask_not_null_gt][c_tl],
-                            y_pred=self.df_labels_[mask_not_null_gt][col_pred_],
-                            data_fold_name=data_fold_name_,
-                            append_fold_name_as_metric_prefix=True,
-                            beta=1,
-                            average='macro_and_weighted',
-                            class_labels=None,
-                            save_path=None,
-                            log_metrics_to_console=False,
-                            log_metrics_to_mlflow=log_clf_metrics_to_mlflow_,
-                            log_artifacts_to_mlflow=False,
-                            log_df_to_console=False,
-                            log_support=False,
-                            output_dict=True,
-                            append_fold_name_to_output_dict=False,
-                        )
-                    )
+                k_int = d_metrics_this_split['k']
+                if k_int not in d_optimal_ks_lookup.keys():
+                    continue
+                c_tl = d_metrics_this_split['truth_col']
+                k_col_prefix = d_metrics_this_split['predicted_col'].replace(label_col_suffix, '')
+                col_pred_ = f"{k_col_prefix}_majority_{c_tl}"
+                data_fold_name_ = f"{c_tl}-{d_optimal_ks_lookup[k_int]}"
+
+                # Save confusion matrices & per-class metrics only for optimal K's
+                mask_not_null_gt = ~(
+                        (self.df_labels_[c_tl].isnull()) |
+                        (self.df_labels_[c_tl] == 'null')
+                )
+                log_classification_report_and_confusion_matrix(
+                    y_true=self.df_labels_[mask_not_null_gt][c_tl],
+                    y_pred=self.df_labels_[mask_not_null_gt][col_pred_],
+                    data_fold_name=f"{c_tl}-{d_optimal_ks_lookup[k_int]}-{k_int}",
+                    beta=1,
+                    class_labels=None,
+                    sort_labels_by_support=True,
+                    save_path=folder_classifxn_full_,
+                    log_metrics_to_console=False,
+                    log_df_to_console=False,
+                    log_metrics_to_mlflow=False,
+                    log_artifacts_to_mlflow=False,
+                    log_support_avg=True,
+                    log_support_per_class=True,
+                )
 
-                    # ===============
-                    # Other metrics
-                    # ===
-                    for m_name, metric_ in D_CLUSTER_METRICS_WITH_KNOWN_LABELS.items():
-                        try:
-                            d_metrics_this_split[m_name] = metric_(
-                                y_true=self.df_labels_[mask_not_null_gt][c_tl],
-                                y_pred=self.df_labels_[mask_not_null_gt][col_pred_],
-                            )
-                        except TypeError:
-                            d_metrics_this_split[m_name] = metric_(
-                                labels_true=self.df_labels_[mask_not_null_gt][c_tl],
-                                labels_pred=self.df_labels_[mask_not_null_gt][col_pred_],
-                            )
-
-                        # Only log to MLflow metrics for optimal Ks
-                        if k_int in d_optimal_ks_lookup.keys():
-                            mlflow.log_metric(
-                                f"{c_tl}-{d_optimal_ks_lookup[k_int]}-{m_name}",
-                                d_metrics_this_split[m_name]
-                            )
-                    l_metrics_for_df.append(d_metrics_this_split)
+                # Only log to MLflow metrics for optimal Ks. Names match the previous job:
+                #  e.g., primary_topic-0050_to_0060-precision-macro_avg
+                #  e.g., primary_topic-0050_to_0060-adjusted_rand_score
+                for m_name, val_ in d_metrics_this_split.items():
+                    if m_name not in ['predicted_col', 'truth_col', 'k']:
+                        mlflow.log_metric(f"{data_fold_name_}-{m_name}", val_)
 
             self.df_supervised_metrics_ = pd.DataFrame(l_metrics_for_df)
             log.info(f"{self.df_supervised_metrics_.shape} <- df_supervised metrics shape")
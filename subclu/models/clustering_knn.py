@@ -0,0 +1,270 @@
+"""
+Hierarchical clustering that scales past ~50-80k rows.
+
+Plain `AgglomerativeClustering` (ward) computes merges over a dense problem, so
+memory & time grow with N^2. Here we:
+1. Build a sparse kNN connectivity graph, either:
+    - exact: blocked brute-force in float32 (each block only needs block_rows x N memory)
+    - annoy: approximate neighbors with the ANN index in `nn_annoy.py`
+2. Run connectivity-constrained ward, so merges are only evaluated between neighbors
+
+The model still exposes `children_`, `distances_`, `labels_` & `n_leaves_`, so
+`create_linkage_for_dendrogram()`, `fcluster()` and the elbow plots keep working.
+"""
+import logging
+from logging import info
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from sklearn.base import BaseEstimator, ClusterMixin
+from sklearn.cluster import AgglomerativeClustering
+
+
+log = logging.getLogger(__name__)
+
+L_KNN_METHODS = ['exact', 'annoy']
+
+
+def get_knn_exact_blocked(
+        X: np.ndarray,
+        n_neighbors: int = 30,
+        metric: str = 'cosine',
+        block_rows: int = 1024,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact kNN with brute force, one block of rows at a time.
+
+    Peak extra memory is ~(block_rows x N) float32 instead of N x N.
+    Self-matches are excluded.
+
+    Returns:
+        (ind, dist): int32 & float32 arrays with shape (N, n_neighbors),
+        sorted from closest to farthest neighbor
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    n_rows = X.shape[0]
+    n_neighbors = min(n_neighbors, n_rows - 1)
+
+    if metric == 'cosine':
+        norms_ = np.linalg.norm(X, axis=1, keepdims=True)
+        norms_[norms_ == 0] = 1
+        X = X / norms_
+    elif metric == 'euclidean':
+        sq_norms = np.einsum('ij,ij->i', X, X)
+    else:
+        raise NotImplementedError(f"kNN metric not implemented: {metric}")
+
+    ind = np.empty((n_rows, n_neighbors), dtype=np.int32)
+    dist = np.empty((n_rows, n_neighbors), dtype=np.float32)
+    for start_ in range(0, n_rows, block_rows):
+        end_ = min(start_ + block_rows, n_rows)
+        ix_block = np.arange(start_, end_)
+
+        # distance-like score where smaller = closer
+        if metric == 'cosine':
+            d_block = 1 - (X[start_:end_] @ X.T)
+        else:
+            d_block = (
+                sq_norms[start_:end_, None] + sq_norms[None, :] -
+                2 * (X[start_:end_] @ X.T)
+            )
+            np.maximum(d_block, 0, out=d_block)
+        d_block[ix_block - start_, ix_block] = np.inf
+
+        # argpartition is O(N) per row, then we only sort the k candidates
+        ind_block = np.argpartition(d_block, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        d_block = np.take_along_axis(d_block, ind_block, axis=1)
+        order_ = np.argsort(d_block, axis=1)
+
+        ind[start_:end_] = np.take_along_axis(ind_block, order_, axis=1)
+        dist[start_:end_] = np.take_along_axis(d_block, order_, axis=1)
+
+    if metric == 'euclidean':
+        np.sqrt(dist, out=dist)
+    return ind, dist
+
+
+def get_knn_annoy(
+        X: np.ndarray,
+        n_neighbors: int = 30,
+        metric: str = 'cosine',
+        n_trees: int = 100,
+        search_k: int = -1,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Approximate kNN with the ANNOY index we use for FPRs & similar subreddits.
+    Self-matches are excluded.
+    """
+    from .nn_annoy import AnnoyIndex
+
+    d_metrics = {'cosine': 'angular', 'euclidean': 'euclidean'}
+    if metric not in d_metrics:
+        raise NotImplementedError(f"kNN metric not implemented for annoy: {metric}")
+
+    n_rows = X.shape[0]
+    n_neighbors = min(n_neighbors, n_rows - 1)
+    df_vectors = pd.DataFrame(np.asarray(X, dtype=np.float32), copy=False)
+    df_vectors.columns = [f"embeddings_{c}" for c in df_vectors.columns]
+    df_vectors['row_ix'] = np.arange(n_rows)
+
+    annoy_ix = AnnoyIndex(
+        df_vectors,
+        index_cols=['row_ix'],
+        metric=d_metrics[metric],
+        n_trees=n_trees,
+    )
+    annoy_ix.build()
+
+    ind = np.empty((n_rows, n_neighbors), dtype=np.int32)
+    dist = np.empty((n_rows, n_neighbors), dtype=np.float32)
+    for i in range(n_rows):
+        # ask for extra neighbors in case self isn't returned first (ties)
+        l_ix, l_dist = annoy_ix.index.get_nns_by_item(
+            i, n_neighbors + 1, search_k=search_k, include_distances=True,
+        )
+        l_nn = [(j, d) for j, d in zip(l_ix, l_dist) if j != i][:n_neighbors]
+        n_found = len(l_nn)
+        ind[i, :n_found] = [j for j, _ in l_nn]
+        dist[i, :n_found] = [d for _, d in l_nn]
+        if n_found < n_neighbors:
+            # annoy can return fewer items with small search_k. Point to self,
+            #  self-loops get dropped when we build the graph
+            ind[i, n_found:] = i
+            dist[i, n_found:] = np.inf
+    return ind, dist
+
+
+def build_knn_connectivity_graph(
+        X: np.ndarray,
+        n_neighbors: int = 30,
+        knn_method: str = 'exact',
+        metric: str = 'cosine',
+        block_rows: int = 1024,
+        annoy_n_trees: int = 100,
+        annoy_search_k: int = -1,
+        verbose: bool = False,
+) -> sparse.csr_matrix:
+    """Create a symmetric sparse kNN connectivity matrix (no self-loops).
+    Symmetric because ward only merges clusters that are connected in the graph,
+    and A->B should allow the same merge as B->A.
+    """
+    if knn_method == 'exact':
+        ind, _ = get_knn_exact_blocked(X, n_neighbors=n_neighbors, metric=metric, block_rows=block_rows)
+    elif knn_method == 'annoy':
+        ind, _ = get_knn_annoy(
+            X, n_neighbors=n_neighbors, metric=metric,
+            n_trees=annoy_n_trees, search_k=annoy_search_k,
+        )
+    else:
+        raise NotImplementedError(f"knn_method not implemented: {knn_method}. Options: {L_KNN_METHODS}")
+
+    n_rows = X.shape[0]
+    rows_ = np.repeat(np.arange(n_rows, dtype=np.int32), ind.shape[1])
+    cols_ = ind.ravel()
+    mask_no_self = rows_ != cols_
+    graph_ = sparse.csr_matrix(
+        (np.ones(mask_no_self.sum(), dtype=np.int8), (rows_[mask_no_self], cols_[mask_no_self])),
+        shape=(n_rows, n_rows),
+    )
+    graph_ = graph_.maximum(graph_.T).tocsr()
+
+    if verbose:
+        n_components, _ = connected_components(graph_, directed=False)
+        info(f"  kNN graph: {n_rows:,.0f} nodes, {graph_.nnz:,.0f} edges, {n_components:,.0f} components")
+    return graph_
+
+
+class KNNGraphAgglomerativeClustering(BaseEstimator, ClusterMixin):
+    """Connectivity-constrained AgglomerativeClustering on a kNN graph.
+
+    Use it like AgglomerativeClustering from the clustering config (clustering_registry).
+    Set `knn_method='annoy'` for large inputs where even the blocked exact kNN is too slow.
+
+    Ward merge heights can have small inversions when merges are restricted to a graph.
+    scipy's `fcluster()` & `dendrogram()` expect monotonic heights, so by default
+    we store the cumulative max of the distances (merge order stays the same).
+    """
+    def __init__(
+            self,
+            n_clusters: int = 2,
+            affinity: str = 'euclidean',
+            linkage: str = 'ward',
+            compute_full_tree: bool = True,
+            compute_distances: bool = True,
+            distance_threshold: float = None,
+            n_neighbors: int = 30,
+            knn_method: str = 'exact',
+            knn_metric: str = 'cosine',
+            knn_block_rows: int = 1024,
+            annoy_n_trees: int = 100,
+            annoy_search_k: int = -1,
+            monotonic_distances: bool = True,
+            memory=None,
+            verbose: bool = True,
+    ):
+        self.n_clusters = n_clusters
+        self.affinity = affinity
+        self.linkage = linkage
+        self.compute_full_tree = compute_full_tree
+        self.compute_distances = compute_distances
+        self.distance_threshold = distance_threshold
+        self.n_neighbors = n_neighbors
+        self.knn_method = knn_method
+        self.knn_metric = knn_metric
+        self.knn_block_rows = knn_block_rows
+        self.annoy_n_trees = annoy_n_trees
+        self.annoy_search_k = annoy_search_k
+        self.monotonic_distances = monotonic_distances
+        self.memory = memory
+        self.verbose = verbose
+
+    def fit(self, X, y=None):
+        X = np.asarray(X)
+        if self.verbose:
+            info(f"  Building kNN graph with method={self.knn_method}, k={self.n_neighbors}...")
+        self.connectivity_ = build_knn_connectivity_graph(
+            X,
+            n_neighbors=self.n_neighbors,
+            knn_method=self.knn_method,
+            metric=self.knn_metric,
+            block_rows=self.knn_block_rows,
+            annoy_n_trees=self.annoy_n_trees,
+            annoy_search_k=self.annoy_search_k,
+            verbose=self.verbose,
+        )
+
+        if self.verbose:
+            info(f"  Fitting connectivity-constrained {self.linkage} clustering...")
+        # sklearn joins disconnected components (with a warning) so we always get a full tree
+        model_ = AgglomerativeClustering(
+            n_clusters=self.n_clusters,
+            affinity=self.affinity,
+            memory=self.memory,
+            connectivity=self.connectivity_,
+            compute_full_tree=self.compute_full_tree,
+            linkage=self.linkage,
+            distance_threshold=self.distance_threshold,
+            compute_distances=self.compute_distances,
+        ).fit(X)
+
+        self.children_ = model_.children_
+        self.labels_ = model_.labels_
+        self.n_leaves_ = model_.n_leaves_
+        self.n_clusters_ = model_.n_clusters_
+        self.n_connected_components_ = model_.n_connected_components_
+        self.n_features_in_ = X.shape[1]
+        if hasattr(model_, 'distances_'):
+            if self.monotonic_distances:
+                self.distances_ = np.maximum.accumulate(model_.distances_)
+            else:
+                self.distances_ = model_.distances_
+        return self
+
+    def fit_predict(self, X, y=None):
+        return self.fit(X).labels_
+
+
+#
+# ~ fin
+#
@@ -0,0 +1,321 @@
+"""
+Supervised metrics for cluster labels at many k-values.
+
+For each k we compare the "majority topic" of each cluster against the ground truth
+(e.g., primary_topic). Instead of building a pd.crosstab, merging predictions back
+into df_labels & calling sklearn metrics with string labels for each k, we:
+- encode cluster labels & ground truth as int codes once
+- build each contingency table with a single `np.bincount()` on combined codes
+- derive majority topic, precision/recall/f1, AMI, ARI & homogeneity from the tables
+- spread k-values over a process pool
+
+Metric names & values match what we got from `log_precision_recall_fscore_support()`
+and `D_CLUSTER_METRICS_WITH_KNOWN_LABELS`.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import logging
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import adjusted_mutual_info_score, mutual_info_score
+
+from .clustering_registry import D_CLUSTER_METRICS_WITH_KNOWN_LABELS
+
+
+log = logging.getLogger(__name__)
+
+
+def get_contingency_table(
+        codes_a: np.ndarray,
+        codes_b: np.ndarray,
+        n_a: int,
+        n_b: int,
+) -> np.ndarray:
+    """(n_a x n_b) table of counts for each pair of int codes"""
+    return np.bincount(
+        codes_a.astype(np.int64) * n_b + codes_b,
+        minlength=n_a * n_b,
+    ).reshape(n_a, n_b)
+
+
+def _trim_contingency(contingency: np.ndarray) -> np.ndarray:
+    """Drop empty rows & columns, sklearn only counts labels that are present"""
+    return contingency[contingency.sum(axis=1) > 0][:, contingency.sum(axis=0) > 0]
+
+
+def get_labels_from_contingency(contingency: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverse of a contingency table: one (true, predicted) pair of codes per sample"""
+    ix_true, ix_pred = np.nonzero(contingency)
+    counts_ = contingency[ix_true, ix_pred].astype(np.int64)
+    return np.repeat(ix_true, counts_), np.repeat(ix_pred, counts_)
+
+
+def _entropy_from_counts(counts: np.ndarray) -> float:
+    counts = counts[counts > 0]
+    n_ = counts.sum()
+    if n_ == 0:
+        return 1.0
+    p_ = counts / n_
+    return float(-np.sum(p_ * np.log(p_)))
+
+
+def adjusted_rand_score_from_contingency(contingency: np.ndarray) -> float:
+    """Same output as `adjusted_rand_score()`; rows: true labels, cols: predicted labels"""
+    contingency = _trim_contingency(contingency)
+    n_samples = contingency.sum()
+    n_classes, n_clusters = contingency.shape
+    if (
+            (n_classes == n_clusters == 1) or
+            (n_classes == n_clusters == 0) or
+            (n_classes == n_clusters == n_samples)
+    ):
+        return 1.0
+
+    def _comb2(x):
+        x = np.asarray(x, dtype=np.float64)
+        return x * (x - 1) / 2
+
+    sum_comb = _comb2(contingency).sum()
+    sum_comb_c = _comb2(contingency.sum(axis=1)).sum()
+    sum_comb_k = _comb2(contingency.sum(axis=0)).sum()
+    prod_comb = (sum_comb_c * sum_comb_k) / _comb2(n_samples)
+    mean_comb = (sum_comb_k + sum_comb_c) / 2.
+    if mean_comb == prod_comb:
+        return 1.0
+    return float((sum_comb - prod_comb) / (mean_comb - prod_comb))
+
+
+def homogeneity_score_from_contingency(contingency: np.ndarray) -> float:
+    """Same output as `homogeneity_score()`; rows: true labels, cols: predicted labels"""
+    contingency = _trim_contingency(contingency)
+    if contingency.size == 0:
+        return 1.0
+    entropy_c = _entropy_from_counts(contingency.sum(axis=1))
+    if entropy_c == 0:
+        return 1.0
+    mi_ = mutual_info_score(None, None, contingency=contingency.astype(np.float64))
+    return float(mi_ / entropy_c)
+
+
+def adjusted_mutual_info_score_from_contingency(contingency: np.ndarray) -> float:
+    """Same output as `adjusted_mutual_info_score(average_method='arithmetic')`
+    rows: true labels, cols: predicted labels
+    """
+    try:
+        # The expected MI calculation isn't public in sklearn, but it's what AMI calls internally
+        from sklearn.metrics.cluster._expected_mutual_info_fast import expected_mutual_information
+    except ImportError:
+        # If the private module moves, rebuild the labels & call the public function (slower)
+        return float(adjusted_mutual_info_score(*get_labels_from_contingency(contingency)))
+
+    contingency = _trim_contingency(contingency)
+    n_classes, n_clusters = contingency.shape
+    if (n_classes == n_clusters == 1) or (n_classes == n_clusters == 0):
+        return 1.0
+
+    contingency = contingency.astype(np.float64)
+    n_samples = int(contingency.sum())
+    mi_ = mutual_info_score(None, None, contingency=contingency)
+    emi_ = expected_mutual_information(contingency, n_samples)
+    h_true = _entropy_from_counts(contingency.sum(axis=1))
+    h_pred = _entropy_from_counts(contingency.sum(axis=0))
+    normalizer = np.mean([h_true, h_pred])
+    denominator = normalizer - emi_
+    eps = np.finfo('float64').eps
+    if denominator < 0:
+        denominator = min(denominator, -eps)
+    else:
+        denominator = max(denominator, eps)
+    return float((mi_ - emi_) / denominator)
+
+
+# Metrics that we can get straight from the contingency tables.
+#  Metrics in D_CLUSTER_METRICS_WITH_KNOWN_LABELS that aren't here are computed on int codes
+D_CLUSTER_METRICS_FROM_CONTINGENCY = {
+    'adjusted_mutual_info_score': adjusted_mutual_info_score_from_contingency,
+    'adjusted_rand_score': adjusted_rand_score_from_contingency,
+    'homogeneity_score': homogeneity_score_from_contingency,
+}
+
+
+def precision_recall_fscore_from_contingency(
+        contingency: np.ndarray,
+        beta: float = 1,
+) -> Dict[str, float]:
+    """Macro & weighted precision, recall & f-score from a (true x predicted) table.
+
+    Same keys & values as `log_precision_recall_fscore_support(average='macro_and_weighted',
+    output_dict=True, append_fold_name_to_output_dict=False)`. Like sklearn, macro averages
+    include labels that only appear in either y_true or y_pred, and 0/0 = 0.
+    """
+    tp = np.diag(contingency).astype(np.float64)
+    true_count = contingency.sum(axis=1).astype(np.float64)
+    pred_count = contingency.sum(axis=0).astype(np.float64)
+    mask_labels = (true_count > 0) | (pred_count > 0)
+    tp, true_count, pred_count = tp[mask_labels], true_count[mask_labels], pred_count[mask_labels]
+
+    precision = np.divide(tp, pred_count, out=np.zeros_like(tp), where=pred_count > 0)
+    recall = np.divide(tp, true_count, out=np.zeros_like(tp), where=true_count > 0)
+    beta2 = beta ** 2
+    denom_ = beta2 * precision + recall
+    f_score = np.divide(
+        (1 + beta2) * precision * recall, denom_,
+        out=np.zeros_like(tp), where=denom_ > 0,
+    )
+
+    d_scores = {'precision': precision, 'recall': recall, f'f{beta}_score': f_score}
+    d_output = dict()
+    for metric_, arr_ in d_scores.items():
+        d_output[f"{metric_}-macro_avg"] = float(arr_.mean()) if arr_.size else 0.0
+        d_output[f"{metric_}-weighted_avg"] = (
+            float(np.average(arr_, weights=true_count)) if true_count.sum() > 0 else 0.0
+        )
+    return d_output
+
+
+def _evaluate_k(
+        codes_pred: np.ndarray,
+        n_clusters: int,
+        codes_truth: np.ndarray,
+        n_truth: int,
+        beta: float = 1,
+        l_metrics: List[str] = None,
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, float]]:
+    """Metrics for one k. Module-level so it can be pickled & sent to a process pool.
+
+    Args:
+        codes_pred: cluster codes for rows with known ground truth
+        codes_truth: ground truth codes for the same rows
+
+    Returns:
+        crosstab (n_clusters x n_truth), majority truth code per cluster (-1 if the
+        cluster has no rows with known truth), dict of metrics
+    """
+    if l_metrics is None:
+        l_metrics = list(D_CLUSTER_METRICS_WITH_KNOWN_LABELS.keys())
+
+    crosstab_ = get_contingency_table(codes_pred, codes_truth, n_clusters, n_truth)
+    # argmax picks the first max, same as idxmax() on a crosstab with sorted columns
+    majority_ = np.where(crosstab_.sum(axis=1) > 0, crosstab_.argmax(axis=1), -1)
+
+    # (true x majority-predicted) table: add each cluster's row to its majority topic
+    mask_clusters = majority_ >= 0
+    contingency_pred_ = np.zeros((n_truth, n_truth), dtype=np.int64)
+    np.add.at(contingency_pred_.T, majority_[mask_clusters], crosstab_[mask_clusters])
+
+    d_metrics = precision_recall_fscore_from_contingency(contingency_pred_, beta=beta)
+    for m_name in l_metrics:
+        if m_name in D_CLUSTER_METRICS_FROM_CONTINGENCY:
+            d_metrics[m_name] = D_CLUSTER_METRICS_FROM_CONTINGENCY[m_name](contingency_pred_)
+        else:
+            d_metrics[m_name] = D_CLUSTER_METRICS_WITH_KNOWN_LABELS[m_name](
+                codes_truth, majority_[codes_pred]
+            )
+    return crosstab_, majority_, d_metrics
+
+
+def evaluate_supervised_metrics_for_ks(
+        df_labels: pd.DataFrame,
+        l_cols_labels: List[str],
+        l_cols_ground_truth: List[str],
+        label_col_prefix: str = 'k_',
+        label_col_suffix: str = '_label',
+        beta: float = 1,
+        n_jobs: int = 4,
+) -> Tuple[pd.DataFrame, Dict[str, Dict[str, pd.DataFrame]], List[dict]]:
+    """Get majority-topic predictions & supervised metrics for many k-values at once.
+
+    Args:
+        df_labels: df with cluster label columns & ground truth columns
+        l_cols_labels: cluster label columns, e.g., ['k_0010_label', 'k_0020_label']
+        l_cols_ground_truth: e.g., ['primary_topic']
+        n_jobs: processes to spread k-values over. n_jobs=1 runs in this process
+
+    Returns:
+        df_majority: one column per (k, truth col), e.g.: `k_0010_majority_primary_topic`,
+            with the same index as df_labels
+        d_df_crosstab_labels: {col_labels: {col_truth: crosstab df}}
+        l_metrics: list of dicts with metrics for each (k, truth col)
+    """
+    d_label_codes = dict()
+    for col_ in l_cols_labels:
+        d_label_codes[col_] = pd.factorize(df_labels[col_], sort=True)
+
+    d_majority_cols = dict()
+    d_df_crosstab_labels = {col_: dict() for col_ in l_cols_labels}
+    d_metrics = {col_: dict() for col_ in l_cols_labels}
+
+    for c_tl in l_cols_ground_truth:
+        # to be on the safe side, sometimes nulls are filled as "null"
+        mask_not_null_gt = ~(
+                (df_labels[c_tl].isnull()) |
+                (df_labels[c_tl] == 'null')
+        ).to_numpy()
+        codes_truth, uniques_truth = pd.factorize(df_labels[c_tl][mask_not_null_gt], sort=True)
+        arr_truth_names = np.asarray(uniques_truth, dtype=object)
+
+        fxn_evaluate = partial(
+            _evaluate_k,
+            codes_truth=codes_truth,
+            n_truth=len(uniques_truth),
+            beta=beta,
+        )
+        l_args = [
+            (d_label_codes[col_][0][mask_not_null_gt], len(d_label_codes[col_][1]))
+            for col_ in l_cols_labels
+        ]
+        if (n_jobs is None) or (n_jobs <= 1):
+            l_outputs = [fxn_evaluate(codes_, n_) for codes_, n_ in l_args]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                l_outputs = list(
+                    executor.map(
+                        fxn_evaluate,
+                        [a_[0] for a_ in l_args],
+                        [a_[1] for a_ in l_args],
+                    )
+                )
+
+        for col_, (crosstab_, majority_, d_metrics_) in zip(l_cols_labels, l_outputs):
+            codes_all, uniques_labels = d_label_codes[col_]
+            mask_clusters = crosstab_.sum(axis=1) > 0
+            d_df_crosstab_labels[col_][c_tl] = pd.DataFrame(
+                crosstab_[mask_clusters],
+                index=pd.Index(np.asarray(uniques_labels)[mask_clusters], name=col_),
+                columns=pd.Index(uniques_truth, name=c_tl),
+            )
+
+            # Clusters without known ground truth get a null prediction (same as the left merge)
+            arr_pred_names = np.append(arr_truth_names, np.nan)
+            majority_names_ = arr_pred_names[np.where(majority_ >= 0, majority_, len(arr_truth_names))]
+            k_col_prefix = col_.replace(label_col_suffix, '')
+            d_majority_cols[f"{k_col_prefix}_majority_{c_tl}"] = np.where(
+                codes_all >= 0, majority_names_[codes_all], np.nan
+            )
+            d_metrics[col_][c_tl] = {
+                'predicted_col': col_,
+                'truth_col': c_tl,
+                'k': int(col_.replace(label_col_suffix, '').replace(label_col_prefix, '')),
+                **d_metrics_,
+            }
+
+    # keep the same column & row order we'd get from looping over k, then truth cols
+    l_cols_majority = list()
+    l_metrics = list()
+    for col_ in l_cols_labels:
+        for c_tl in l_cols_ground_truth:
+            l_cols_majority.append(f"{col_.replace(label_col_suffix, '')}_majority_{c_tl}")
+            l_metrics.append(d_metrics[col_][c_tl])
+
+    df_majority = pd.DataFrame(
+        {c_: d_majority_cols[c_] for c_ in l_cols_majority},
+        index=df_labels.index,
+    )
+    return df_majority, d_df_crosstab_labels, l_metrics
+
+
+#
+# ~ fin
+#
@@ -0,0 +1,172 @@
+"""
+Dimensionality reduction steps for the clustering pipeline.
+
+- RandomizedPCA: PCA with randomized SVD that keeps float32 inputs in float32
+  (half the memory & faster BLAS calls than float64)
+- CachedTransformer: wrap a reducer so that `fit_transform()` saves the fitted
+  reducer & the reduced matrix to disk. When we sweep clustering hyperparameters
+  over the same embeddings, other runs load them instead of fitting again.
+"""
+import hashlib
+import json
+import logging
+from logging import info
+import os
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.utils.extmath import randomized_svd, svd_flip
+
+
+log = logging.getLogger(__name__)
+
+PATH_REDUCE_CACHE = "/home/jupyter/subreddit_clustering_i18n/data/local_cache/reduce"
+
+
+class RandomizedPCA(BaseEstimator, TransformerMixin):
+    """PCA with randomized SVD computed in `dtype` (float32 by default).
+
+    Same outputs as `PCA(svd_solver='randomized')` (up to float precision), but
+    sklearn's PCA can upcast & copy the input, which doubles memory for 100k+ x 512 inputs.
+    """
+    def __init__(
+            self,
+            n_components: int = 256,
+            whiten: bool = False,
+            n_oversamples: int = 10,
+            n_iter: int = 4,
+            dtype: str = 'float32',
+            random_state: int = 42,
+    ):
+        self.n_components = n_components
+        self.whiten = whiten
+        self.n_oversamples = n_oversamples
+        self.n_iter = n_iter
+        self.dtype = dtype
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        X = np.asarray(X, dtype=self.dtype)
+        n_rows = X.shape[0]
+        self.n_features_in_ = X.shape[1]
+        self.mean_ = X.mean(axis=0)
+        X_centered = X - self.mean_
+
+        U, S, Vt = randomized_svd(
+            X_centered,
+            n_components=self.n_components,
+            n_oversamples=self.n_oversamples,
+            n_iter=self.n_iter,
+            flip_sign=False,
+            random_state=self.random_state,
+        )
+        U, Vt = svd_flip(U, Vt)
+
+        self.components_ = Vt
+        self.singular_values_ = S
+        self.explained_variance_ = (S ** 2) / (n_rows - 1)
+        total_var_ = np.einsum('ij,ij->', X_centered, X_centered, dtype=np.float64) / (n_rows - 1)
+        self.explained_variance_ratio_ = self.explained_variance_ / total_var_
+        self.n_components_ = len(S)
+        return self
+
+    def fit_transform(self, X, y=None, **fit_params):
+        # Project X instead of returning U * S: with an approximate SVD they can differ
+        #  & we want the same output as transform() (e.g., to assign new rows to clusters)
+        return self.fit(X).transform(X)
+
+    def transform(self, X):
+        X_reduced = (np.asarray(X, dtype=self.dtype) - self.mean_) @ self.components_.T
+        if self.whiten:
+            X_reduced /= np.sqrt(self.explained_variance_)
+        return X_reduced
+
+
+def get_array_fingerprint(X) -> str:
+    """Hash of the array shape, dtype & data (so we don't use a cache for a different input)"""
+    X = np.ascontiguousarray(X)
+    hash_ = hashlib.blake2b(digest_size=16)
+    hash_.update(f"{X.shape}|{X.dtype}".encode())
+    hash_.update(X.data)
+    return hash_.hexdigest()
+
+
+class CachedTransformer(BaseEstimator, TransformerMixin):
+    """Cache a transformer's fit_transform() output to disk.
+
+    Cache folder: `{cache_dir}/{cache_key_prefix}/{TransformerName}-{key}`, where
+    key is a hash of the transformer params + a fingerprint of the input array.
+    Set `cache_key_prefix` to something readable, like the embeddings run ID,
+    so it's easy to find & delete caches.
+
+    The reduced matrix is loaded as a copy-on-write memmap (mmap_mode='c'): it's
+    writable like the output of a fresh fit, but parallel runs that use the same cache
+    share its pages until they write to them. The file on disk never changes.
+    """
+    def __init__(
+            self,
+            transformer=None,
+            cache_dir: str = PATH_REDUCE_CACHE,
+            cache_key_prefix: str = 'default',
+            mmap_mode: str = 'c',
+            verbose: bool = True,
+    ):
+        self.transformer = transformer
+        self.cache_dir = cache_dir
+        self.cache_key_prefix = cache_key_prefix
+        self.mmap_mode = mmap_mode
+        self.verbose = verbose
+
+    def get_cache_path(self, X) -> Path:
+        d_key = {
+            'transformer': type(self.transformer).__name__,
+            'params': self.transformer.get_params(deep=True),
+            'input': get_array_fingerprint(X),
+        }
+        key_ = hashlib.sha1(
+            json.dumps(d_key, sort_keys=True, default=str).encode()
+        ).hexdigest()[:16]
+        return Path(self.cache_dir) / str(self.cache_key_prefix) / f"{type(self.transformer).__name__}-{key_}"
+
+    def fit(self, X, y=None):
+        self.fit_transform(X, y)
+        return self
+
+    def fit_transform(self, X, y=None, **fit_params):
+        X = np.asarray(X)
+        path_cache = self.get_cache_path(X)
+        f_transformer = path_cache / 'transformer.joblib'
+        f_X_transformed = path_cache / 'X_transformed.npy'
+
+        if f_transformer.exists() and f_X_transformed.exists():
+            if self.verbose:
+                info(f"  Loading cached {type(self.transformer).__name__} from:\n  {path_cache}")
+            self.transformer_ = joblib.load(f_transformer)
+            return np.load(f_X_transformed, mmap_mode=self.mmap_mode)
+
+        if self.verbose:
+            info(f"  No cache found, fitting {type(self.transformer).__name__}...")
+        self.transformer_ = clone(self.transformer)
+        X_transformed = self.transformer_.fit_transform(X, y, **fit_params)
+
+        # Write to temp files & rename, so parallel runs never read a partial file
+        Path.mkdir(path_cache, exist_ok=True, parents=True)
+        f_tmp_suffix_ = f".tmp-{os.getpid()}"
+        joblib.dump(self.transformer_, str(f_transformer) + f_tmp_suffix_)
+        with open(str(f_X_transformed) + f_tmp_suffix_, 'wb') as f_:
+            np.save(f_, X_transformed)
+        os.replace(str(f_X_transformed) + f_tmp_suffix_, f_X_transformed)
+        os.replace(str(f_transformer) + f_tmp_suffix_, f_transformer)
+        if self.verbose:
+            info(f"  Saved {type(self.transformer).__name__} cache to:\n  {path_cache}")
+        return X_transformed
+
+    def transform(self, X):
+        return self.transformer_.transform(X)
+
+
+#
+# ~ fin
+#
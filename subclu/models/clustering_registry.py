@@ -3,14 +3,21 @@ Registry for clustering algos to use
 
 Use config to call specific model
 """
-from sklearn.cluster import KMeans, DBSCAN, OPTICS, AgglomerativeClustering
-from sklearn.decomposition import TruncatedSVD
+from sklearn.cluster import (
+    KMeans, DBSCAN, OPTICS, AgglomerativeClustering,
+    MiniBatchKMeans, Birch,
+)
+from sklearn.decomposition import TruncatedSVD, IncrementalPCA
 from sklearn.preprocessing import Normalizer
 from sklearn.metrics import (
     adjusted_mutual_info_score, adjusted_rand_score,
     homogeneity_score,
 )
 
+from .clustering_knn import KNNGraphAgglomerativeClustering
+from .clustering_reduce import RandomizedPCA
+from .clustering_streaming import PreClusterAgglomerativeClustering
+
 
 D_CLUSTER_PIPELINE = {
     'normalize': {
@@ -19,6 +26,10 @@ D_CLUSTER_PIPELINE = {
 
     'reduce': {
         'TruncatedSVD': TruncatedSVD,
+        # float32 randomized SVD. Set `cache: true` in pipeline_config to reuse it in sweeps
+        'RandomizedPCA': RandomizedPCA,
+        # has partial_fit(), use it to train in chunks
+        'IncrementalPCA': IncrementalPCA,
     }
 }
 
@@ -28,6 +39,12 @@ D_CLUSTER_MODELS = {
     'KMeans': KMeans,
     'DBSCAN': DBSCAN,
     'OPTICS': OPTICS,
+    'KNNGraphAgglomerativeClustering': KNNGraphAgglomerativeClustering,
+
+    # Models with partial_fit(), can be trained in chunks (see `train_embeddings_in_chunks` config)
+    'MiniBatchKMeans': MiniBatchKMeans,
+    'Birch': Birch,
+    'PreClusterAgglomerativeClustering': PreClusterAgglomerativeClustering,
 }
 
 
@@ -0,0 +1,267 @@
+"""
+Clustering for embeddings that don't fit in memory (e.g., post-level or user-level).
+
+1. Summarize the rows with a streaming pre-clustering model that has `partial_fit()`:
+    - birch: BIRCH CF-tree, each leaf subcluster keeps a centroid of the rows it absorbed
+    - minibatch_kmeans: MiniBatchKMeans with many (e.g., 5k) centroids
+2. Run hierarchical clustering (ward) on the pre-cluster centroids
+
+The leaves of the hierarchy are the pre-clusters (not the input rows). The model
+exposes `children_`, `distances_` & `n_leaves_`, so `create_linkage_for_dendrogram()`,
+`fcluster_multi_k()` and the elbow plots keep working. Use `predict_leaves()` to map
+rows (e.g., subreddit-level embeddings) to their leaf & get labels for each k.
+"""
+import logging
+from logging import info
+from typing import Iterator, Callable
+
+import numpy as np
+from sklearn.base import BaseEstimator, ClusterMixin
+from sklearn.cluster import AgglomerativeClustering, Birch, MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer, Normalizer
+
+
+log = logging.getLogger(__name__)
+
+L_PRE_CLUSTER_METHODS = ['birch', 'minibatch_kmeans']
+
+# Steps without partial_fit() that we can fit on a single chunk b/c they don't learn
+#  anything from the data
+STATELESS_STEPS = (Normalizer, FunctionTransformer)
+
+
+class PreClusterAgglomerativeClustering(BaseEstimator, ClusterMixin):
+    """AgglomerativeClustering on the centroids of a streaming pre-clustering model.
+
+    Train it with `fit(X)` or in chunks:
+        for X_ in chunks:
+            model.partial_fit(X_)
+        model.partial_fit()  # no X: only fit the hierarchy on the pre-cluster centroids
+
+    Same convention as sklearn's `Birch.partial_fit(X=None)`.
+
+    NOTE: ward treats each centroid as a single point (it doesn't weight them
+    by the number of rows in each pre-cluster).
+    """
+    def __init__(
+            self,
+            n_clusters: int = 2,
+            pre_cluster_method: str = 'birch',
+            birch_threshold: float = 0.5,
+            birch_branching_factor: int = 50,
+            n_pre_clusters: int = 5000,
+            kmeans_batch_size: int = 4096,
+            affinity: str = 'euclidean',
+            linkage: str = 'ward',
+            compute_full_tree: bool = True,
+            compute_distances: bool = True,
+            distance_threshold: float = None,
+            random_state: int = 42,
+            verbose: bool = True,
+    ):
+        self.n_clusters = n_clusters
+        self.pre_cluster_method = pre_cluster_method
+        self.birch_threshold = birch_threshold
+        self.birch_branching_factor = birch_branching_factor
+        self.n_pre_clusters = n_pre_clusters
+        self.kmeans_batch_size = kmeans_batch_size
+        self.affinity = affinity
+        self.linkage = linkage
+        self.compute_full_tree = compute_full_tree
+        self.compute_distances = compute_distances
+        self.distance_threshold = distance_threshold
+        self.random_state = random_state
+        self.verbose = verbose
+
+    def _get_pre_cluster_model(self):
+        if self.pre_cluster_method == 'birch':
+            # n_clusters=None so that predict() returns the leaf subcluster index
+            return Birch(
+                threshold=self.birch_threshold,
+                branching_factor=self.birch_branching_factor,
+                n_clusters=None,
+                compute_labels=False,
+            )
+        elif self.pre_cluster_method == 'minibatch_kmeans':
+            return MiniBatchKMeans(
+                n_clusters=self.n_pre_clusters,
+                batch_size=self.kmeans_batch_size,
+                random_state=self.random_state,
+            )
+        else:
+            raise NotImplementedError(
+                f"pre_cluster_method not implemented: {self.pre_cluster_method}."
+                f" Options: {L_PRE_CLUSTER_METHODS}"
+            )
+
+    @property
+    def subcluster_centers_(self) -> np.ndarray:
+        if self.pre_cluster_method == 'birch':
+            return self.pre_cluster_model_.subcluster_centers_
+        else:
+            return self.pre_cluster_model_.cluster_centers_
+
+    def partial_fit(self, X=None, y=None):
+        """Update the pre-clusters with a chunk of rows.
+        If X is None, fit the hierarchy on the current pre-cluster centroids.
+        """
+        if X is None:
+            return self._fit_hierarchy()
+
+        X = np.asarray(X)
+        if not hasattr(self, 'pre_cluster_model_'):
+            self.pre_cluster_model_ = self._get_pre_cluster_model()
+            self.n_features_in_ = X.shape[1]
+        self.pre_cluster_model_.partial_fit(X)
+        return self
+
+    def fit(self, X, y=None):
+        X = np.asarray(X)
+        if self.verbose:
+            info(f"  Pre-clustering {X.shape[0]:,.0f} rows with {self.pre_cluster_method}...")
+        self.pre_cluster_model_ = self._get_pre_cluster_model().fit(X)
+        self.n_features_in_ = X.shape[1]
+        self._fit_hierarchy()
+        self.labels_ = self.predict(X)
+        return self
+
+    def _fit_hierarchy(self):
+        centers_ = self.subcluster_centers_
+        if self.verbose:
+            info(f"  Fitting {self.linkage} clustering on {centers_.shape[0]:,.0f} pre-cluster centroids...")
+        model_ = AgglomerativeClustering(
+            n_clusters=None if self.distance_threshold is not None else min(self.n_clusters, len(centers_)),
+            affinity=self.affinity,
+            compute_full_tree=self.compute_full_tree,
+            linkage=self.linkage,
+            distance_threshold=self.distance_threshold,
+            compute_distances=self.compute_distances,
+        ).fit(centers_)
+
+        self.children_ = model_.children_
+        self.n_leaves_ = model_.n_leaves_
+        self.n_clusters_ = model_.n_clusters_
+        self.leaf_labels_ = model_.labels_
+        if hasattr(model_, 'distances_'):
+            self.distances_ = model_.distances_
+        return self
+
+    def predict_leaves(self, X) -> np.ndarray:
+        """Get the leaf (pre-cluster) index for each row"""
+        return self.pre_cluster_model_.predict(np.asarray(X))
+
+    def predict(self, X) -> np.ndarray:
+        """Get the label of each row for `n_clusters`"""
+        return self.leaf_labels_[self.predict_leaves(X)]
+
+    def fit_predict(self, X, y=None):
+        return self.fit(X).labels_
+
+
+def fit_pipeline_in_chunks(
+        pipeline: Pipeline,
+        get_chunks: Callable[[], Iterator[np.ndarray]],
+        verbose: bool = True,
+) -> Pipeline:
+    """Train a pipeline with `partial_fit()`, one chunk of rows at a time.
+
+    Each step that has `partial_fit()` (e.g., IncrementalPCA, MiniBatchKMeans, Birch)
+    takes one pass over the chunks, so `get_chunks` needs to return a new iterator
+    each time we call it. Stateless steps (Normalizer, FunctionTransformer) only
+    need `fit()` on one chunk.
+
+    Some steps need a minimum number of rows in each call to `partial_fit()` (e.g.,
+    IncrementalPCA needs n_components), so we merge short chunks with the next
+    one & a short last chunk with the previous one.
+
+    If the last step is `Birch` or `PreClusterAgglomerativeClustering` we call
+    `partial_fit()` without X at the end to run their final (global) clustering step.
+    """
+    n_steps = len(pipeline.steps)
+    for ix_step, (name_, step_) in enumerate(pipeline.steps):
+        l_prev_steps = [s_ for _, s_ in pipeline.steps[:ix_step]]
+
+        if not hasattr(step_, 'partial_fit'):
+            if (ix_step == n_steps - 1) or (not isinstance(step_, STATELESS_STEPS)):
+                raise NotImplementedError(
+                    f"Step `{name_}` ({type(step_).__name__}) doesn't have partial_fit()"
+                    f" so we can't train it in chunks"
+                )
+            step_.fit(transform_chunk(next(iter(get_chunks())), l_prev_steps))
+            continue
+
+        if verbose:
+            info(f"  Training step `{name_}` in chunks...")
+        n_rows = 0
+        for ix_chunk, X_ in enumerate(
+                iter_chunks_min_rows(
+                    (transform_chunk(X_chunk_, l_prev_steps) for X_chunk_ in get_chunks()),
+                    min_rows=get_min_rows_for_partial_fit(step_),
+                )
+        ):
+            step_.partial_fit(X_)
+            n_rows += X_.shape[0]
+            if verbose:
+                log.info(f"    chunk {ix_chunk:4,.0f} | {n_rows:12,.0f} rows")
+
+    model_ = pipeline.steps[-1][1]
+    if isinstance(model_, (Birch, PreClusterAgglomerativeClustering)):
+        model_.partial_fit()
+    return pipeline
+
+
+def transform_chunk(
+        X: np.ndarray,
+        l_steps: list,
+) -> np.ndarray:
+    for s_ in l_steps:
+        X = s_.transform(X)
+    return X
+
+
+def get_min_rows_for_partial_fit(step) -> int:
+    """Min rows that `step.partial_fit()` needs in each chunk"""
+    if isinstance(step, IncrementalPCA):
+        return step.n_components or 1
+    elif isinstance(step, MiniBatchKMeans):
+        # only for the first chunk, but keeping it for every chunk is simpler
+        return step.n_clusters
+    elif isinstance(step, PreClusterAgglomerativeClustering) and (step.pre_cluster_method == 'minibatch_kmeans'):
+        return step.n_pre_clusters
+    else:
+        return 1
+
+
+def iter_chunks_min_rows(
+        chunks: Iterator[np.ndarray],
+        min_rows: int = 1,
+) -> Iterator[np.ndarray]:
+    """Yield chunks with at least `min_rows` rows (unless all chunks together are shorter).
+    Short chunks are merged with the next chunk & a short tail is merged with the
+    previous chunk, so we only hold 2 chunks in memory at a time.
+    """
+    X_ready = None
+    l_short = list()
+    n_rows_short = 0
+    for X_ in chunks:
+        l_short.append(X_)
+        n_rows_short += X_.shape[0]
+        if n_rows_short < min_rows:
+            continue
+        if X_ready is not None:
+            yield X_ready
+        X_ready = l_short[0] if len(l_short) == 1 else np.concatenate(l_short)
+        l_short = list()
+        n_rows_short = 0
+
+    if len(l_short) > 0:
+        X_ready = np.concatenate(l_short if X_ready is None else [X_ready] + l_short)
+    if X_ready is not None:
+        yield X_ready
+
+
+#
+# ~ fin
+#
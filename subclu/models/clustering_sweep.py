@@ -0,0 +1,182 @@
+"""
+Share embeddings across the jobs of a hydra `--multirun` clustering sweep.
+
+Without this, every joblib worker downloads & parses the same parquet files and
+keeps its own copy of the embeddings in RAM. Instead:
+1. `SharedEmbeddingsCallback.on_multirun_start()` runs once in the parent process:
+    it loads & filters the embeddings & saves them as a float32 .npy file + a meta parquet
+2. Each worker (ClusterEmbeddings with `shared_embeddings.enabled=true`) attaches to the
+    .npy file as a read-only memmap. All workers share the same OS pages.
+
+Set `shared_embeddings.shared_dir` to a folder in /dev/shm to keep the array in
+shared memory instead of the disk page cache.
+
+Example config:
+    shared_embeddings:
+      enabled: true
+    hydra:
+      callbacks:
+        shared_embeddings:
+          _target_: subclu.models.clustering_sweep.SharedEmbeddingsCallback
+
+NOTE: if `n_sample_embedding_rows` is set, all jobs in the sweep use the same sample.
+"""
+import hashlib
+import json
+import logging
+from logging import info
+import os
+from pathlib import Path
+import shutil
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from hydra.experimental.callback import Callback
+from omegaconf import DictConfig, OmegaConf
+
+
+log = logging.getLogger(__name__)
+
+PATH_SHARED_EMBEDDINGS = "/home/jupyter/subreddit_clustering_i18n/data/local_cache/shared_embeddings"
+
+F_EMBEDDINGS = 'embeddings.npy'
+F_META = 'df_embeddings_meta.parquet'
+F_SUBS = 'df_subs.parquet'
+F_COLUMNS = 'columns.json'
+
+
+def get_shared_embeddings_path(
+        data_embeddings_to_cluster: dict,
+        embeddings_to_cluster: str,
+        n_sample_embedding_rows: int = None,
+        filter_embeddings: dict = None,
+        shared_dir: str = PATH_SHARED_EMBEDDINGS,
+) -> Path:
+    """Folder for the shared embeddings. The key includes everything that changes
+    which rows we load, so a worker never attaches to the wrong embeddings.
+    """
+    if isinstance(filter_embeddings, DictConfig):
+        filter_embeddings = OmegaConf.to_container(filter_embeddings, resolve=True)
+    d_key = {
+        'run_uuid': data_embeddings_to_cluster['run_uuid'],
+        'artifact_folder': data_embeddings_to_cluster[embeddings_to_cluster],
+        'n_sample_embedding_rows': n_sample_embedding_rows,
+        'filter_embeddings': filter_embeddings,
+    }
+    key_ = hashlib.sha1(json.dumps(d_key, sort_keys=True, default=str).encode()).hexdigest()[:12]
+    return Path(shared_dir) / f"{data_embeddings_to_cluster['run_uuid']}-{embeddings_to_cluster}-{key_}"
+
+
+def save_shared_embeddings(
+        path: Path,
+        df_embeddings: pd.DataFrame,
+        l_cols_embeddings: list,
+        df_subs: pd.DataFrame = None,
+) -> None:
+    """Save embeddings as a float32 .npy (so we can memmap it) & the other columns as parquet.
+    The .npy file is written last (tmp file + rename) so workers only see complete outputs.
+    """
+    Path.mkdir(path, exist_ok=True, parents=True)
+    df_embeddings.drop(l_cols_embeddings, axis=1).to_parquet(path / F_META)
+    if df_subs is not None:
+        df_subs.to_parquet(path / F_SUBS)
+    with open(path / F_COLUMNS, 'w') as f_:
+        json.dump({'l_cols_embeddings': list(l_cols_embeddings)}, f_)
+
+    f_tmp_ = path / f"{F_EMBEDDINGS}.tmp-{os.getpid()}"
+    with open(f_tmp_, 'wb') as f_:
+        np.save(f_, np.ascontiguousarray(df_embeddings[l_cols_embeddings].to_numpy(dtype=np.float32)))
+    os.replace(f_tmp_, path / F_EMBEDDINGS)
+
+    r_, c_ = df_embeddings.shape
+    info(f"{r_:9,.0f} | {c_:5,.0f} <- Shared embeddings SHAPE, saved to:\n  {path}")
+
+
+def is_shared_embeddings_ready(path: Path) -> bool:
+    return (Path(path) / F_EMBEDDINGS).exists()
+
+
+def load_shared_embeddings(
+        path: Path,
+        mmap_mode: str = 'r',
+) -> Tuple[pd.DataFrame, np.ndarray, list, pd.DataFrame]:
+    """Attach to shared embeddings.
+
+    Returns:
+        df_meta: non-embedding columns (e.g., subreddit_name, subreddit_id)
+        X_embeddings: read-only memmap with the embeddings (same row order as df_meta)
+        l_cols_embeddings: names of the embedding columns
+        df_subs: subreddit meta used for filtering (None if it wasn't saved)
+    """
+    path = Path(path)
+    df_meta = pd.read_parquet(path / F_META)
+    with open(path / F_COLUMNS, 'r') as f_:
+        l_cols_embeddings = json.load(f_)['l_cols_embeddings']
+    df_subs = pd.read_parquet(path / F_SUBS) if (path / F_SUBS).exists() else None
+    X_embeddings = np.load(path / F_EMBEDDINGS, mmap_mode=mmap_mode)
+    return df_meta, X_embeddings, l_cols_embeddings, df_subs
+
+
+def _get_shared_embeddings_path_from_config(config: DictConfig) -> Path:
+    """Get the path from the hydra config. None if shared embeddings aren't enabled"""
+    d_shared_ = config.get('shared_embeddings', None) or dict()
+    if not d_shared_.get('enabled', False):
+        return None
+    return get_shared_embeddings_path(
+        data_embeddings_to_cluster=config['data_embeddings_to_cluster'],
+        embeddings_to_cluster=config['embeddings_to_cluster'],
+        n_sample_embedding_rows=config.get('n_sample_embedding_rows', None),
+        filter_embeddings=config.get('filter_embeddings', None),
+        shared_dir=d_shared_.get('shared_dir', PATH_SHARED_EMBEDDINGS),
+    )
+
+
+class SharedEmbeddingsCallback(Callback):
+    """Hydra callback: load embeddings once in the parent process of a multirun"""
+    def on_multirun_start(self, config: DictConfig, **kwargs) -> None:
+        # import here to prevent circular imports (clustering.py imports this module)
+        from .clustering import ClusterEmbeddings, get_cluster_embeddings_kwargs
+
+        # Don't abort the sweep if we can't create the shared embeddings,
+        #  each job can still load its own embeddings
+        try:
+            path_ = _get_shared_embeddings_path_from_config(config)
+            if path_ is None:
+                log.info(f"shared_embeddings.enabled is not true, workers will load their own embeddings")
+                return
+            if is_shared_embeddings_ready(path_):
+                info(f"Shared embeddings already exist, workers will attach to:\n  {path_}")
+                return
+
+            info(f"Loading embeddings once for all jobs in the sweep...")
+            d_kwargs_ = get_cluster_embeddings_kwargs(config)
+            d_kwargs_['shared_embeddings'] = None  # the parent needs to load them
+            cluster = ClusterEmbeddings(**d_kwargs_)
+            df_embeddings, df_subs = cluster.load_and_filter_embeddings()
+            save_shared_embeddings(
+                path_,
+                df_embeddings=df_embeddings,
+                l_cols_embeddings=cluster.l_cols_embeddings,
+                df_subs=df_subs,
+            )
+        except Exception as e:
+            log.error(f"Could not create shared embeddings, workers will load their own embeddings:\n  {e}")
+
+    def on_multirun_end(self, config: DictConfig, **kwargs) -> None:
+        """Only delete the files if `shared_embeddings.delete_on_multirun_end=true`
+        (e.g., when they're in /dev/shm). Otherwise, keep them for the next sweep.
+        """
+        try:
+            path_ = _get_shared_embeddings_path_from_config(config)
+        except Exception as e:
+            log.error(f"Could not get shared embeddings path:\n  {e}")
+            return
+        if (path_ is not None) and config['shared_embeddings'].get('delete_on_multirun_end', False):
+            info(f"Deleting shared embeddings:\n  {path_}")
+            shutil.rmtree(path_, ignore_errors=True)
+
+
+#
+# ~ fin
+#
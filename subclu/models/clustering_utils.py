@@ -8,18 +8,18 @@ reference:
 - Describe different ways to use scipy's tools
     - https://joernhees.de/blog/2015/08/26/scipy-hierarchical-clustering-and-dendrogram-tutorial/
 """
-import gc
 import logging
 from pathlib import Path
-from typing import Union, Tuple, List
+from typing import Union, Tuple, List, Dict
 
 from matplotlib import pyplot as plt
 from matplotlib import cm
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from tqdm import tqdm
 
-from scipy.cluster.hierarchy import dendrogram
+from scipy.cluster.hierarchy import dendrogram, fcluster, leaves_list, maxdists, ward
 
 from ..utils.eda import reorder_array
 
@@ -97,33 +97,17 @@ def create_dynamic_clusters(
             c for c in df_labels.columns if all([c.startswith('k'), c.endswith(suffix_primary_topic_col)])
         ])
 
-    # Create new cols that have zero-padding so we can concat and sort them
+    # Nested labels as ints: one group code per (level, nested path). Only format strings for output
+    #  e.g., k_0010 = 3 & k_0020 = 17 -> nested label for k_0020: "0003-0017"
     l_cols_labels_new = [f"{c}_nested" for c in l_cols_labels_input]
     df_new_labels = df_labels[l_ix].copy()
 
     if verbose:
-        logging.info(f"Concat'ing nested cluster labels...")
-    # First convert the label vals [1, 5, 328] to string & apply zero padding to normalize them and make it
-    #  easy to sort them as text
-    df_new_labels[l_cols_labels_new] = df_labels[l_cols_labels_input].apply(lambda x: x.map("{:04.0f}".format))
-    # Concat the values of the new columns so it's easier to tell depth of each cluster
-    for i in range(len(l_cols_labels_new)):
-        if i == 0:
-            df_new_labels[l_cols_labels_new[-1]] = (
-                df_new_labels[l_cols_labels_new[0]]
-                .str.cat(
-                    df_new_labels[l_cols_labels_new[1:]],
-                    sep='-'
-                )
-            )
-        else:
-            df_new_labels[l_cols_labels_new[-i - 1]] = (
-                df_new_labels[l_cols_labels_new[0]]
-                .str.cat(
-                    df_new_labels[l_cols_labels_new[1:-i]],
-                    sep='-'
-                )
-            )
+        logging.info(f"Creating nested cluster labels...")
+    arr_labels = df_labels[l_cols_labels_input].to_numpy()
+    arr_groups, l_arr_nested_labels = get_nested_cluster_label_codes(arr_labels)
+    for c_, arr_nested_ in zip(l_cols_labels_new, l_arr_nested_labels):
+        df_new_labels[c_] = arr_nested_
 
     if verbose:
         logging.info(f"Getting topic mix at different depths...")
@@ -141,8 +125,7 @@ def create_dynamic_clusters(
         verbose=verbose,
         tqdm_log_col_iterations=tqdm_log_col_iterations,
     )
-    # use reset_index() "trick" so that we can keep the same index when using masks
-    # to copy data between df_new_labels & df_labels
+    # use reset_index() "trick" so that we keep the same index as df_labels
     df_new_labels = (
         df_new_labels
         .reset_index()
@@ -157,114 +140,52 @@ def create_dynamic_clusters(
     df_new_labels[col_subreddit_topic_mix] = df_new_labels[l_cols_new_topic_mix[-1]]
     del df_prim_topic_mix_cols
 
-    # Default algo works from smallest cluster to highest cluster (bottom up)
+    # Columns are sorted by name (k) to pick the roll-up order, like in the string version
+    l_levels_by_name = sorted(range(len(l_cols_labels_new)), key=lambda j: l_cols_labels_new[j])
     if agg_strategy == 'aggregate_small_clusters':
-        if verbose:
-            logging.info(f"Initializing values for strategy: {agg_strategy}")
-        # initialize values for new columns (smallest cluster name & values)
-        df_new_labels[col_new_cluster_val] = df_new_labels[l_cols_labels_new[-1]]
-        df_new_labels[col_new_cluster_name] = l_cols_labels_new[-1].replace('_nested', '')
-        df_new_labels[col_new_cluster_prim_topic] = df_labels[
-            l_cols_labels_new[-1].replace('_label_nested', '_majority_primary_topic')
-        ]
-        df_new_labels[col_new_cluster_topic_mix] = df_new_labels[l_cols_new_topic_mix[-1]]
-
-        iter_cols = sorted(l_cols_labels_new[:-1], reverse=True)
-        if tqdm_log_col_iterations:
-            # only use TQDM if verbose=True, otherwise we can get a long list of tqdm progress bars
-            iter_cols = tqdm(iter_cols)
-        if verbose:
-            logging.info(f"  Looping to roll-up clusters from smallest to largest...")
-        for c_ in iter_cols:
-            if log_n_clusters_below_threshold:
-                print(c_)
-            c_name_new = c_.replace('_nested', '')
-            col_update_prim_topic = c_.replace('_label_nested', '_majority_primary_topic')
-            c_update_topic_mix_ = c_.replace('_label_nested', suffix_new_topic_mix)
-
-            # find which current clusters are below threshold
-            df_vc = df_new_labels[col_new_cluster_val].value_counts()
-            dv_vc_below_threshold = df_vc[df_vc <= min_subreddits_in_cluster]
-            if log_n_clusters_below_threshold:
-                print(f"  {dv_vc_below_threshold.shape} <- Shape of clusters below threshold")
-
-            # Replace cluster labels & names for current clusters that have too few subs in a cluster
-            mask_subs_to_reassign = df_new_labels[col_new_cluster_val].isin(dv_vc_below_threshold.index)
-            df_new_labels.loc[
-                mask_subs_to_reassign,
-                col_new_cluster_val
-            ] = df_new_labels[mask_subs_to_reassign][c_]
-
-            df_new_labels.loc[
-                mask_subs_to_reassign,
-                col_new_cluster_name
-            ] = c_name_new
-
-            df_new_labels.loc[
-                mask_subs_to_reassign,
-                col_new_cluster_topic_mix
-            ] = df_new_labels[mask_subs_to_reassign][c_update_topic_mix_]
-
-            # NOTE that this assignment will only work for sure if index of both dfs is the same
-            df_new_labels.loc[
-                mask_subs_to_reassign,
-                col_new_cluster_prim_topic
-            ] = df_labels[mask_subs_to_reassign][col_update_prim_topic]
-
-        # if redo_orphans:
-        #     # TODO(djb) this might be better done manually, though...
-        #     # Try to reassign ONLY the clusters where we have orphans
-        #     df_vc_orphans = df_vc[df_vc <= 1]
-        #     cluster_id_orphans = df_vc_orphans.index
-
+        # Default algo works from smallest cluster to highest cluster (bottom up)
+        start_level = len(l_cols_labels_new) - 1
+        l_levels_to_check = [j for j in l_levels_by_name[::-1] if j != start_level]
     elif agg_strategy == 'split_large_clusters':
-        df_new_labels[col_new_cluster_val] = df_new_labels[l_cols_labels_new[1]]
-        df_new_labels[col_new_cluster_name] = l_cols_labels_new[1].replace('_nested', '')
-        df_new_labels[col_new_cluster_prim_topic] = df_labels[
-            l_cols_labels_new[1].replace('_label_nested', '_majority_primary_topic')
-        ]
-
-        for c_ in sorted(l_cols_labels_new[1:]):
-            if verbose:
-                print(c_)
-            c_name_new = c_.replace('_nested', '')
-            col_update_prim_topic = c_.replace('_label_nested', '_majority_primary_topic')
-
-            # find which current clusters are ABOVE threshold
-            df_vc = df_new_labels[col_new_cluster_val].value_counts()
-            # multiply min by 2 so that we only split up a cluster if we have a high chance
-            #  of getting at least 2 clusters from it
-            dv_vc_above_threshold = df_vc[df_vc > (2 * min_subreddits_in_cluster)]
-            if log_n_clusters_below_threshold:
-                print(f"  {dv_vc_above_threshold.shape} <- Shape of clusters ABOVE threshold")
-
-            # Replace cluster labels & names for current clusters that have too few subs in a cluster
-            mask_subs_to_reassign = df_new_labels[col_new_cluster_val].isin(dv_vc_above_threshold.index)
-            df_new_labels.loc[
-                mask_subs_to_reassign,
-                col_new_cluster_val
-            ] = df_new_labels[mask_subs_to_reassign][c_]
-
-            df_new_labels.loc[
-                mask_subs_to_reassign,
-                col_new_cluster_name
-            ] = c_name_new
-
-            df_new_labels.loc[
-                mask_subs_to_reassign,
-                col_new_cluster_prim_topic
-            ] = df_labels[mask_subs_to_reassign][col_update_prim_topic]
+        start_level = 1
+        l_levels_to_check = [j for j in l_levels_by_name if j >= 1]
     else:
         l_expected_aggs = ['aggregate_small_clusters', 'split_large_clusters']
         raise NotImplementedError(f"Agg strategy not implemented: {agg_strategy}.\n"
                                   f"  Expected one of: {l_expected_aggs}")
 
-    # create new col as int for label so we can add a color scale when doing QA
-    df_new_labels[col_new_cluster_val_int] = (
-        df_new_labels[col_new_cluster_val]
-        .str[-4:].astype(int)
+    if verbose:
+        logging.info(f"  Resolving cluster level for each subreddit with strategy: {agg_strategy}")
+    if tqdm_log_col_iterations:
+        l_levels_to_check = tqdm(l_levels_to_check)
+    arr_level = get_dynamic_cluster_levels(
+        arr_groups,
+        l_levels_to_check=l_levels_to_check,
+        start_level=start_level,
+        min_subreddits_in_cluster=min_subreddits_in_cluster,
+        agg_strategy=agg_strategy,
+        log_n_clusters_below_threshold=log_n_clusters_below_threshold,
     )
 
+    # Only now pick the label, name & topics for the final level of each subreddit
+    ix_rows = np.arange(len(arr_level))
+    df_new_labels[col_new_cluster_val] = (
+        df_new_labels[l_cols_labels_new].to_numpy()[ix_rows, arr_level]
+    )
+    df_new_labels[col_new_cluster_name] = (
+        np.array([c.replace('_nested', '') for c in l_cols_labels_new], dtype=object)[arr_level]
+    )
+    df_new_labels[col_new_cluster_prim_topic] = df_labels[
+        [c.replace('_label_nested', '_majority_primary_topic') for c in l_cols_labels_new]
+    ].to_numpy()[ix_rows, arr_level]
+    if agg_strategy == 'aggregate_small_clusters':
+        df_new_labels[col_new_cluster_topic_mix] = df_new_labels[
+            [c.replace('_label_nested', suffix_new_topic_mix) for c in l_cols_labels_new]
+        ].to_numpy()[ix_rows, arr_level]
+
+    # create new col as int for label so we can add a color scale when doing QA
+    df_new_labels[col_new_cluster_val_int] = arr_labels[ix_rows, arr_level].astype(int)
+
     if append_columns:
         df_new_labels = df_labels.merge(
             df_new_labels,
@@ -310,6 +231,104 @@ def create_dynamic_clusters(
     return df_new_labels
 
 
+def get_nested_cluster_label_codes(
+        arr_labels: np.ndarray,
+        sep: str = '-',
+        label_format: str = "{:04.0f}",
+) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Get int codes for nested cluster labels & the string labels for each level.
+
+    A nested label at level j is the path of labels from level 0 to j, e.g.: '0003-0017-0042'.
+    Instead of concatenating strings for each row, we get one int code per unique path
+    (combining the parent path code with the label at each level) and only format
+    the strings for the unique paths.
+
+    Args:
+        arr_labels: (n_rows x n_levels) cluster labels, from fewest clusters to most
+
+    Returns:
+        arr_groups: (n_rows x n_levels) int64 codes. Codes are unique within each level
+        l_arr_nested_labels: one object array of nested string labels for each level
+    """
+    arr_labels = np.asarray(arr_labels)
+    n_rows, n_levels = arr_labels.shape
+    arr_groups = np.empty((n_rows, n_levels), dtype=np.int64)
+    l_arr_nested_labels = list()
+
+    codes_parent = np.zeros(n_rows, dtype=np.int64)
+    arr_str_parent = np.array([''], dtype=object)
+    for j in range(n_levels):
+        labels_uniq, labels_codes = np.unique(arr_labels[:, j], return_inverse=True)
+        n_labels_uniq = len(labels_uniq)
+        groups_uniq, codes_ = np.unique(
+            codes_parent * n_labels_uniq + labels_codes.reshape(-1),
+            return_inverse=True,
+        )
+        codes_ = codes_.reshape(-1)
+        arr_groups[:, j] = codes_
+
+        arr_str_labels = np.array([label_format.format(v_) for v_ in labels_uniq], dtype=object)
+        arr_str_groups = arr_str_labels[groups_uniq % n_labels_uniq]
+        if j > 0:
+            arr_str_groups = arr_str_parent[groups_uniq // n_labels_uniq] + sep + arr_str_groups
+        l_arr_nested_labels.append(arr_str_groups[codes_])
+
+        codes_parent = codes_
+        arr_str_parent = arr_str_groups
+
+    return arr_groups, l_arr_nested_labels
+
+
+def get_dynamic_cluster_levels(
+        arr_groups: np.ndarray,
+        l_levels_to_check: List[int],
+        start_level: int,
+        min_subreddits_in_cluster: int = 5,
+        agg_strategy: str = 'aggregate_small_clusters',
+        log_n_clusters_below_threshold: bool = False,
+) -> np.ndarray:
+    """Get the level (column index) of the cluster each row ends up in.
+
+    aggregate_small_clusters: start at the deepest level. At each level (from most to
+        fewest clusters), move rows in clusters with <= min_subreddits_in_cluster
+        rows up to their cluster at that level.
+    split_large_clusters: start at a shallow level. At each level (from fewest to most
+        clusters), move rows in clusters with > 2x min_subreddits_in_cluster rows
+        down to their cluster at that level.
+
+    Cluster sizes come from `np.bincount()` on a single key per row:
+    (offset for the row's current level + group code at that level).
+
+    Args:
+        arr_groups: (n_rows x n_levels) int codes from `get_nested_cluster_label_codes()`
+    """
+    n_rows, n_levels = arr_groups.shape
+    level_offsets = np.zeros(n_levels, dtype=np.int64)
+    level_offsets[1:] = np.cumsum(arr_groups.max(axis=0) + 1)[:-1]
+    n_keys = int(level_offsets[-1] + arr_groups[:, -1].max() + 1) if n_rows else 0
+
+    arr_level = np.full(n_rows, start_level, dtype=np.int64)
+    arr_key = level_offsets[start_level] + arr_groups[:, start_level]
+    for j in l_levels_to_check:
+        cluster_sizes = np.bincount(arr_key, minlength=n_keys)
+        if agg_strategy == 'aggregate_small_clusters':
+            mask_reassign = cluster_sizes[arr_key] <= min_subreddits_in_cluster
+        elif agg_strategy == 'split_large_clusters':
+            # multiply min by 2 so that we only split up a cluster if we have a high chance
+            #  of getting at least 2 clusters from it
+            mask_reassign = cluster_sizes[arr_key] > (2 * min_subreddits_in_cluster)
+        else:
+            raise NotImplementedError(f"Agg strategy not implemented: {agg_strategy}")
+
+        if log_n_clusters_below_threshold:
+            print(f"  {len(np.unique(arr_key[mask_reassign])):,.0f} <- level {j} clusters to reassign")
+
+        arr_level[mask_reassign] = j
+        arr_key[mask_reassign] = level_offsets[j] + arr_groups[mask_reassign, j]
+
+    return arr_level
+
+
 def create_dynamic_clusters_clean(
         df_dynamic_raw: pd.DataFrame,
         col_model_sort_order: str = 'model_sort_order',
@@ -451,13 +470,11 @@ def get_primary_topic_mix_cols(
     in a single column as a string that combines all the nested topics without repeats
 
     General idea:
-    get subreddit ID as index & stack all the cluster majority primary topics as a row (long)
     exclude the first N primary topics b/c those will be broad & noisy
-    then for each  final cluster (last row),
-    - drop duplicates (keep first)
-    - groupby subreddit ID & get a list of the new primary topics (w/o dupes)
-    - convert primary topics to string (instead of list)
-    - assign the list to a new column
+    - encode the remaining primary topics as ints (pd.factorize)
+    - get a mask with the first time each topic shows up in each row (w/o dupes)
+    - build one ' | ' string per new topic in each row, so each depth only needs
+      to look up the string for its number of unique topics (no stack/groupby/merge)
 
     Only start appending after first few cols, otherwise we can get weird results
     b/c labels change too quickly & get dominated by largest primary topics as we decrease k
@@ -470,152 +487,99 @@ def get_primary_topic_mix_cols(
         ])
 
     l_cols_new_topic_mix = [c.replace(suffix_primary_topic_col, suffix_new_topic_mix) for c in l_cols_primary_topics]
+    ix_max_ = len(l_cols_primary_topics)  # max for slice = len(cols)
+    ix_col_max_ = ix_max_ - 1  # max to get final col name = len(cols) - 1
+
+    # Keep input row order w/ a new RangeIndex (same output we used to get from outer merges)
+    df_labels_ = df_labels.reset_index(drop=True)
+    n_rows = len(df_labels_)
 
     # For the first N cols, primary topic is the same as the input primary topic
     if verbose:
         logging.info(f"  Assigning base topic mix cols")
-    df_topic_mix_final = df_labels[l_ix].copy()
+    df_topic_mix_final = df_labels_[l_ix].copy()
     df_topic_mix_final[l_cols_new_topic_mix[:n_mix_start + 1]] = (
-        df_labels[l_cols_primary_topics[:n_mix_start + 1]].copy()
+        df_labels_[l_cols_primary_topics[:n_mix_start + 1]].copy()
     )
 
     # =====================
-    # Now get the deepest topic first
+    # Encode topics as ints & find the first time each topic shows up in each row
     # ===
-    # This way we know which ones stay the same, so we don't need to loop a bunch
-    # NOTE: slices & indexing do slightly different things
-    #  so I need to add or subtract by one to get the correct col name
+    # Mix cols use topics from the `n_mix_start` col up to (but excluding) the last col
     if verbose:
-        logging.info(f"  Creating deepest base topic mix col...")
-    ix_max_ = len(l_cols_primary_topics)  # max for slice = len(cols)
-    ix_col_max_ = ix_max_ - 1  # max to get final col name = len(cols) - 1
-    col_topic_mix_deep = l_cols_new_topic_mix[-1]
-
-    df_topic_mix_deepest = (
-        df_labels
-        [l_ix + l_cols_primary_topics[n_mix_start:ix_col_max_]]
-        .set_index(l_ix, append=False)
-        .stack()
-        .to_frame()
-        .reset_index()
-        .rename(columns={
-            'level_0': 'index',
-            'level_1': col_new_cluster_name,  # level_num depends on whether we drop index or include name
-            'level_2': col_new_cluster_name,
-            0: col_new_cluster_prim_topic
-        }
-        )
-
-        # sort by sub + majority topic level so we ensure order before dropping dupes
-        .sort_values(by=['subreddit_id', col_new_cluster_name], ascending=True)
-
-        # drop duplicates for sub + topic
-        .drop_duplicates(subset=['subreddit_id', col_new_cluster_prim_topic], keep='first')
-
-        # aggregate by subreddit & get a list of the topics
-        .groupby(l_ix)
-        .agg(
-            **{
-                col_topic_mix_deep: (col_new_cluster_prim_topic, list),
-                col_full_depth_mix_count: (col_new_cluster_prim_topic, 'nunique'),
-            }
-        )
-    )
-    # Convert the list column to a string
-    #  Use ' | '.join() instead of string replace to avoid replacing comas in primary topics
-    df_topic_mix_deepest[col_topic_mix_deep] = (
-        df_topic_mix_deepest[col_topic_mix_deep]
-        .apply(lambda x: ' | '.join(x))
-        .astype(str)
-        .str.replace("'", "")
-    )
-
-    # merge base + deeepest
-    df_topic_mix_final = df_topic_mix_final.merge(
-        df_topic_mix_deepest,
-        how='outer',
-        on=l_ix,
-    )
-
-    # ===
-    # Iterate through other subs that have mixed topics
-    mask_constant_topic_mix = df_topic_mix_final[col_full_depth_mix_count] == 1
-    mask_subreddits_with_multiple_topics = (
-        df_labels['subreddit_id'].isin(
-            df_topic_mix_final[~mask_constant_topic_mix]['subreddit_id']
-        )
+        logging.info(f"  Encoding topics & getting first occurrence of each topic...")
+    arr_topic_codes, topic_names = pd.factorize(
+        df_labels_[l_cols_primary_topics[n_mix_start:ix_col_max_]].to_numpy().ravel()
     )
-
-    # To optimize later, we could create columns in deepest to newest and only
-    #  calculate values for those that have multiple values... but for now
-    #  just iterate through all of them
-    # had to mess with +/- 1 here so that we don't calculate the same col twice
-
-    iter_cols = list(np.arange(n_mix_start + 1, ix_max_ - 1))[::-1]
+    n_depth = ix_col_max_ - n_mix_start
+    arr_topic_codes = arr_topic_codes.reshape(n_rows, n_depth)
+    # Remove apostrophes only from the final strings, after dropping duplicate topics
+    arr_topic_names = np.array([str(t_).replace("'", "") for t_ in topic_names], dtype=object)
+
+    # np.unique(return_index) gives the first flat position of each (row, topic) pair.
+    #  Because the flat array is row-major, that's the first column with that topic in that row
+    arr_row_topic_key = (
+        np.arange(n_rows, dtype=np.int64)[:, None] * (len(topic_names) + 1) + arr_topic_codes
+    ).ravel()
+    _, ix_first_flat = np.unique(arr_row_topic_key, return_index=True)
+    mask_first = np.zeros(n_rows * n_depth, dtype=bool)
+    mask_first[ix_first_flat] = True
+    mask_first &= (arr_topic_codes.ravel() >= 0)  # nulls don't count as topics
+    mask_first = mask_first.reshape(n_rows, n_depth)
+
+    # cumulative count of unique topics at each depth for each row
+    arr_unique_cum = np.cumsum(mask_first, axis=1)
+    arr_full_depth_count = arr_unique_cum[:, -1] if n_depth > 0 else np.zeros(n_rows, dtype=int)
+
+    # Build one string per first occurrence (each string extends the one before it
+    #  in the same row). Then each depth only needs to index the latest string
+    rows_first, cols_first = np.nonzero(mask_first)
+    names_first = arr_topic_names[arr_topic_codes[rows_first, cols_first]]
+    row_start = np.zeros(n_rows + 1, dtype=np.int64)
+    row_start[1:] = np.cumsum(arr_full_depth_count)
+    rank_first = np.arange(len(rows_first)) - row_start[rows_first]
+
+    arr_mix_strings = np.empty(len(rows_first), dtype=object)
+    arr_mix_current = np.empty(n_rows, dtype=object)
+    for rank_ in range(int(arr_full_depth_count.max()) if n_rows else 0):
+        mask_rank_ = rank_first == rank_
+        rows_rank_ = rows_first[mask_rank_]
+        if rank_ == 0:
+            arr_mix_current[rows_rank_] = names_first[mask_rank_]
+        else:
+            arr_mix_current[rows_rank_] = arr_mix_current[rows_rank_] + ' | ' + names_first[mask_rank_]
+        arr_mix_strings[mask_rank_] = arr_mix_current[rows_rank_]
+
+    def _get_mix_at_depth(depth_: int) -> np.ndarray:
+        """Topic mix using topic cols [n_mix_start, n_mix_start + depth_]. Null if no topics"""
+        counts_ = arr_unique_cum[:, depth_]
+        mix_ = np.full(n_rows, np.nan, dtype=object)
+        mask_ = counts_ > 0
+        mix_[mask_] = arr_mix_strings[row_start[:-1][mask_] + counts_[mask_] - 1]
+        return mix_
+
+    # Deepest mix & count of unique topics. Subreddits without topics get nulls
+    col_topic_mix_deep = l_cols_new_topic_mix[-1]
+    mask_any_topic = arr_full_depth_count > 0
+    arr_mix_deep = _get_mix_at_depth(n_depth - 1)
+    arr_count_deep = arr_full_depth_count.astype(int)
+    if not mask_any_topic.all():
+        arr_count_deep = np.where(mask_any_topic, arr_count_deep, np.nan)
+    df_topic_mix_final[col_topic_mix_deep] = arr_mix_deep
+    df_topic_mix_final[col_full_depth_mix_count] = arr_count_deep
+
+    # Intermediate depths. Subreddits with a single topic use the deepest mix
+    mask_constant_topic_mix = arr_full_depth_count == 1
+    iter_cols = list(np.arange(n_mix_start + 1, ix_max_ - 1))
     if tqdm_log_col_iterations:
-        # only use TQDM if verbose=True, otherwise we can get a long list of tqdm progress bars
         iter_cols = tqdm(iter_cols)
     if verbose:
-        logging.info(f"  Iterating through additional subs with multiple topics...")
+        logging.info(f"  Assigning topic mix for intermediate depths...")
     for ix_col_ in iter_cols:
-        ix_slice_end_ = ix_col_ + 1
-        col_topic_mix_iter_ = l_cols_new_topic_mix[ix_col_]
-
-        df_mix_iter_ = (
-            df_labels[mask_subreddits_with_multiple_topics]
-            [l_ix + l_cols_primary_topics[n_mix_start:ix_slice_end_]]
-            .set_index(l_ix, append=False)
-            .stack()
-            .to_frame()
-            .reset_index()
-            .rename(
-                columns={
-                    'level_0': 'index',
-                    'level_1': col_new_cluster_name,  # level_num depends on whether we drop index or include name
-                    'level_2': col_new_cluster_name,
-                    0: col_new_cluster_prim_topic
-                }
-            )
-            # sort by sub + majority topic level so we ensure order before dropping dupes
-            .sort_values(by=['subreddit_id', col_new_cluster_name], ascending=True)
-
-            # drop duplicates for sub + topic
-            .drop_duplicates(subset=['subreddit_id', col_new_cluster_prim_topic], keep='first')
-
-            # aggregate by subreddit & get a list of the topics
-            .groupby(l_ix)
-            .agg(
-                **{
-                    col_topic_mix_iter_: (col_new_cluster_prim_topic, list),
-                }
-            )
-        )
-
-        # Convert the list column to a string
-        #  Use ' | '.join() instead of string replace to avoid replacing comas in primary topics
-        df_mix_iter_[col_topic_mix_iter_] = (
-            df_mix_iter_[col_topic_mix_iter_]
-            .apply(lambda x: ' | '.join(x))
-            .astype(str)
-            .str.replace("'", "")
-        )
-
-        # merge base + current iter
-        df_topic_mix_final = df_topic_mix_final.merge(
-            df_mix_iter_,
-            how='outer',
-            on=l_ix,
-        )
-    del df_mix_iter_
+        mix_ = _get_mix_at_depth(ix_col_ - n_mix_start)
+        mix_[mask_constant_topic_mix] = arr_mix_deep[mask_constant_topic_mix]
+        df_topic_mix_final[l_cols_new_topic_mix[ix_col_]] = mix_
 
-    # ===
-    # Finally, assign the topics for subs that have a constant topic
-    df_topic_mix_final.loc[
-        mask_constant_topic_mix,
-        l_cols_new_topic_mix[n_mix_start + 1: -1]
-    ] = df_topic_mix_final[mask_constant_topic_mix][col_topic_mix_deep]
-
-    gc.collect()
     return df_topic_mix_final[
         reorder_array(l_ix + [col_full_depth_mix_count] + l_cols_new_topic_mix,
                       df_topic_mix_final.columns)
@@ -711,11 +675,19 @@ def convert_distance_or_ab_to_list_for_fpr(
         col_primary_topic: str = 'primary_topic',
         col_sort_by: str = None,
         verbose: bool = False,
+        method: str = 'cluster_slices',
 ) -> pd.DataFrame:
     """Take a df_distances or df_ab and reshape it to get output needed for an FPR
     TODO(djb): this might be better as a method for a cluster class... right now each function feels
       disjointed and I need to pass the same column names back and forth a few times
+
+    method:
+        'cluster_slices': sort by cluster once & slice each seed's cluster (see `get_seed_to_cluster_lists_df()`)
+        'merge': self-merge on the cluster label, creates sum(cluster_size^2) rows
     """
+    if method not in ['cluster_slices', 'merge']:
+        raise NotImplementedError(f"Method not implemented: {method}")
+
     if convert_to_ab:
         if l_cols_for_seeds is None:
             l_cols_for_seeds = [
@@ -738,27 +710,28 @@ def convert_distance_or_ab_to_list_for_fpr(
             print(l_cols_for_seeds)
             print(l_cols_for_clusters)
 
-        df_ab = (
-            df[l_cols_for_seeds].copy()
-            .merge(
-                df[l_cols_for_clusters],
-                how='left',
-                on=[col_new_cluster_val],
-                suffixes=('_seed', '_cluster')
-            )
-        )
-        if verbose:
-            print(f"  {df_ab.shape} <- df_ab.shape raw")
         # Set name of columns to be used for aggregation
         col_sub_name_a = 'subreddit_name_seed'
         col_sub_id_a = 'subreddit_id_seed'
         col_sub_name_b = 'subreddit_name_cluster'
         col_sub_id_b = 'subreddit_id_cluster'
-        # Remove matches to self b/c that makes no sense as a recommendation
-        df_ab = df_ab[
-            df_ab[col_sub_id_a] != df_ab[col_sub_id_b]
-            ]
-        print(f"  {df_ab.shape} <- df_ab.shape after removing matches to self")
+        if method == 'merge':
+            df_ab = (
+                df[l_cols_for_seeds].copy()
+                .merge(
+                    df[l_cols_for_clusters],
+                    how='left',
+                    on=[col_new_cluster_val],
+                    suffixes=('_seed', '_cluster')
+                )
+            )
+            if verbose:
+                print(f"  {df_ab.shape} <- df_ab.shape raw")
+            # Remove matches to self b/c that makes no sense as a recommendation
+            df_ab = df_ab[
+                df_ab[col_sub_id_a] != df_ab[col_sub_id_b]
+                ]
+            print(f"  {df_ab.shape} <- df_ab.shape after removing matches to self")
     else:
         raise NotImplementedError(f"reshape for df_distances not implemented")
 
@@ -777,17 +750,33 @@ def convert_distance_or_ab_to_list_for_fpr(
     if verbose:
         print(f"  Groupby cols:\n    {l_groupby_cols}")
 
-    df_a_to_b_list = (
-        df_ab
-        .groupby(l_groupby_cols)
-        .agg(
-            **{
-                col_counterpart_count: (col_sub_id_b, 'nunique'),
-                col_list_cluster_names: (col_sub_name_b, list),
-                col_list_cluster_ids: (col_sub_id_b, list),
-            }
+    if method == 'merge':
+        df_a_to_b_list = (
+            df_ab
+            .groupby(l_groupby_cols)
+            .agg(
+                **{
+                    col_counterpart_count: (col_sub_id_b, 'nunique'),
+                    col_list_cluster_names: (col_sub_name_b, list),
+                    col_list_cluster_ids: (col_sub_id_b, list),
+                }
+            )
+            .reset_index()
         )
-        .reset_index()
+    else:
+        df_a_to_b_list = get_seed_to_cluster_lists_df(
+            df,
+            l_cols_for_seeds=l_cols_for_seeds,
+            l_cols_for_clusters=l_cols_for_clusters,
+            l_groupby_cols=l_groupby_cols,
+            col_new_cluster_val=col_new_cluster_val,
+            col_counterpart_count=col_counterpart_count,
+            col_list_cluster_names=col_list_cluster_names,
+            col_list_cluster_ids=col_list_cluster_ids,
+            suffixes=('_seed', '_cluster'),
+        )
+    df_a_to_b_list = (
+        df_a_to_b_list
         # .rename(columns={'subreddit_name_a': 'subreddit_name_de',
         #                  'subreddit_id_a': 'subreddit_id_de'})
         .sort_values(by=[col_sort_by, ], ascending=True)
@@ -807,38 +796,345 @@ def convert_distance_or_ab_to_list_for_fpr(
     return df_a_to_b_list
 
 
-def create_linkage_for_dendrogram(model) -> pd.DataFrame:
+def get_cluster_lists_for_seeds(
+        df: pd.DataFrame,
+        col_new_cluster_val: str = 'cluster_label',
+        col_subreddit_id: str = 'subreddit_id',
+        mask_candidates: Union[pd.Series, np.ndarray] = None,
+        mask_seeds: Union[pd.Series, np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """For each seed (row), get the other subreddits in its cluster without a self-merge.
+
+    A self-merge on the cluster label creates sum(cluster_size^2) rows with all the seed
+    columns. Instead, we sort the candidates by cluster once & each seed's list is
+    its cluster's slice minus the seed itself, so memory & time only grow with the
+    size of the output lists.
+    The order of each list is the same as the input order (same as the merge).
+
+    Args:
+        df: 1 row = 1 subreddit
+        col_new_cluster_val: cluster column
+        col_subreddit_id: ID column, used to remove the seed from its own list
+        mask_candidates: rows that can be in the lists (e.g., subs we can recommend). Default: all
+        mask_seeds: rows to use as seeds. Default: all
+
+    Returns:
+        ix_seeds: row positions of the seeds, sorted by cluster.
+            Seeds with empty lists or without a cluster are excluded.
+        counts: number of unique IDs in each seed's list
+        list_offsets: (n_seeds + 1) the list for seed i is ix_items[list_offsets[i]:list_offsets[i + 1]]
+        ix_items: row positions of the items in all lists
+    """
+    n_rows = len(df)
+    cluster_codes, cluster_uniques = pd.factorize(df[col_new_cluster_val])
+    id_codes, _ = pd.factorize(df[col_subreddit_id])
+
+    mask_candidates = (
+        np.ones(n_rows, dtype=bool) if mask_candidates is None else np.asarray(mask_candidates, dtype=bool)
+    )
+    mask_seeds = np.ones(n_rows, dtype=bool) if mask_seeds is None else np.asarray(mask_seeds, dtype=bool)
+
+    # candidates grouped by cluster. stable sort keeps the input order in each cluster
+    ix_cand = np.flatnonzero(mask_candidates & (cluster_codes >= 0))
+    ix_cand = ix_cand[np.argsort(cluster_codes[ix_cand], kind='stable')]
+    cluster_sizes = np.bincount(cluster_codes[ix_cand], minlength=len(cluster_uniques))
+    cluster_starts = np.cumsum(cluster_sizes) - cluster_sizes
+
+    ix_seeds = np.flatnonzero(mask_seeds & (cluster_codes >= 0))
+    ix_seeds = ix_seeds[np.argsort(cluster_codes[ix_seeds], kind='stable')]
+    seed_clusters = cluster_codes[ix_seeds]
+    seed_sizes = cluster_sizes[seed_clusters]
+
+    # Expand each seed to its cluster's slice: item j of seed i -> ix_cand[start_i + j]
+    seed_of_item = np.repeat(np.arange(len(ix_seeds)), seed_sizes)
+    item_starts = np.cumsum(seed_sizes) - seed_sizes
+    pos_in_cluster = np.arange(seed_sizes.sum()) - item_starts[seed_of_item]
+    ix_items = ix_cand[cluster_starts[seed_clusters][seed_of_item] + pos_in_cluster]
+
+    # Remove matches to self (by ID, same as `id_seed != id_cluster`; null IDs never match)
+    item_id_codes = id_codes[ix_items]
+    mask_keep = (item_id_codes != id_codes[ix_seeds][seed_of_item]) | (item_id_codes < 0)
+    ix_items = ix_items[mask_keep]
+    seed_of_item = seed_of_item[mask_keep]
+
+    # Drop seeds with empty lists (e.g., orphans or clusters without candidates)
+    list_lens = np.bincount(seed_of_item, minlength=len(ix_seeds))
+    mask_non_empty = list_lens > 0
+    ix_seeds = ix_seeds[mask_non_empty]
+    list_lens = list_lens[mask_non_empty]
+    list_offsets = np.zeros(len(list_lens) + 1, dtype=np.int32)
+    np.cumsum(list_lens, out=list_offsets[1:])
+
+    if (id_codes >= 0).all() and (id_codes.max(initial=-1) + 1 == n_rows):
+        # IDs are unique & not null, so each list has unique IDs
+        counts = list_lens
+    else:
+        item_id_codes = item_id_codes[mask_keep]
+        counts = (
+            pd.Series(np.where(item_id_codes >= 0, item_id_codes, np.nan))
+            .groupby(seed_of_item).nunique()
+            .to_numpy()
+        )
+
+    return ix_seeds, counts, list_offsets, ix_items
+
+
+def get_cluster_list_arrays_for_seeds(
+        df: pd.DataFrame,
+        l_cols_lists: List[str],
+        col_new_cluster_val: str = 'cluster_label',
+        col_subreddit_id: str = 'subreddit_id',
+        mask_candidates: Union[pd.Series, np.ndarray] = None,
+        mask_seeds: Union[pd.Series, np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, pa.ListArray]]:
+    """Same as `get_cluster_lists_for_seeds()`, but return the lists as Arrow list columns:
+        {col: pa.ListArray} with the values of each col in l_cols_lists for each seed's list
+    Use them to build a pa.Table or write parquet without creating a python list per seed.
+    """
+    ix_seeds, counts, list_offsets, ix_items = get_cluster_lists_for_seeds(
+        df,
+        col_new_cluster_val=col_new_cluster_val,
+        col_subreddit_id=col_subreddit_id,
+        mask_candidates=mask_candidates,
+        mask_seeds=mask_seeds,
+    )
+    offsets_ = pa.array(list_offsets, type=pa.int32())
+    d_lists = {
+        c_: pa.ListArray.from_arrays(offsets_, pa.array(df[c_].to_numpy()[ix_items], from_pandas=True))
+        for c_ in l_cols_lists
+    }
+    return ix_seeds, counts, d_lists
+
+
+def get_seed_to_cluster_lists_df(
+        df: pd.DataFrame,
+        l_cols_for_seeds: List[str],
+        l_cols_for_clusters: List[str],
+        l_groupby_cols: List[str],
+        col_new_cluster_val: str = 'cluster_label',
+        col_counterpart_count: str = 'counterpart_count',
+        col_list_cluster_names: str = 'list_cluster_subreddit_names',
+        col_list_cluster_ids: str = 'list_cluster_subreddit_ids',
+        mask_candidates: Union[pd.Series, np.ndarray] = None,
+        suffixes: Tuple[str, str] = ('_seed', '_cluster'),
+) -> pd.DataFrame:
+    """Same output as self-merging seeds & clusters on `col_new_cluster_val`, removing matches to self
+    & then `.groupby(l_groupby_cols).agg(count, list of names, list of IDs).reset_index()`
+    but using `get_cluster_lists_for_seeds()`.
+
+    Seed cols that are also cluster cols get suffixes[0], like in the merge.
+    """
+    d_rename_seeds = {
+        c: f"{c}{suffixes[0]}" for c in l_cols_for_seeds
+        if (c in l_cols_for_clusters) and (c != col_new_cluster_val)
+    }
+    d_rename_inverse = {v: k for k, v in d_rename_seeds.items()}
+    l_cols_seeds_src = [d_rename_inverse.get(c, c) for c in l_groupby_cols]
+
+    ix_seeds, counts, list_offsets, ix_items = get_cluster_lists_for_seeds(
+        df,
+        col_new_cluster_val=col_new_cluster_val,
+        mask_candidates=mask_candidates,
+        # groupby() drops rows with nulls in any groupby column, so these seeds don't get lists
+        mask_seeds=df[l_cols_seeds_src].notna().all(axis=1).to_numpy(),
+    )
+
+    df_out = (
+        df[l_cols_seeds_src].iloc[ix_seeds]
+        .rename(columns=d_rename_seeds)
+        .reset_index(drop=True)
+    )
+    df_out[col_counterpart_count] = counts
+    # slices of object arrays reuse the input strings (no new python objects per item)
+    for col_list_, col_ in [(col_list_cluster_names, 'subreddit_name'), (col_list_cluster_ids, 'subreddit_id')]:
+        values_ = df[col_].to_numpy()[ix_items]
+        df_out[col_list_] = [
+            values_[start_:end_].tolist() for start_, end_ in zip(list_offsets[:-1], list_offsets[1:])
+        ]
+
+    # groupby() sorts by the groupby keys
+    return df_out.sort_values(by=l_groupby_cols).reset_index(drop=True)
+
+
+def get_linkage_counts(
+        children: np.ndarray,
+        n_samples: int,
+        max_rounds_vectorized: int = 64,
+) -> np.ndarray:
+    """Count leaves under each merge of an sklearn `children_` array.
+
+    Merges are resolved in "waves": each round fills in every merge whose 2 children
+    are already known, using array indexing instead of a python loop per merge.
+    Balanced trees (e.g., ward) finish in ~log(N) rounds. If the tree is deep (chain-like)
+    and rounds stop making progress, we finish the remaining merges with a single pass
+    in merge order (children always come before parents).
+    """
+    children = np.asarray(children, dtype=np.int64)
+    n_merges = children.shape[0]
+    node_counts = np.zeros(n_samples + n_merges, dtype=np.int64)
+    node_counts[:n_samples] = 1
+    resolved = np.zeros(n_samples + n_merges, dtype=bool)
+    resolved[:n_samples] = True
+
+    pending = np.arange(n_merges)
+    n_rounds = 0
+    while pending.size > 0:
+        c_pending = children[pending]
+        mask_ready = resolved[c_pending[:, 0]] & resolved[c_pending[:, 1]]
+        ix_ready = pending[mask_ready]
+        c_ready = c_pending[mask_ready]
+        node_counts[n_samples + ix_ready] = node_counts[c_ready[:, 0]] + node_counts[c_ready[:, 1]]
+        resolved[n_samples + ix_ready] = True
+        pending = pending[~mask_ready]
+
+        n_rounds += 1
+        if (n_rounds >= max_rounds_vectorized) and (ix_ready.size < 0.01 * pending.size):
+            break
+
+    if pending.size > 0:
+        l_counts = node_counts.tolist()
+        for i, (c0, c1) in zip(pending.tolist(), children[pending].tolist()):
+            l_counts[n_samples + i] = l_counts[c0] + l_counts[c1]
+        node_counts = np.asarray(l_counts, dtype=np.int64)
+
+    return node_counts[n_samples:]
+
+
+def create_linkage_for_dendrogram(
+        model,
+        X: np.ndarray = None,
+        method: str = 'numpy',
+) -> pd.DataFrame:
     """
     Create linkage matrix from an Sklearn model (e.g., AgglomerativeCluster)
     We can use this matrix to plot a dendogram and create cluster labels using fcluster.
+
+    Args:
+        model: fitted sklearn model with `children_` & `distances_`.
+            Ignored for the scipy path.
+        X: vectors to cluster. Only needed for the scipy path
+        method:
+            'numpy':        leaf counts with `get_linkage_counts()`
+            'scipy_ward':   skip sklearn and get linkage from `scipy...hierarchy.ward(X)`.
+                            sklearn calls the same function for unconstrained ward, so
+                            use it when we only need the tree (e.g., ad-hoc analysis).
+                            Opt-in only: `ClusterEmbeddings` always uses 'numpy' because
+                            its model is already fitted & this would cluster X again.
     """
-    # create the counts of samples under each node
-    counts = np.zeros(model.children_.shape[0])
-    n_samples = len(model.labels_)
-    for i, merge in enumerate(model.children_):
-        current_count = 0
-        for child_idx in merge:
-            if child_idx < n_samples:
-                current_count += 1  # leaf node
-            else:
-                current_count += counts[child_idx - n_samples]
-        counts[i] = current_count
-
-    linkage_matrix = pd.DataFrame(
-        np.column_stack(
-            [model.children_,
-             model.distances_,
-             counts]
-        ),
-        columns=['children_0', 'children_1', 'distance', 'count'],
-    ).astype({
+    l_cols = ['children_0', 'children_1', 'distance', 'count']
+    d_dtypes = {
         'children_0': int,
         'children_1': int,
         'distance': float,
         'count': int,
-    })
+    }
+    if method == 'scipy_ward':
+        if X is None:
+            raise ValueError(f"X is required to create the linkage with scipy")
+        return pd.DataFrame(ward(np.asarray(X, dtype=np.float64)), columns=l_cols).astype(d_dtypes)
+
+    elif method == 'numpy':
+        children = np.asarray(model.children_)
+        # Leaves can be pre-clusters instead of rows, so check n_leaves_ before labels_
+        if hasattr(model, 'n_leaves_'):
+            n_samples = model.n_leaves_
+        elif hasattr(model, 'labels_'):
+            n_samples = len(model.labels_)
+        else:
+            n_samples = children.shape[0] + 1
+        return pd.DataFrame(
+            {
+                'children_0': children[:, 0],
+                'children_1': children[:, 1],
+                'distance': model.distances_,
+                'count': get_linkage_counts(children, n_samples),
+            },
+            columns=l_cols,
+        ).astype(d_dtypes)
+
+    else:
+        raise NotImplementedError(f"Linkage method not implemented: {method}")
+
 
-    return linkage_matrix
+def fcluster_multi_k(
+        Z: Union[pd.DataFrame, np.ndarray],
+        ks: List[int],
+) -> np.ndarray:
+    """Get flat cluster labels for multiple k-values with a single pass over the tree.
+
+    Same output as calling `fcluster(Z, k, criterion='maxclust')` for each k, but
+    instead of traversing the whole tree once per k we:
+    - sort merges by the max distance in their subtree (scipy's `maxdists()`; same as
+      the merge distance when distances are monotonic, like in ward)
+    - sweep k from largest (fewest merges) to smallest & apply merges incrementally
+      with a union-find (parent array + path compression)
+    - number clusters in the same depth-first order that fcluster uses
+
+    Because all k's cut the same tree, labels are nested: every cluster at a larger k
+    falls inside exactly one cluster at any smaller k.
+
+    For k >= n_leaves - 1 we call fcluster once & re-use its labels. Its binary search
+    over thresholds always applies the two lowest merges (& their ties), so it returns
+    the same labels (fewer than k clusters) for all of those k's. This can happen when
+    a model has fewer leaves than the k's we evaluate (e.g., pre-clusters).
+
+    Returns:
+        int32 array with shape (n_leaves, len(ks)). Column j has labels for ks[j]
+    """
+    Z = np.asarray(Z, dtype=np.float64)
+    n_leaves = Z.shape[0] + 1
+    children = Z[:, :2].astype(np.int64)
+
+    # merges in the order fcluster thresholds would add them
+    #  stable sort keeps children before parents when there are ties
+    merge_dists = maxdists(Z)
+    merge_order = np.argsort(merge_dists, kind='stable')
+    dists_sorted = merge_dists[merge_order]
+
+    # fcluster numbers clusters in depth-first order, but at each node it visits
+    #  non-leaf children before leaf children. Swap children so leaves_list() matches it
+    Z_visit_order = Z.copy()
+    mask_swap = (Z[:, 0] < n_leaves) & (Z[:, 1] >= n_leaves)
+    Z_visit_order[mask_swap, 0], Z_visit_order[mask_swap, 1] = Z[mask_swap, 1], Z[mask_swap, 0]
+    leaves_order = leaves_list(Z_visit_order)
+
+    parent = np.arange(2 * n_leaves - 1)
+    labels_out = np.empty((n_leaves, len(ks)), dtype=np.int32)
+    n_merges_applied = 0
+    labels_max_k = None
+
+    for j, k_ in sorted(enumerate(ks), key=lambda t_: -t_[1]):
+        if k_ >= n_leaves - 1:
+            # fcluster doesn't return one cluster per leaf here, see docstring
+            if labels_max_k is None:
+                labels_max_k = fcluster(Z, n_leaves - 1, criterion='maxclust')
+            labels_out[:, j] = labels_max_k
+            continue
+        else:
+            # smallest threshold that leaves <= k clusters. Ties get merged together
+            thresh_ = dists_sorted[n_leaves - max(k_, 1) - 1]
+            n_merges = int(np.searchsorted(dists_sorted, thresh_, side='right'))
+
+        ix_merges = merge_order[n_merges_applied:n_merges]
+        parent[children[ix_merges, 0]] = n_leaves + ix_merges
+        parent[children[ix_merges, 1]] = n_leaves + ix_merges
+        n_merges_applied = max(n_merges, n_merges_applied)
+
+        # path compression: after this, every node points to its current root
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+        # clusters are contiguous in leaf order, so count root changes in that order
+        roots_in_order = parent[leaves_order]
+        new_cluster = np.empty(n_leaves, dtype=bool)
+        new_cluster[0] = True
+        new_cluster[1:] = roots_in_order[1:] != roots_in_order[:-1]
+        labels_out[leaves_order, j] = np.cumsum(new_cluster)
+
+    return labels_out
 
 
 def fancy_dendrogram(
@@ -0,0 +1,190 @@
+"""
+Write per-country FPR outputs as Hive-partitioned parquet datasets:
+    {root_uri}/{dataset_name}/country_code=MX/part-0.parquet
+    {root_uri}/{dataset_name}/country_code=BR/part-0.parquet
+
+- All partitions in a dataset use the same pyarrow schema. If we don't have a fixed
+  schema for a dataset, we infer it from the data & promote null (all-None) columns
+  once another country has values for them
+- Files are uploaded in a thread pool, so we don't wait for each upload before
+  starting the next country
+- Load each dataset into BigQuery with a single load job (`{dataset}/*.parquet`),
+  see `subclu.utils.big_query_utils.TableLoader`
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import logging
+from logging import info
+import posixpath
+import threading
+from typing import Dict, List, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+log = logging.getLogger(__name__)
+
+
+class PartitionedParquetWriter:
+    """Accumulate dataframes into Hive-partitioned parquet datasets.
+
+    If a dataset doesn't have a schema in `d_schemas`, the schema of the first
+    partition we add becomes the schema for the rest of the dataset. An all-None
+    object column has type null in pyarrow, so null fields get the type from the
+    first partition that has values for them. Partitions with null fields are only
+    written in `close()`, after we know the final types (still null -> string).
+    """
+    def __init__(
+            self,
+            root_uri: str,
+            d_schemas: Dict[str, pa.Schema] = None,
+            partition_col: str = 'country_code',
+            n_threads: int = 8,
+    ):
+        # import here, fsspec comes with gcsfs
+        import fsspec
+
+        self.root_uri = root_uri
+        self.fs, self.root_path = fsspec.core.url_to_fs(root_uri)
+        self.protocol = root_uri.split('://')[0] if '://' in root_uri else None
+        self.d_schemas = {k: v for k, v in (d_schemas or dict()).items() if v is not None}
+        self.l_fixed_schemas = list(self.d_schemas.keys())
+        self.partition_col = partition_col
+        self.n_threads = n_threads
+
+        self._executor = ThreadPoolExecutor(max_workers=n_threads)
+        self._lock = threading.Lock()
+        self._d_futures = dict()
+        self._l_deferred = list()
+        self.l_files_written = list()
+        self.l_errors = list()
+
+    def get_partition_path(
+            self,
+            dataset_name: str,
+            partition_value: str,
+    ) -> str:
+        return posixpath.join(
+            self.root_path, dataset_name, f"{self.partition_col}={partition_value}", 'part-0.parquet'
+        )
+
+    def get_dataset_uri(
+            self,
+            dataset_name: str,
+    ) -> str:
+        path_ = posixpath.join(self.root_path, dataset_name)
+        return path_ if self.protocol is None else f"{self.protocol}://{path_}"
+
+    def to_table(
+            self,
+            dataset_name: str,
+            df: pd.DataFrame,
+    ) -> pa.Table:
+        """Convert df to a pyarrow table with the dataset's schema"""
+        if dataset_name in self.l_fixed_schemas:
+            return pa.Table.from_pandas(df, schema=self.d_schemas[dataset_name], preserve_index=False)
+
+        schema_df = pa.Table.from_pandas(df, preserve_index=False).schema.remove_metadata()
+        with self._lock:
+            schema = promote_null_fields(
+                self.d_schemas.setdefault(dataset_name, schema_df),
+                schema_df,
+            )
+            self.d_schemas[dataset_name] = schema
+        return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+    def add(
+            self,
+            dataset_name: str,
+            partition_value: str,
+            df: pd.DataFrame,
+    ) -> None:
+        """Convert df now (errors show up for this country) & upload it in the background"""
+        table = self.to_table(dataset_name, df)
+        if any(pa.types.is_null(t_) for t_ in table.schema.types):
+            # wait until we know the type of the null fields, otherwise some partitions
+            #  would have a different schema
+            with self._lock:
+                self._l_deferred.append((dataset_name, partition_value, table))
+            return
+        self._submit(dataset_name, partition_value, table)
+
+    def _submit(
+            self,
+            dataset_name: str,
+            partition_value: str,
+            table: pa.Table,
+    ) -> None:
+        path_ = self.get_partition_path(dataset_name, partition_value)
+        f_ = self._executor.submit(self._write_table, table, path_)
+        with self._lock:
+            self._d_futures[f_] = (dataset_name, partition_value, path_)
+
+    def _write_table(
+            self,
+            table: pa.Table,
+            path: str,
+    ) -> None:
+        self.fs.makedirs(posixpath.dirname(path), exist_ok=True)
+        with self.fs.open(path, 'wb') as f_:
+            pq.write_table(table, f_)
+
+    def close(self) -> List[Tuple[str, str, str]]:
+        """Wait for all uploads to finish.
+        Returns: list of (dataset_name, partition_value, error) for files that failed
+        """
+        with self._lock:
+            l_deferred = self._l_deferred
+            self._l_deferred = list()
+        for dataset_name, partition_value, table in l_deferred:
+            try:
+                schema = promote_null_fields(self.d_schemas[dataset_name], default_type=pa.string())
+                self._submit(dataset_name, partition_value, table.cast(schema))
+            except Exception as e:
+                logging.error(f"**+++!! ERROR saving {dataset_name} for {partition_value} **+++!!")
+                logging.error(f"**+++!!\n\n {e} \n\n **+++!!", exc_info=e)
+                self.l_errors.append((dataset_name, partition_value, str(e)))
+
+        with self._lock:
+            d_futures = dict(self._d_futures)
+            self._d_futures = dict()
+        wait(list(d_futures.keys()))
+        for f_, (dataset_name, partition_value, path_) in d_futures.items():
+            e = f_.exception()
+            if e is None:
+                self.l_files_written.append(path_)
+            else:
+                logging.error(f"**+++!! ERROR saving {dataset_name} for {partition_value} **+++!!")
+                logging.error(f"**+++!!\n\n {e} \n\n **+++!!", exc_info=e)
+                self.l_errors.append((dataset_name, partition_value, str(e)))
+        self._executor.shutdown(wait=True)
+        info(f"  {len(self.l_files_written)} parquet files saved to: {self.root_uri}")
+        return self.l_errors
+
+
+def promote_null_fields(
+        schema: pa.Schema,
+        schema_new: pa.Schema = None,
+        default_type: pa.DataType = None,
+) -> pa.Schema:
+    """Replace null fields in `schema` with the type of the same field in `schema_new`.
+    If `default_type` is set, use it for null fields that are missing/null in `schema_new`.
+    Fields that already have a (non-null) type don't change.
+    """
+    for i_, field_ in enumerate(schema):
+        type_new = None
+        if schema_new is not None:
+            ix_new = schema_new.get_field_index(field_.name)
+            if ix_new != -1:
+                type_new = schema_new.field(ix_new).type
+        if (type_new is None) or pa.types.is_null(type_new):
+            type_new = default_type
+        if pa.types.is_null(field_.type) and (type_new is not None):
+            schema = schema.set(i_, field_.with_type(type_new))
+    return schema
+
+
+#
+# ~ fin
+#
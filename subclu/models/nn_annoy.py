@@ -9,6 +9,8 @@ import annoy
 import pandas as pd
 from tqdm import tqdm
 
+from ..utils.embeddings_storage import get_embeddings_array
+
 
 class AnnoyIndex():
     def __init__(
@@ -28,17 +30,23 @@ class AnnoyIndex():
         Ideally it's subreddit_id because subreddit_name can change over time.
 
         We might need to convert vectors to float 32, if they're not already float32
+
+        Vectors can be wide columns (one per dimension) or a single nested column
+        with one array per row (fixed_size_list storage format).
         """
         if index_cols == 'default':
             index_cols = ['subreddit_id', 'subreddit_name']
 
-        rows_, cols_ = df_vectors.drop(index_cols, axis=1).shape
+        df_embeddings_ = df_vectors.drop(index_cols, axis=1)
+        self.vectors = get_embeddings_array(
+            df_embeddings_, embedding_cols=list(df_embeddings_.columns),
+        )  # vectors.astype('float32')
+        rows_, cols_ = self.vectors.shape
         self.n_dimension = cols_
         self.n_rows = rows_
 
         self.metric = metric
         self.n_trees = n_trees
-        self.vectors = df_vectors.drop(index_cols, axis=1).to_numpy()  # vectors.astype('float32')
 
         self.index = None
         self.index_labels = df_vectors[index_cols[0]].to_list()
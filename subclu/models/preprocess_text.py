@@ -3,6 +3,7 @@ Utils to preprocess text.
 Using classes/functions/pipelines makes it easier to make sure
 we apply the same preprocessing at training & inference.
 """
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 from logging import info
 import re
@@ -19,6 +20,16 @@ import pandas as pd
 from sklearn.base import BaseEstimator, TransformerMixin
 
 
+# Compile regexes once at import time instead of on every call
+D_REGEX = {
+    'sklearn': re.compile(r"(?u)\b\w\w+\b"),
+    'sklearn_acronyms': re.compile(r"(?u)\b\w\w+\b|\b\w\.\w\.\w|\b\w\.\w"),
+    'sklearn_emoji': re.compile(fr"(?u)\b\w\w+\b|[^\w\s\\{string.punctuation}]"),
+    'sklearn_acronyms_emoji': re.compile(fr"(?u)\b\w\w+\b|\b\w\.\w\.\w|\b\w\.\w|[^\w\s\\{string.punctuation}]"),
+}
+RE_DIGITS = re.compile(r"\d")
+
+
 class TextPreprocessor(BaseEstimator, TransformerMixin):
     """"""
     # custom class to preprocess text before passing it
@@ -32,13 +43,24 @@ class TextPreprocessor(BaseEstimator, TransformerMixin):
             return_fse_format: bool = True,
             fse_format=CSplitCIndexedList,
             verbose: bool = True,
+            n_jobs: int = 1,
+            chunk_rows: int = 100000,
     ):
+        """
+        If `tokenizer_function` is the name of a built-in tokenizer (e.g., 'sklearn', 'split'),
+        transform() tokenizes the whole Series at once with `tokenize_series()`.
+        For large Series set `n_jobs` > 1 to tokenize chunks in a process pool.
+        """
         self.lowercase = lowercase
         self.remove_digits = remove_digits
         self.return_fse_format = return_fse_format
         self.fse_format = fse_format
         self.verbose = verbose
+        self.n_jobs = n_jobs
+        self.chunk_rows = chunk_rows
 
+        # Keep the name so we can use the vectorized tokenizer in transform()
+        self.tokenizer_name = tokenizer_function if isinstance(tokenizer_function, str) else None
         if tokenizer_function is not None:
             self.tokenizer_function = partial(
                 transform_and_tokenize_text, tokenizer=tokenizer_function)
@@ -84,10 +106,7 @@ class TextPreprocessor(BaseEstimator, TransformerMixin):
         if self.remove_digits:
             if self.verbose:
                 info(f"Removing digits...")
-            re_remove_digits = re.compile(r"\d")
-            X_transformed = X_transformed.apply(
-                lambda text_: re.sub(re_remove_digits, '', text_)
-            )
+            X_transformed = X_transformed.str.replace(RE_DIGITS, '', regex=True)
         # if self.return_fse_format:
         #     # TODO(djb): maybe this should belong to the fse/USIF model
         #     #  so that I can create the lookup dict functions inside of
@@ -96,7 +115,16 @@ class TextPreprocessor(BaseEstimator, TransformerMixin):
         #     logging.warning(f"FSE NOT IMPLEMENTED YET")
         #     raise NotImplementedError
         # else:
-        if self.tokenizer_function is not None:
+        if self.tokenizer_name is not None:
+            # lowercase was already applied above
+            return tokenize_series(
+                X_transformed,
+                tokenizer=self.tokenizer_name,
+                lowercase=False,
+                n_jobs=self.n_jobs,
+                chunk_rows=self.chunk_rows,
+            )
+        elif self.tokenizer_function is not None:
             return X_transformed.apply(self.tokenizer_function)
         else:
             return X_transformed
@@ -138,12 +166,6 @@ def transform_and_tokenize_text(
     Returns:
 
     """
-    D_REGEX = {
-        'sklearn': re.compile(r"(?u)\b\w\w+\b"),
-        'sklearn_acronyms': re.compile(r"(?u)\b\w\w+\b|\b\w\.\w\.\w|\b\w\.\w"),
-        'sklearn_emoji': re.compile(fr"(?u)\b\w\w+\b|[^\w\s\\{string.punctuation}]"),
-        'sklearn_acronyms_emoji': re.compile(fr"(?u)\b\w\w+\b|\b\w\.\w\.\w|\b\w\.\w|[^\w\s\\{string.punctuation}]"),
-    }
     try:
         # exclude lowercase check and do it at vector level?
         if lowercase:
@@ -168,6 +190,56 @@ def transform_and_tokenize_text(
             return tokenizer(doc)
 
 
+def _tokenize_series_chunk(
+        series: pd.Series,
+        tokenizer: str,
+        lowercase: bool = False,
+) -> pd.Series:
+    """Tokenize a Series with vectorized string methods when possible.
+    Module-level function so it can be pickled & sent to a process pool.
+    """
+    if lowercase:
+        series = series.str.lower()
+
+    if tokenizer in D_REGEX.keys():
+        return series.str.findall(D_REGEX[tokenizer])
+    elif tokenizer == 'split':
+        return series.str.split()
+    else:
+        return series.apply(partial(transform_and_tokenize_text, tokenizer=tokenizer, lowercase=False))
+
+
+def tokenize_series(
+        series: pd.Series,
+        tokenizer: str = 'sklearn',
+        lowercase: bool = False,
+        n_jobs: int = 1,
+        chunk_rows: int = 100000,
+) -> pd.Series:
+    """High-throughput version of `series.apply(transform_and_tokenize_text)`.
+
+    - Uses the pre-compiled regexes in `D_REGEX` with `Series.str.findall()`
+      instead of calling a python function for each row
+    - If `n_jobs` > 1 & the Series has more than `chunk_rows` rows, split it into
+      chunks & tokenize them in a process pool. Regex matching holds the GIL,
+      so threads wouldn't help here.
+
+    Output is the same as applying `transform_and_tokenize_text()` row by row.
+    """
+    if (n_jobs is None) or (n_jobs <= 1) or (len(series) <= chunk_rows):
+        return _tokenize_series_chunk(series, tokenizer=tokenizer, lowercase=lowercase)
+
+    l_chunks = [series.iloc[i:i + chunk_rows] for i in range(0, len(series), chunk_rows)]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        l_tokenized = list(
+            executor.map(
+                partial(_tokenize_series_chunk, tokenizer=tokenizer, lowercase=lowercase),
+                l_chunks,
+            )
+        )
+    return pd.concat(l_tokenized, axis=0)
+
+
 #
 # ~ fin
 #
@@ -14,12 +14,16 @@ The fastest way to get the queries from BQ into a pandas dataframe is using cola
   but those are hard to parameterize, so we'll take a hit in speed, but our queries will
   be in source control.
 """
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait,
+)
 from datetime import datetime
-import gc
+from functools import partial
 import json
 import logging
 from logging import info
 import posixpath
+import resource
 from typing import Union, Tuple, List, Dict
 
 # import hydra
@@ -27,19 +31,42 @@ from tqdm import tqdm
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 
 from google.cloud import bigquery, storage
 
 from .clustering_utils import (
-    create_dynamic_clusters
+    create_dynamic_clusters,
+    get_dynamic_cluster_levels,
+    get_nested_cluster_label_codes,
+    get_seed_to_cluster_lists_df,
 )
+from .fpr_dataset import PartitionedParquetWriter
 from .fpr_schemas import fpr_qa_summary_schema, fpr_full_schema
 
+from ..utils.big_query_utils import BigQueryTableLoader, TableLoader
 from ..utils.eda import (
+    elapsed_time,
     reorder_array,
 )
 
 
+# Check sensitive topics in case labels have changed since CA QA step
+L_SENSITIVE_TOPICS_FOR_FPRS = [
+    'Addiction Support',
+    'Activism',
+    # 'Culture, Race, and Ethnicity',
+    'Fitness and Nutrition',
+    'Gender', 'Mature Themes and Adult Content', 'Medical and Mental Health',
+    'Military',
+    "Men's Health", 'Politics', 'Sexual Orientation',
+    'Trauma Support', "Women's Health",
+]
+TABLE_ALL_REDDIT_SUBREDDITS = 'data-prod-165221.all_reddit.all_reddit_subreddits'
+TABLE_TOPIC_AND_RATING = 'data-prod-165221.cnc.shredded_crowdsource_topic_and_rating'
+TABLE_SUBREDDIT_LOOKUP = 'data-prod-165221.ds_v2_postgres_tables.subreddit_lookup'
+
+
 # TODO(djb): use hydra to set default parameter values & run from CLI
 # @hydra.main(config_path='../config', config_name="vectorize_subreddits_test")
 
@@ -69,6 +96,13 @@ class CreateFPRs:
             col_new_cluster_topic_mix: str = 'cluster_topic_mix',
             verbose: bool = False,
             add_outputs_to_bq: bool = False,
+            n_jobs: int = 1,
+            n_io_threads: int = 8,
+            batch_geo_query: bool = True,
+            local_tables: Dict[str, str] = None,
+            fpr_output_format: str = 'json',
+            parquet_layout: str = 'files',
+            table_loader: TableLoader = None,
             **kwargs
     ) -> None:
         """
@@ -104,6 +138,31 @@ class CreateFPRs:
                 column that captures nested primary topic mix
             verbose:
                 whether to show additional log outputs
+            n_jobs:
+                Number of processes to create FPRs in parallel (dynamic clusters & FPR logic).
+                If n_jobs <= 1, process one country at a time.
+            n_io_threads:
+                Number of threads for BigQuery queries & GCS uploads when n_jobs > 1
+            batch_geo_query:
+                If True, run one geo-relevance query for all countries & split it locally.
+                If the batch query fails, we fall back to one query per country so that
+                errors are isolated (& recorded) per country.
+                If False, run one query per country.
+            local_tables:
+                Run the geo-relevance query with DuckDB on local parquet files instead of BigQuery.
+                See `get_geo_relevant_subreddits_and_cluster_labels_multi_country()`
+            fpr_output_format:
+                'json': one JSON file per country: {country_code: {seed: [recs]}}
+                'ndjson': stream one line per seed (flat RAM for large countries).
+                    We skip the FPR dict & df_fpr (parquet & BQ table) for ndjson
+            parquet_layout:
+                'files': one file per country & output ({df_name}-{country_code}.parquet)
+                'hive': one dataset per output with a partition per country (country_code=XX/),
+                    same schema for all countries & concurrent uploads.
+                    NOTE: readers that expect `{df_name}-{country_code}.parquet` files won't find them
+            table_loader:
+                Where to load the parquet outputs when add_outputs_to_bq=True.
+                Default: BigQueryTableLoader(). Use LocalTableLoader for offline tests.
             **kwargs:
 
         Returns: None
@@ -131,6 +190,15 @@ class CreateFPRs:
 
         self.verbose = verbose
         self.add_outputs_to_bq = add_outputs_to_bq
+        self.n_jobs = n_jobs
+        self.n_io_threads = n_io_threads
+        self.batch_geo_query = batch_geo_query
+        self.local_tables = local_tables
+        self.fpr_output_format = fpr_output_format
+        self.parquet_layout = parquet_layout
+        self.table_loader = table_loader
+        if self.parquet_layout not in ['hive', 'files']:
+            raise NotImplementedError(f"Parquet layout not implemented: {self.parquet_layout}")
 
         # set start time so we can use timestamp when saving outputs
         self.run_id = f"{datetime.utcnow().strftime('%Y-%m-%d_%H%M%S')}"
@@ -162,6 +230,10 @@ class CreateFPRs:
             'df_dynamic_clusters'
         )
         self.fpr_outputs = dict()
+        # time (seconds) for each country & step + peak RAM of the process that computed it
+        self.df_country_stats = None
+        # Created in create_fprs() when parquet_layout='hive'
+        self.dataset_writer = None
         # define schemas for df outputs. We can use these for
         #  Saving parquet files consistently
         #  Creating BQ tables based on the parquet files
@@ -186,15 +258,46 @@ class CreateFPRs:
             },
         }
 
+    def __getstate__(self) -> dict:
+        # Process pools pickle `self`. Workers don't need the writer (it has threads & locks)
+        d_state = self.__dict__.copy()
+        d_state['dataset_writer'] = None
+        return d_state
+
     def create_fprs(self) -> None:
         """High level method to generate FPRs for all input countries"""
-        for country_code_ in tqdm(self.target_countries):
-            info(f"== Country: {country_code_} ==")
-            try:
-                self.fpr_outputs[country_code_] = self.create_fpr_(country_code_)
-            except Exception as e:
-                logging.error(f"**+++!! ERROR processing country: {country_code_} **+++!!")
-                logging.error(f"**+++!!\n\n {e} \n\n **+++!!", exc_info=True)
+        d_country_stats = {c_: {'country_code': c_} for c_ in self.target_countries}
+        if self.parquet_layout == 'hive':
+            self.dataset_writer = self.get_dataset_writer_()
+        d_df_labels_target = None
+        if self.batch_geo_query:
+            d_df_labels_target = self.get_df_labels_target_all_countries_()
+
+        if (self.n_jobs is None) or (self.n_jobs <= 1):
+            for country_code_ in tqdm(self.target_countries):
+                info(f"== Country: {country_code_} ==")
+                try:
+                    self.fpr_outputs[country_code_] = self.create_fpr_(
+                        country_code_,
+                        df_labels_target=(
+                            None if d_df_labels_target is None else d_df_labels_target.pop(country_code_, None)
+                        ),
+                        d_stats=d_country_stats[country_code_],
+                    )
+                except Exception as e:
+                    d_country_stats[country_code_]['error'] = str(e)
+                    logging.error(f"**+++!! ERROR processing country: {country_code_} **+++!!")
+                    logging.error(f"**+++!!\n\n {e} \n\n **+++!!", exc_info=True)
+        else:
+            self.create_fprs_parallel_(d_country_stats, d_df_labels_target)
+
+        if self.dataset_writer is not None:
+            info(f"Waiting for parquet uploads to finish...")
+            for _, country_code_, error_ in self.dataset_writer.close():
+                d_country_stats[country_code_]['error'] = f"save: {error_}"
+
+        self.df_country_stats = pd.DataFrame(list(d_country_stats.values()))
+        info(f"Time (seconds) & process peak RAM by country:\n{self.df_country_stats.to_string(index=False)}")
 
         # TODO(djb): upload df outputs to a bigquery table
         #  Looks like the path to automation is to create a BQ table
@@ -204,6 +307,77 @@ class CreateFPRs:
         if self.add_outputs_to_bq:
             self.add_outputs_to_bq_tables_()
 
+    def create_fprs_parallel_(
+            self,
+            d_country_stats: Dict[str, dict],
+            d_df_labels_target: Dict[str, pd.DataFrame] = None,
+    ) -> None:
+        """Create FPRs for all countries in parallel.
+
+        Each country goes through 3 steps, as soon as one step finishes we submit the next one:
+        - query (threads): get geo-relevant subreddits & cluster labels from BigQuery
+            (skipped if we already have `d_df_labels_target` from the batch query)
+        - compute (processes): dynamic clusters, QA summary & FPR (CPU-bound)
+        - save (threads): upload JSON & parquet files to GCS
+
+        Like the serial loop, an error in one country is logged & the other countries continue.
+
+        NOTE: each compute task pickles `self`, so we only add outputs to self.fpr_outputs
+        at the end (otherwise we'd send the outputs of finished countries to each worker).
+        """
+        info(f"Creating FPRs for {len(self.target_countries)} countries with"
+             f" {self.n_jobs} processes & {self.n_io_threads} I/O threads...")
+        d_pending = dict()
+        d_fpr_outputs = dict()
+        with ThreadPoolExecutor(max_workers=self.n_io_threads) as io_pool, \
+                ProcessPoolExecutor(max_workers=self.n_jobs) as cpu_pool:
+            for country_code_ in self.target_countries:
+                df_labels_target_ = (
+                    None if d_df_labels_target is None else d_df_labels_target.pop(country_code_, None)
+                )
+                if df_labels_target_ is None:
+                    f_ = io_pool.submit(_run_and_time, self.get_df_labels_target_, country_code_)
+                    d_pending[f_] = ('query', country_code_)
+                else:
+                    d_country_stats[country_code_]['subreddit_count'] = len(df_labels_target_)
+                    f_ = cpu_pool.submit(
+                        _run_and_time, self.get_fpr_outputs_, country_code_, df_labels_target_,
+                    )
+                    d_pending[f_] = ('compute', country_code_)
+
+            while len(d_pending) > 0:
+                l_done, _ = wait(list(d_pending.keys()), return_when=FIRST_COMPLETED)
+                for f_ in l_done:
+                    step_, country_code_ = d_pending.pop(f_)
+                    d_stats_ = d_country_stats[country_code_]
+                    try:
+                        output_, seconds_, process_peak_rss_mb_ = f_.result()
+                    except Exception as e:
+                        d_stats_['error'] = f"{step_}: {e}"
+                        logging.error(f"**+++!! ERROR processing country: {country_code_} ({step_}) **+++!!")
+                        logging.error(f"**+++!!\n\n {e} \n\n **+++!!", exc_info=e)
+                        continue
+
+                    d_stats_[f"{step_}_seconds"] = seconds_
+                    if step_ == 'query':
+                        d_stats_['subreddit_count'] = len(output_)
+                        d_pending[cpu_pool.submit(
+                            _run_and_time, self.get_fpr_outputs_, country_code_, output_,
+                        )] = ('compute', country_code_)
+                    elif step_ == 'compute':
+                        # peak RAM of the worker process so far (not only this country):
+                        #  a worker can compute several countries
+                        d_stats_['compute_process_peak_rss_mb'] = process_peak_rss_mb_
+                        d_pending[io_pool.submit(
+                            _run_and_time, self.save_fpr_outputs_, country_code_, output_,
+                        )] = ('save', country_code_)
+                    else:
+                        d_fpr_outputs[country_code_] = output_
+                        info(f"  {country_code_} done | {len(d_fpr_outputs)} of"
+                             f" {len(self.target_countries)} countries")
+
+        self.fpr_outputs.update(d_fpr_outputs)
+
     def create_fpr_(
             self,
             country_code,
@@ -212,21 +386,85 @@ class CreateFPRs:
             verbose: bool = False,
             verbose_summary: bool = False,
             fpr_verbose: bool = False,
+            df_labels_target: pd.DataFrame = None,
+            d_stats: dict = None,
     ) -> dict:
         """
         Create fpr output for a single country
 
         Save outputs to a dict in case we want to analyze/pull data for a country
+        If `df_labels_target` is None, query it for this country.
+        If `d_stats` is a dict, add the time for each step & the process peak RAM to it.
         """
-        if optimal_k_search is None:
-            optimal_k_search = np.arange(5, 10)
+        if d_stats is None:
+            d_stats = dict()
 
-        # We create a single dict per country & aggregate at the end
-        d_df_fpr = dict()
+        if df_labels_target is None:
+            df_labels_target, d_stats['query_seconds'], _ = _run_and_time(
+                self.get_df_labels_target_, country_code
+            )
+        d_stats['subreddit_count'] = len(df_labels_target)
+
+        d_df_fpr, d_stats['compute_seconds'], d_stats['compute_process_peak_rss_mb'] = _run_and_time(
+            self.get_fpr_outputs_,
+            country_code,
+            df_labels_target,
+            optimal_k_search=optimal_k_search,
+            convert_lists_to_str=convert_lists_to_str,
+            verbose=verbose,
+            verbose_summary=verbose_summary,
+            fpr_verbose=fpr_verbose,
+        )
+
+        d_df_fpr, d_stats['save_seconds'], _ = _run_and_time(
+            self.save_fpr_outputs_, country_code, d_df_fpr
+        )
+        return d_df_fpr
 
+    def get_df_labels_target_(
+            self,
+            country_code: str,
+    ) -> pd.DataFrame:
+        """Query geo-relevant subreddits & cluster labels for one country"""
         info(f"Getting geo-relevant subreddits in model for {country_code}...")
-        df_labels_target = get_geo_relevant_subreddits_and_cluster_labels(
-            target_country=country_code,
+        df_labels_target = get_geo_relevant_subreddits_and_cluster_labels_multi_country(
+            target_countries=[country_code],
+            **self.get_geo_query_kwargs_(),
+        )[country_code]
+        return self.prepare_df_labels_target_(df_labels_target, country_code)
+
+    def get_df_labels_target_all_countries_(self) -> Union[Dict[str, pd.DataFrame], None]:
+        """Run one query for all target countries & split it by country.
+
+        If the query fails, return None so that we query each country individually.
+        Countries that fail in prepare_df_labels_target_() are left out of the dict,
+        so they also get queried individually.
+        """
+        info(f"Getting geo-relevant subreddits in model for all countries...")
+        t_start_query = datetime.utcnow()
+        try:
+            d_df_labels_target = get_geo_relevant_subreddits_and_cluster_labels_multi_country(
+                target_countries=self.target_countries,
+                **self.get_geo_query_kwargs_(),
+            )
+        except Exception as e:
+            logging.error(f"**+++!! ERROR in geo-relevance query for all countries."
+                          f" Falling back to one query per country **+++!!")
+            logging.error(f"**+++!!\n\n {e} \n\n **+++!!", exc_info=True)
+            return None
+        elapsed_time(t_start_query, log_label='Geo-relevance query for all countries', verbose=True)
+
+        d_df_labels_target_clean = dict()
+        for c_, df_ in d_df_labels_target.items():
+            try:
+                d_df_labels_target_clean[c_] = self.prepare_df_labels_target_(df_, c_)
+            except Exception as e:
+                logging.error(f"**+++!! ERROR preparing labels for country: {c_}. Will query it again **+++!!")
+                logging.error(f"**+++!!\n\n {e} \n\n **+++!!", exc_info=True)
+        return d_df_labels_target_clean
+
+    def get_geo_query_kwargs_(self) -> dict:
+        return dict(
             cluster_labels_table=self.cluster_labels_table,
             qa_table=self.qa_table,
             qa_pt=self.qa_pt,
@@ -234,7 +472,15 @@ class CreateFPRs:
             geo_min_users_percent_by_subreddit_l28=self.geo_min_users_percent_by_subreddit_l28,
             geo_min_country_standardized_relevance=self.geo_min_country_standardized_relevance,
             partition_dt=self.partition_dt,
+            local_tables=self.local_tables,
         )
+
+    def prepare_df_labels_target_(
+            self,
+            df_labels_target: pd.DataFrame,
+            country_code: str,
+    ) -> pd.DataFrame:
+        """Add run_id & drop subreddits that we never use as seeds or recommendations"""
         # add run_id col so we can identify outputs of this run
         df_labels_target['run_id'] = self.run_id
 
@@ -248,7 +494,25 @@ class CreateFPRs:
             df_labels_target = (
                 df_labels_target[~df_labels_target['subreddit_name'].str.contains(word_, na=False)]
             )
-        info(f" {df_labels_target.shape} <- Shape AFTER dropping subreddits with covid in title")
+        info(f" {df_labels_target.shape} <- {country_code} shape AFTER dropping subreddits with covid in title")
+        return df_labels_target
+
+    def get_fpr_outputs_(
+            self,
+            country_code: str,
+            df_labels_target: pd.DataFrame,
+            optimal_k_search: iter = None,
+            convert_lists_to_str: bool = False,
+            verbose: bool = False,
+            verbose_summary: bool = False,
+            fpr_verbose: bool = False,
+    ) -> dict:
+        """Dynamic clusters, QA summary & FPR for one country (no I/O)"""
+        if optimal_k_search is None:
+            optimal_k_search = np.arange(5, 10)
+
+        # We create a single dict per country & aggregate at the end
+        d_df_fpr = dict()
 
         df_top_level_summary = self.check_df_labels_target_(df_labels_target)
 
@@ -309,6 +573,21 @@ class CreateFPRs:
         if verbose:
             self.get_top_level_stats_from_cluster_summary_(df_summary_cluster)
         info(f"Creating FPR output...")
+        if self.fpr_output_format == 'ndjson':
+            # Skip the FPR df & dict (one list per seed), we stream the ndjson
+            #  straight from the cluster arrays & check the arrays instead
+            d_fpr_arrays = get_fpr_cluster_arrays(
+                df_labels_target_dynamic,
+                col_new_cluster_val=self.col_new_cluster_val,
+            )
+            d_df_fpr['fpr_cluster_arrays'] = d_fpr_arrays
+            self.check_fpr_with_expected_output_(
+                None,
+                d_fpr_qa,
+                d_fpr_arrays=d_fpr_arrays,
+            )
+            return d_df_fpr
+
         df_fpr, dict_fpr = get_fpr_df_and_dict(
             df_labels_target_dynamic,
             target_country_code=country_code,
@@ -321,20 +600,38 @@ class CreateFPRs:
             dict_fpr[country_code],
             d_fpr_qa
         )
+        return d_df_fpr
 
+    def save_fpr_outputs_(
+            self,
+            country_code: str,
+            d_df_fpr: dict,
+    ) -> dict:
+        """Save JSON & parquet outputs for one country"""
         #  Save each JSON file (country) individually
-        save_fpr_json(
-            fpr_dict=dict_fpr,
-            file_name=f"{country_code}_{self.run_id}.json",
-            bucket_name=self.output_bucket,
-            gcs_output_path=self.gcs_output_path_fpr_json,
-        )
+        if self.fpr_output_format == 'json':
+            save_fpr_json(
+                fpr_dict=d_df_fpr['dict_fpr'],
+                file_name=f"{country_code}_{self.run_id}.json",
+                bucket_name=self.output_bucket,
+                gcs_output_path=self.gcs_output_path_fpr_json,
+            )
+        elif self.fpr_output_format == 'ndjson':
+            save_fpr_ndjson(
+                d_df_fpr['fpr_cluster_arrays'],
+                geo_country_code=country_code,
+                path=(
+                    f"gs://{self.output_bucket}/{self.gcs_output_path_fpr_json}/"
+                    f"{country_code}_{self.run_id}.ndjson"
+                ),
+            )
+        else:
+            raise NotImplementedError(f"FPR output format not implemented: {self.fpr_output_format}")
 
         self.save_fpr_dfs_(
             d_df_fpr,
             country_code=country_code
         )
-
         return d_df_fpr
 
     def check_df_labels_target_(
@@ -458,15 +755,25 @@ class CreateFPRs:
     def check_fpr_with_expected_output_(
             d_fpr_output: Dict[str, str],
             d_fpr_qa: Dict[str, str],
+            d_fpr_arrays: Dict[str, np.ndarray] = None,
     ) -> None:
         """Check the actual outputs w/ expected outputs
         and raise error if they don't match.
         We use 2 different methods to calculate the actual output v. the QA output
         so this serves to check them both
         (it's unlikely both of them screw up in the same way).
+
+        If `d_fpr_arrays` is set (output from `get_fpr_cluster_arrays()`) we check
+        the arrays instead of the FPR dict, so `d_fpr_output` can be None.
         """
         info(f"** Checking FPR output with expected QA output... **")
-        set_seeds = set(d_fpr_output.keys())
+        if d_fpr_arrays is not None:
+            seed_ids_, rec_ids_ = get_fpr_ids_from_cluster_arrays(d_fpr_arrays)
+            set_seeds = set(seed_ids_)
+            set_recs = set(rec_ids_)
+        else:
+            set_seeds = set(d_fpr_output.keys())
+            set_recs = {i_ for l_ in d_fpr_output.values() for i_ in l_}
         set_seeds_expected = set(d_fpr_qa['seed_subreddit_ids'])
         info(f"{  len(set_seeds):6,.0f} SEED subreddits in output")
         info(f"{  len(set_seeds_expected):6,.0f} SEED subreddits expected")
@@ -484,11 +791,6 @@ class CreateFPRs:
             if len(seeds_missing) > 0:
                 logging.error(f"    {len(seeds_missing):6,.0f} Seeds MISSING in output:\n  {seeds_missing}")
 
-        l_recs = list()
-        for _, l_ in d_fpr_output.items():
-            for i_ in l_:
-                l_recs.append(i_)
-        set_recs = set(l_recs)
         set_recs_expected = set(d_fpr_qa['recommend_subreddit_ids'])
         info(f"{  len(set_recs):6,.0f} RECOMMEND subreddits in output")
         info(f"{  len(set_recs_expected):6,.0f} RECOMMEND subreddits expected")
@@ -548,49 +850,36 @@ class CreateFPRs:
         downstream analysis
         """
         d_map_outputs_to_df_names = {
-            self.gcs_output_path_df_fpr: d_df_fpr['df_fpr'],
             self.gcs_output_path_df_fpr_qa_summary: d_df_fpr['df_top_level_summary'],
             self.gcs_output_path_df_fpr_cluster_summary: d_df_fpr['df_summary_cluster'],
             self.gcs_output_path_df_dynamic_clusters: d_df_fpr['df_labels_target_dynamic'],
         }
+        # We don't create df_fpr for fpr_output_format='ndjson'
+        if 'df_fpr' in d_df_fpr:
+            d_map_outputs_to_df_names[self.gcs_output_path_df_fpr] = d_df_fpr['df_fpr']
+        if self.parquet_layout == 'hive':
+            dataset_writer = self.dataset_writer
+            if dataset_writer is None:
+                # e.g., we called create_fpr_() for a single country: upload right away
+                dataset_writer = self.get_dataset_writer_()
+            for k_, df_ in d_map_outputs_to_df_names.items():
+                if verbose:
+                    info(f"Adding {country_code} to dataset: \n  {k_}")
+                dataset_writer.add(k_, country_code, self.drop_redundant_cols_(df_, verbose))
+            if self.dataset_writer is None:
+                dataset_writer.close()
+            return
+
         for k_, df_ in d_map_outputs_to_df_names.items():
             info(f"Saving to: \n  {k_}")
             df_name = k_.split('/')[-1]
             try:
-                # Get list of redundant cols to drop, these mostly apply to df_labels_target_dynamic
-                l_cols_labels_drop = [c for c in df_.columns if all([c.startswith('k_'), c.endswith('_label')])]
-                l_cols_topic_drop = [c for c in df_.columns if all([c.startswith('k_'), c.endswith('_primary_topic')])]
-                l_cols_nested_drop = [c for c in df_.columns if all([c.startswith('k_'), c.endswith('_nested')])]
-                n_label_cols = len(l_cols_labels_drop)
-                n_topic_cols = len(l_cols_topic_drop)
-                n_nested_cols = len(l_cols_nested_drop)
-                if verbose:
-                    info(f"Label cols to drop: {n_label_cols}")
-                    info(f"Topic cols to drop: {n_topic_cols}")
-                    info(f"Topic cols to drop: {n_nested_cols}")
-                    if n_label_cols > 0:
-                        info(f"  Label cols sample: {l_cols_labels_drop[:5]}")
-                    if n_topic_cols > 0:
-                        info(f"  Topic cols sample: {l_cols_topic_drop[:5]}")
-                    if n_nested_cols > 0:
-                        info(f"  Nested cols sample: {l_cols_nested_drop[:5]}")
-                l_all_cols_to_drop = l_cols_labels_drop + l_cols_topic_drop + l_cols_nested_drop
-
-                if len(l_all_cols_to_drop) > 0:
-                    # This *should* only apply to df_labels_target_dynamic
-                    df_.drop(l_all_cols_to_drop, axis=1).to_parquet(
-                        f"gs://{self.output_bucket}/{k_}/{df_name}-{country_code}.parquet",
-                        index=False,
-                        engine='pyarrow',
-                        schema=self.schemas[k_]['pyarrow'],
-                    )
-                else:
-                    df_.to_parquet(
-                        f"gs://{self.output_bucket}/{k_}/{df_name}-{country_code}.parquet",
-                        index=False,
-                        engine='pyarrow',
-                        schema=self.schemas[k_]['pyarrow'],
-                    )
+                self.drop_redundant_cols_(df_, verbose).to_parquet(
+                    f"gs://{self.output_bucket}/{k_}/{df_name}-{country_code}.parquet",
+                    index=False,
+                    engine='pyarrow',
+                    schema=self.schemas[k_]['pyarrow'],
+                )
             except Exception as e:
                 logging.error(e, exc_info=True)
                 df_.to_parquet(
@@ -598,15 +887,63 @@ class CreateFPRs:
                     index=False,
                 )
 
+    def get_dataset_writer_(self) -> PartitionedParquetWriter:
+        """Writer for Hive-partitioned datasets, one dataset per output path"""
+        return PartitionedParquetWriter(
+            root_uri=f"gs://{self.output_bucket}",
+            d_schemas={k_: d_['pyarrow'] for k_, d_ in self.schemas.items()},
+            partition_col='country_code',
+            n_threads=self.n_io_threads,
+        )
+
+    @staticmethod
+    def drop_redundant_cols_(
+            df_: pd.DataFrame,
+            verbose: bool = False,
+    ) -> pd.DataFrame:
+        """Drop redundant k_* cols, these mostly apply to df_labels_target_dynamic"""
+        l_cols_labels_drop = [c for c in df_.columns if all([c.startswith('k_'), c.endswith('_label')])]
+        l_cols_topic_drop = [c for c in df_.columns if all([c.startswith('k_'), c.endswith('_primary_topic')])]
+        l_cols_nested_drop = [c for c in df_.columns if all([c.startswith('k_'), c.endswith('_nested')])]
+        n_label_cols = len(l_cols_labels_drop)
+        n_topic_cols = len(l_cols_topic_drop)
+        n_nested_cols = len(l_cols_nested_drop)
+        if verbose:
+            info(f"Label cols to drop: {n_label_cols}")
+            info(f"Topic cols to drop: {n_topic_cols}")
+            info(f"Topic cols to drop: {n_nested_cols}")
+            if n_label_cols > 0:
+                info(f"  Label cols sample: {l_cols_labels_drop[:5]}")
+            if n_topic_cols > 0:
+                info(f"  Topic cols sample: {l_cols_topic_drop[:5]}")
+            if n_nested_cols > 0:
+                info(f"  Nested cols sample: {l_cols_nested_drop[:5]}")
+        l_all_cols_to_drop = l_cols_labels_drop + l_cols_topic_drop + l_cols_nested_drop
+
+        if len(l_all_cols_to_drop) > 0:
+            # This *should* only apply to df_labels_target_dynamic
+            return df_.drop(l_all_cols_to_drop, axis=1)
+        else:
+            return df_
+
     def add_outputs_to_bq_tables_(
             self
     ) -> None:
-        """Add parquet outputs of this run to target BQ tables"""
-        client = bigquery.Client()
+        """Add parquet outputs of this run to target BQ tables.
+        One load job per table: the wildcard matches files in sub-folders, so
+        it works for both parquet layouts ('hive' & 'files').
+        """
+        table_loader = self.table_loader
+        if table_loader is None:
+            table_loader = BigQueryTableLoader(location='US')
+
         for path_, d_ in self.schemas.items():
             bq_schema = d_.get('bigquery')
             # table ID to create or append to:
             bq_table = d_.get('bq_table')
+            if (path_ == self.gcs_output_path_df_fpr) & (self.fpr_output_format == 'ndjson'):
+                info(f"No df_fpr parquet files for fpr_output_format='ndjson', skipping table:\n  {bq_table}")
+                continue
             if (bq_schema is not None) & (bq_table is not None):
                 info(f"Loading data to table:\n  {bq_table}")
                 uri = (
@@ -614,36 +951,42 @@ class CreateFPRs:
                     f"{path_}/*.parquet"
                 )
                 try:
-                    destination_table = client.get_table(bq_table)
                     info(
-                        f"  {destination_table.num_rows:,.0f} rows in table BEFORE addig data"
+                        f"  {table_loader.get_num_rows(bq_table):,.0f} rows in table BEFORE addig data"
                     )
                 except Exception as e:
                     info(f"Error reading table.\n  {e}")
 
-                # WRITE_TRUNCATE -> replace
-                # WRITE_APPEND -> append data
-                job_config = bigquery.LoadJobConfig(
-                    schema=bq_schema,
-                    source_format=bigquery.SourceFormat.PARQUET,
-                    write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
-                )
-
-                # Make an API request to load data
-                load_job = client.load_table_from_uri(
+                table_loader.load_parquet(
                     uri,
                     bq_table,
-                    location="US",  # Must match the destination dataset location.
-                    job_config=job_config,
+                    schema=bq_schema,
+                    append=True,
                 )
-
-                load_job.result()  # Waits for the job to complete.
-                destination_table = client.get_table(bq_table)
                 info(
-                    f"  {destination_table.num_rows:,.0f} rows in table AFTER addig data"
+                    f"  {table_loader.get_num_rows(bq_table):,.0f} rows in table AFTER addig data"
                 )
 
 
+def _run_and_time(
+        fxn: callable,
+        *args,
+        **kwargs,
+) -> Tuple[object, float, float]:
+    """Call fxn & return (output, seconds, process_peak_rss_mb).
+    Module-level so we can send it to a process pool.
+
+    NOTE: process_peak_rss_mb is the peak RAM (MB) of the process that ran fxn since
+    the process started, NOT the RAM used by this call. With one country per process it's
+    a good proxy, but with a pool or a serial loop it can come from an earlier country.
+    """
+    t_start = datetime.utcnow()
+    output_ = fxn(*args, **kwargs)
+    # ru_maxrss is in KB on linux
+    process_peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return output_, elapsed_time(t_start, measure='seconds'), process_peak_rss_mb
+
+
 def save_fpr_json(
         fpr_dict: dict,
         file_name: str,
@@ -687,6 +1030,7 @@ def get_fpr_cluster_per_row_summary(
         l_sort_cols: str = None,
         convert_lists_to_str: bool = True,
         verbose: bool = True,
+        method: str = 'columnar',
 ) -> Tuple[pd.DataFrame, dict]:
     """Take a df with clusters and reshape it so it's easier to review
     by taking a long df (1 row=1 subredddit) and reshaping so that
@@ -694,7 +1038,34 @@ def get_fpr_cluster_per_row_summary(
 
     Note: even if convert_lists_to_str is true for seeds & recs, wait to do it
     at the end, otherwise it messes with logic to extract seeds & recs for QA
+
+    method:
+        'columnar': (default) see `get_fpr_cluster_per_row_summary_columnar()`
+        'groupby': original method, groupby-agg lists + merges for each type of sub
     """
+    if method == 'columnar':
+        return get_fpr_cluster_per_row_summary_columnar(
+            df_labels,
+            col_new_cluster_val=col_new_cluster_val,
+            col_new_cluster_val_int=col_new_cluster_val_int,
+            col_new_cluster_name=col_new_cluster_name,
+            col_new_cluster_topic=col_new_cluster_topic,
+            l_groupby_cols=l_groupby_cols,
+            prefix_seed=prefix_seed,
+            prefix_recommend=prefix_recommend,
+            prefix_adf=prefix_adf,
+            prefix_private=prefix_private,
+            prefix_review_topic=prefix_review_topic,
+            suffix_col_count=suffix_col_count,
+            suffix_col_list_sub_names=suffix_col_list_sub_names,
+            suffix_col_list_sub_ids=suffix_col_list_sub_ids,
+            l_sort_cols=l_sort_cols,
+            convert_lists_to_str=convert_lists_to_str,
+            verbose=verbose,
+        )
+    elif method != 'groupby':
+        raise NotImplementedError(f"method not implemented: {method}")
+
     if l_groupby_cols is None:
         # add pt & qa_pt so that we can have a trail to debug diffs
         l_groupby_cols = [
@@ -1015,6 +1386,221 @@ def get_fpr_cluster_per_row_summary(
     return df_cluster_per_row, d_fpr_qa
 
 
+def get_fpr_cluster_per_row_summary_columnar(
+        df_labels: pd.DataFrame,
+        col_new_cluster_val: str = 'cluster_label',
+        col_new_cluster_val_int: str = 'cluster_label_int',
+        col_new_cluster_name: str = 'cluster_label_k',
+        col_new_cluster_topic: str = 'cluster_topic_mix',
+        l_groupby_cols: iter = None,
+        prefix_seed: str = 'seed',
+        prefix_recommend: str = 'recommend',
+        prefix_adf: str = 'discoveryF',
+        prefix_private: str = 'private',
+        prefix_review_topic: str = 'missingTopic',
+        suffix_col_count: str = 'subreddit_count',
+        suffix_col_list_sub_names: str = 'subreddit_names_list',
+        suffix_col_list_sub_ids: str = 'subreddit_ids_list',
+        l_sort_cols: str = None,
+        convert_lists_to_str: bool = True,
+        verbose: bool = True,
+) -> Tuple[pd.DataFrame, dict]:
+    """Same outputs as `get_fpr_cluster_per_row_summary(method='groupby')`, but
+    we create the lists for all types of subs (seed, recommend, missingTopic, etc.)
+    from ONE set of cluster codes & offsets instead of a groupby-agg + merge for each type.
+    The QA dict (seeds, recs, orphans) comes from the same arrays instead of python loops.
+
+    List columns are Arrow list arrays until the end. We only render them as strings
+    if convert_lists_to_str=True (human-facing QA), otherwise each row has a
+    python list of names/IDs (NaN for clusters with no subs of that type).
+    """
+    if l_groupby_cols is None:
+        # add pt & qa_pt so that we can have a trail to debug diffs
+        l_groupby_cols = [
+            'pt', 'qa_pt', 'run_id', 'geo_country_code', 'country_name',
+            col_new_cluster_val, col_new_cluster_name, col_new_cluster_val_int, col_new_cluster_topic,
+        ]
+        l_groupby_cols = [c for c in l_groupby_cols if c in df_labels]
+
+    if l_sort_cols is None:
+        l_sort_cols = [col_new_cluster_val]
+
+    mask_private_subs = (df_labels['type'] == 'private').to_numpy()
+    mask_adf_subs = (df_labels['allow_discovery'] == 'f').to_numpy()
+    mask_remove_or_review = (df_labels['combined_filter'] != 'recommend').to_numpy()
+    mask_review_missing_topic = (df_labels['combined_filter_detail'] == 'review-missing_topic').to_numpy()
+    mask_recommend_subs = ~(mask_private_subs | mask_adf_subs | mask_remove_or_review)
+
+    n_seed_subreddits = df_labels['subreddit_id'].nunique()
+    if verbose:
+        info(f"{n_seed_subreddits:6,.0f} <- {prefix_seed.upper()} subreddits (including orphans)")
+        info(f"{mask_recommend_subs.sum():6,.0f} <- {prefix_recommend.upper()} subs (includes orphans)")
+        info(f"{mask_review_missing_topic.sum():6,.0f} <- {prefix_review_topic} subreddits")
+        info(f"  {mask_adf_subs.sum():4,.0f} <- discover=f subs")
+        info(f"  {mask_private_subs.sum():4,.0f} <- private subs")
+
+    tbl_cluster_per_row, cluster_ix = reshape_df_1_cluster_per_row_columnar(
+        df_labels,
+        d_masks={
+            prefix_seed: None,
+            prefix_recommend: mask_recommend_subs,
+            prefix_review_topic: mask_review_missing_topic,
+            prefix_adf: mask_adf_subs,
+            prefix_private: mask_private_subs,
+        },
+        l_prefixes_with_ids=[prefix_seed, prefix_recommend],
+        l_groupby_cols=l_groupby_cols,
+        l_sort_cols=l_sort_cols,
+        suffix_col_count=suffix_col_count,
+        suffix_col_list_sub_names=suffix_col_list_sub_names,
+        suffix_col_list_sub_ids=suffix_col_list_sub_ids,
+    )
+
+    # New orphan definition: clusters where we only have 1 subreddit to recommend
+    #  & clusters with multiple seeds but only 1 sub to recommend, see groupby method
+    seed_count = tbl_cluster_per_row[f"{prefix_seed}_{suffix_col_count}"].to_numpy()
+    rec_count = tbl_cluster_per_row[f"{prefix_recommend}_{suffix_col_count}"].to_numpy()
+    mask_orphan_subs = (seed_count <= 1) | (rec_count <= 0)
+    mask_exclude_recs_from_seeds_ = (seed_count >= 2) & (rec_count == 1)
+
+    # Create summary dict that we can use to compare expected v output (seeds & recs)
+    #  sub IDs in the same order as the lists: cluster (output row), then row in df_labels
+    ix_sort_ = np.argsort(cluster_ix, kind='stable')
+    ix_sort_ = ix_sort_[cluster_ix[ix_sort_] != -1]
+    cluster_ix_sorted = cluster_ix[ix_sort_]
+    sub_ids_sorted = df_labels['subreddit_id'].to_numpy()[ix_sort_]
+    mask_rec_sorted = mask_recommend_subs[ix_sort_]
+    mask_orphan_sorted = mask_orphan_subs[cluster_ix_sorted]
+
+    l_seeds_ = sub_ids_sorted[~mask_orphan_sorted].tolist()
+    l_recs_to_exclude_from_seeds = sub_ids_sorted[
+        mask_rec_sorted & mask_exclude_recs_from_seeds_[cluster_ix_sorted]
+    ].tolist()
+    l_orphan_seeds = sub_ids_sorted[mask_orphan_sorted].tolist()
+    l_orphan_recs = sub_ids_sorted[mask_rec_sorted & mask_orphan_sorted].tolist()
+
+    d_fpr_qa = dict()
+    d_fpr_qa['seed_subreddit_ids'] = list(set(l_seeds_) - set(l_recs_to_exclude_from_seeds))
+    d_fpr_qa['seed_subreddit_ids_count'] = len(d_fpr_qa['seed_subreddit_ids'])
+    d_fpr_qa['recommend_subreddit_ids'] = sub_ids_sorted[mask_rec_sorted & ~mask_orphan_sorted].tolist()
+    d_fpr_qa['recommend_subreddit_ids_count'] = len(d_fpr_qa['recommend_subreddit_ids'])
+
+    d_fpr_qa[f'orphan_or_exclude_seed_{suffix_col_list_sub_ids}'] = list(
+        set(l_recs_to_exclude_from_seeds) | set(l_orphan_seeds)
+    )
+    d_fpr_qa['orphan_or_exclude_seed_subreddit_ids_count'] = len(
+        d_fpr_qa[f'orphan_or_exclude_seed_{suffix_col_list_sub_ids}']
+    )
+    d_fpr_qa[f"orphan_seed_{suffix_col_list_sub_ids}"] = l_orphan_seeds
+    d_fpr_qa['orphan_seed_subreddit_ids_count'] = len(l_orphan_seeds)
+    # fka orphan_recommend_subreddit_ids
+    d_fpr_qa[f'orphan_recommend_{suffix_col_list_sub_ids}'] = l_orphan_recs
+    d_fpr_qa['orphan_recommend_subreddit_ids_count'] = len(l_orphan_recs)
+
+    # Add total clusters & clusters w/o orphans
+    d_fpr_qa['clusters_total'] = tbl_cluster_per_row.num_rows
+    d_fpr_qa['clusters_with_recommendations'] = (~mask_orphan_subs).sum()
+    if verbose:
+        for k_, v_ in d_fpr_qa.items():
+            try:
+                info(f"  {v_:4,.0f} <- {k_}")
+            except (ValueError, TypeError):
+                pass
+
+    # Only convert to pandas (& strings) at the end
+    d_cols = dict()
+    for col_ in tbl_cluster_per_row.column_names:
+        col_arr_ = tbl_cluster_per_row[col_]
+        if not pa.types.is_list(col_arr_.type):
+            d_cols[col_] = col_arr_.to_pandas()
+            continue
+
+        # clusters without subs of this type get a null, same as the left merge
+        prefix_ = col_.rsplit(f"_{suffix_col_list_sub_names}", 1)[0].rsplit(f"_{suffix_col_list_sub_ids}", 1)[0]
+        counts_ = tbl_cluster_per_row[f"{prefix_}_{suffix_col_count}"].to_numpy()
+        # join in python instead of pc.binary_join() b/c it's not available in pyarrow 3.0
+        d_cols[col_] = [
+            np.nan if n_ == 0 else (', '.join(l_) if convert_lists_to_str else l_)
+            for l_, n_ in zip(col_arr_.to_pylist(), counts_)
+        ]
+        if col_ == f"{prefix_recommend}_{suffix_col_list_sub_ids}":
+            d_cols['orphan_clusters'] = mask_orphan_subs
+            d_cols['exclude_recs_from_seeds'] = mask_exclude_recs_from_seeds_
+
+    df_cluster_per_row = pd.DataFrame(d_cols)
+    info(f"{df_cluster_per_row.shape}  <- df.shape full summary")
+
+    return df_cluster_per_row, d_fpr_qa
+
+
+def reshape_df_1_cluster_per_row_columnar(
+        df_labels: pd.DataFrame,
+        d_masks: Dict[str, np.ndarray],
+        l_groupby_cols: List[str],
+        l_sort_cols: List[str],
+        l_prefixes_with_ids: List[str] = None,
+        suffix_col_count: str = 'subreddit_count',
+        suffix_col_list_sub_names: str = 'subreddit_names_list',
+        suffix_col_list_sub_ids: str = 'subreddit_ids_list',
+) -> Tuple[pa.Table, np.ndarray]:
+    """Columnar version of `reshape_df_1_cluster_per_row()` for multiple types of subs at once.
+
+    Args:
+        df_labels: 1 row = 1 subreddit
+        d_masks: {prefix: boolean mask of rows in df_labels}. Use None to keep all rows.
+            Columns for each prefix: {prefix}_{suffix_col_count}, {prefix}_{suffix_col_list_sub_names}
+        l_prefixes_with_ids: prefixes that also get {prefix}_{suffix_col_list_sub_ids}
+
+    Returns:
+        table with 1 row = 1 cluster (every cluster in df_labels, sorted by l_sort_cols):
+            the l_groupby_cols, then counts & Arrow list columns for each prefix
+        cluster_ix: output row for each row in df_labels (-1 if a groupby col is null)
+    """
+    if l_prefixes_with_ids is None:
+        l_prefixes_with_ids = list()
+
+    grouped_ = df_labels.groupby(l_groupby_cols, sort=True)
+    df_keys = grouped_.size().index.to_frame(index=False)
+    # same order as the groupby-agg + sort
+    ix_sorted_keys = df_keys.sort_values(by=l_sort_cols, ascending=True).index.to_numpy()
+    df_keys = df_keys.loc[ix_sorted_keys].reset_index(drop=True)
+    n_clusters = len(df_keys)
+
+    group_ix = grouped_.ngroup().fillna(-1).to_numpy().astype(np.int64)
+    out_row_for_group = np.empty(n_clusters, dtype=np.int64)
+    out_row_for_group[ix_sorted_keys] = np.arange(n_clusters)
+    cluster_ix = np.where(group_ix >= 0, out_row_for_group[np.maximum(group_ix, 0)], -1)
+
+    sub_names = df_labels['subreddit_name'].to_numpy()
+    sub_ids = df_labels['subreddit_id'].to_numpy()
+    sub_id_codes, _ = pd.factorize(sub_ids)
+
+    d_cols = {c: pa.Array.from_pandas(df_keys[c]) for c in l_groupby_cols}
+    for prefix_, mask_ in d_masks.items():
+        mask_ = cluster_ix != -1 if mask_ is None else (np.asarray(mask_, dtype=bool) & (cluster_ix != -1))
+        ix_rows_ = np.flatnonzero(mask_)
+        ix_rows_ = ix_rows_[np.argsort(cluster_ix[ix_rows_], kind='stable')]
+        cluster_ix_ = cluster_ix[ix_rows_]
+        offsets_ = np.r_[0, np.cumsum(np.bincount(cluster_ix_, minlength=n_clusters))].astype(np.int32)
+
+        # count = nunique(subreddit_id) per cluster, same as the groupby-agg
+        id_codes_ = sub_id_codes[ix_rows_]
+        mask_unique_ = ~pd.DataFrame({'c': cluster_ix_, 'i': id_codes_}).duplicated().to_numpy()
+        mask_unique_ &= id_codes_ != -1
+        d_cols[f"{prefix_}_{suffix_col_count}"] = pa.array(
+            np.bincount(cluster_ix_[mask_unique_], minlength=n_clusters).astype(np.int64)
+        )
+        d_cols[f"{prefix_}_{suffix_col_list_sub_names}"] = pa.ListArray.from_arrays(
+            pa.array(offsets_), pa.array(sub_names[ix_rows_], type=pa.string()),
+        )
+        if prefix_ in l_prefixes_with_ids:
+            d_cols[f"{prefix_}_{suffix_col_list_sub_ids}"] = pa.ListArray.from_arrays(
+                pa.array(offsets_), pa.array(sub_ids[ix_rows_], type=pa.string()),
+            )
+
+    return pa.table(d_cols), cluster_ix
+
+
 def reshape_df_1_cluster_per_row(
         df_labels: pd.DataFrame,
         prefix_list_and_name_cols: str = None,
@@ -1107,6 +1693,7 @@ def get_fpr_df_and_dict(
         col_sort_by: str = None,
         verbose: bool = True,
         convert_lists_to_str: bool = False,
+        method: str = 'cluster_slices',
 ) -> Tuple[pd.DataFrame, dict]:
     """
     Take a df with cluster labels and create 2 things:
@@ -1144,6 +1731,9 @@ def get_fpr_df_and_dict(
             False for BigQuery because we want to return a nested list!
         col_sort_by:
         verbose:
+        method:
+            'cluster_slices': sort by cluster once & slice each seed's cluster (no self-merge)
+            'merge': self-merge on the cluster label, creates sum(cluster_size^2) rows
 
     Returns:
 
@@ -1188,43 +1778,40 @@ def get_fpr_df_and_dict(
     df_clean = df[~mask_remove_from_fpr].copy()
 
     # Create mask for subreddits to RECOMMEND
-    mask_private_subs = df_clean['type'] == 'private'
-    # n_private_subs = mask_private_subs.sum()
-    mask_adf_subs = df_clean['allow_discovery'] == 'f'
-    # n_adf_subs = mask_adf_subs.sum()
-    mask_remove_or_review = df_clean['combined_filter'] != 'recommend'
+    mask_recommend_subs = get_fpr_mask_recommend(df_clean)
 
-    mask_recommend_subs = ~(mask_private_subs | mask_adf_subs | mask_remove_or_review)
-    # n_recommend_subs = mask_recommend_subs.sum()
+    if method not in ['cluster_slices', 'merge']:
+        raise NotImplementedError(f"Method not implemented: {method}")
 
     suffix_rec = 'recommend'
-    df_ab = (
-        df[l_cols_for_seeds].copy()
-        .merge(
-            df[mask_recommend_subs][l_cols_for_clusters],
-            how='left',
-            on=[col_new_cluster_val],
-            suffixes=('_seed', f"_{suffix_rec}")
-        )
-    )
-    if verbose:
-        info(f"  {df_ab.shape} <- df_ab.shape raw")
-
     # Set name of columns to be used for aggregation
     col_sub_name_a = 'subreddit_name_seed'
     col_sub_id_a = 'subreddit_id_seed'
     col_sub_name_b = f'subreddit_name_{suffix_rec}'
     col_sub_id_b = f'subreddit_id_{suffix_rec}'
-    # Remove matches to self b/c that makes no sense as a recommendation
-    #  This also gets rid of orphan subreddits/clusters
-    df_ab = df_ab[
-        df_ab[col_sub_id_a] != df_ab[col_sub_id_b]
-    ]
-    # Remove subs that were orphan & had no recommendations from the start
-    df_ab = df_ab.dropna(subset=[col_sub_id_b])
+    if method == 'merge':
+        df_ab = (
+            df[l_cols_for_seeds].copy()
+            .merge(
+                df[mask_recommend_subs][l_cols_for_clusters],
+                how='left',
+                on=[col_new_cluster_val],
+                suffixes=('_seed', f"_{suffix_rec}")
+            )
+        )
+        if verbose:
+            info(f"  {df_ab.shape} <- df_ab.shape raw")
 
-    if verbose:
-        info(f"  {df_ab.shape} <- df_ab.shape after removing orphans & matches to self")
+        # Remove matches to self b/c that makes no sense as a recommendation
+        #  This also gets rid of orphan subreddits/clusters
+        df_ab = df_ab[
+            df_ab[col_sub_id_a] != df_ab[col_sub_id_b]
+        ]
+        # Remove subs that were orphan & had no recommendations from the start
+        df_ab = df_ab.dropna(subset=[col_sub_id_b])
+
+        if verbose:
+            info(f"  {df_ab.shape} <- df_ab.shape after removing orphans & matches to self")
 
     # Create groupby cols that include input seeds & col_sort_by
     # NOTE that pandas will drop any rows that have nulls in a groupby column!
@@ -1242,19 +1829,33 @@ def get_fpr_df_and_dict(
     if verbose:
         info(f"  Groupby cols:\n    {l_groupby_cols}")
 
-    df_a_to_b_list = (
-        df_ab
-        .groupby(l_groupby_cols)
-        .agg(
-            **{
-                col_counterpart_count: (col_sub_id_b, 'nunique'),
-                col_list_cluster_names: (col_sub_name_b, list),
-                col_list_cluster_ids: (col_sub_id_b, list),
-            }
+    if method == 'merge':
+        df_a_to_b_list = (
+            df_ab
+            .groupby(l_groupby_cols)
+            .agg(
+                **{
+                    col_counterpart_count: (col_sub_id_b, 'nunique'),
+                    col_list_cluster_names: (col_sub_name_b, list),
+                    col_list_cluster_ids: (col_sub_id_b, list),
+                }
+            )
+            .reset_index()
         )
-        .reset_index()
-        .sort_values(by=[col_sort_by, ], ascending=True)
-    )
+    else:
+        df_a_to_b_list = get_seed_to_cluster_lists_df(
+            df,
+            l_cols_for_seeds=l_cols_for_seeds,
+            l_cols_for_clusters=l_cols_for_clusters,
+            l_groupby_cols=l_groupby_cols,
+            col_new_cluster_val=col_new_cluster_val,
+            col_counterpart_count=col_counterpart_count,
+            col_list_cluster_names=col_list_cluster_names,
+            col_list_cluster_ids=col_list_cluster_ids,
+            mask_candidates=mask_recommend_subs.reindex(df.index, fill_value=False),
+            suffixes=('_seed', f"_{suffix_rec}"),
+        )
+    df_a_to_b_list = df_a_to_b_list.sort_values(by=[col_sort_by, ], ascending=True)
 
     # Convert to FPR format! desired output:
     #  {"DE": {subreddit_seed: [list_of_subreddits], subreddit_seed: [list_of_subreddits]}}
@@ -1312,6 +1913,151 @@ def get_fpr_df_and_dict(
     return df_a_to_b_list, d_fpr
 
 
+def get_fpr_mask_recommend(
+        df: pd.DataFrame,
+) -> pd.Series:
+    """Mask for subreddits that we can recommend (public, allow_discovery & recommend filter)"""
+    mask_private_subs = df['type'] == 'private'
+    mask_adf_subs = df['allow_discovery'] == 'f'
+    mask_remove_or_review = df['combined_filter'] != 'recommend'
+    return ~(mask_private_subs | mask_adf_subs | mask_remove_or_review)
+
+
+def get_fpr_cluster_arrays(
+        df: pd.DataFrame,
+        col_new_cluster_val: str = 'cluster_label',
+        col_subreddit_id: str = 'subreddit_id',
+) -> Dict[str, np.ndarray]:
+    """Columnar version of the FPR.
+
+    Instead of one list of recommendations per seed, keep the IDs we can recommend
+    grouped by cluster (one flat array + offsets). The recommendations for a seed
+    are its cluster's slice minus the seed itself.
+    Same seeds & order of recommendations as `get_fpr_df_and_dict()`.
+
+    Returns: dict with
+        seed_ids: subreddit ID for each seed (sorted by cluster)
+        seed_cluster_ix: cluster index for each seed
+        cluster_offsets: (n_clusters + 1) array, cluster i is rec_ids[offsets[i]:offsets[i+1]]
+        rec_ids: IDs of subreddits we can recommend, sorted by cluster
+    """
+    cluster_codes, cluster_uniques = pd.factorize(df[col_new_cluster_val], sort=True)
+    # stable sort so recommendations keep the input order within each cluster
+    ix_sort = np.argsort(cluster_codes, kind='stable')
+    # Subreddits without a cluster label can't be seeds or recommendations
+    ix_sort = ix_sort[cluster_codes[ix_sort] >= 0]
+
+    seed_ids = df[col_subreddit_id].to_numpy()[ix_sort]
+    seed_cluster_ix = cluster_codes[ix_sort]
+    mask_rec_sorted = get_fpr_mask_recommend(df).to_numpy()[ix_sort]
+
+    cluster_offsets = np.zeros(len(cluster_uniques) + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(seed_cluster_ix[mask_rec_sorted], minlength=len(cluster_uniques)),
+        out=cluster_offsets[1:],
+    )
+    return {
+        'seed_ids': seed_ids,
+        'seed_cluster_ix': seed_cluster_ix,
+        'cluster_offsets': cluster_offsets,
+        'rec_ids': seed_ids[mask_rec_sorted],
+    }
+
+
+def get_fpr_ids_from_cluster_arrays(
+        d_fpr_arrays: Dict[str, np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the same seeds & recommendations as the keys & values of the FPR dict,
+    but without creating one list per seed.
+
+    - A seed is in the FPR if its cluster has at least 1 rec other than itself
+    - A rec is in the FPR if its cluster has at least 1 seed other than itself
+
+    Returns: (seed_ids, rec_ids)
+    """
+    seed_ids = d_fpr_arrays['seed_ids']
+    seed_cluster_ix = d_fpr_arrays['seed_cluster_ix']
+    rec_ids = d_fpr_arrays['rec_ids']
+    n_recs_per_cluster = np.diff(d_fpr_arrays['cluster_offsets'])
+    n_seeds_per_cluster = np.bincount(seed_cluster_ix, minlength=len(n_recs_per_cluster))
+
+    mask_seed_is_rec = np.isin(seed_ids, rec_ids)
+    mask_seeds_with_recs = (n_recs_per_cluster[seed_cluster_ix] - mask_seed_is_rec) > 0
+    # every rec is also a seed, so we need 2+ seeds in its cluster
+    rec_cluster_ix = np.repeat(np.arange(len(n_recs_per_cluster)), n_recs_per_cluster)
+    mask_recs_with_seeds = n_seeds_per_cluster[rec_cluster_ix] >= 2
+    return seed_ids[mask_seeds_with_recs], rec_ids[mask_recs_with_seeds]
+
+
+def write_fpr_ndjson(
+        f,
+        d_fpr_arrays: Dict[str, np.ndarray],
+        geo_country_code: str,
+        col_seed: str = 'subreddit_id_seed',
+        col_list_cluster_ids: str = 'cluster_subreddit_ids_list',
+        lines_per_write: int = 2000,
+) -> int:
+    """Write one compact JSON line per seed to a text file object:
+        {"geo_country_code":"DE","subreddit_id_seed":"t5_1","cluster_subreddit_ids_list":["t5_2","t5_3"]}
+
+    We encode each subreddit ID once & write in batches of lines, so we never build
+    the full FPR dict or string in memory. Seeds without recommendations are skipped
+    (same as the FPR dict).
+
+    Args:
+        f: text file object (local file, gcsfs file, etc.)
+        d_fpr_arrays: output from `get_fpr_cluster_arrays()`
+
+    Returns: number of seeds written
+    """
+    seed_ids = d_fpr_arrays['seed_ids']
+    cluster_offsets = d_fpr_arrays['cluster_offsets']
+    rec_codes, rec_uniques = pd.factorize(d_fpr_arrays['rec_ids'])
+    # position of the seed in rec_uniques, so we can remove it from its own recs. -1 = not in recs
+    seed_rec_codes = pd.Index(rec_uniques).get_indexer(seed_ids)
+    rec_ids_json = np.array([json.dumps(str(id_)) for id_ in rec_uniques], dtype=object)
+
+    line_prefix = '{' + f'"geo_country_code":{json.dumps(geo_country_code)},"{col_seed}":'
+    line_recs = f',"{col_list_cluster_ids}":['
+
+    n_seeds = 0
+    l_lines = list()
+    for seed_id, seed_code, cluster_ix in zip(seed_ids, seed_rec_codes, d_fpr_arrays['seed_cluster_ix']):
+        codes_ = rec_codes[cluster_offsets[cluster_ix]:cluster_offsets[cluster_ix + 1]]
+        if seed_code >= 0:
+            codes_ = codes_[codes_ != seed_code]
+        if len(codes_) == 0:
+            continue
+        l_lines.append(
+            f"{line_prefix}{json.dumps(str(seed_id))}{line_recs}{','.join(rec_ids_json[codes_])}]}}\n"
+        )
+        n_seeds += 1
+        if len(l_lines) >= lines_per_write:
+            f.write(''.join(l_lines))
+            l_lines = list()
+    if len(l_lines) > 0:
+        f.write(''.join(l_lines))
+    return n_seeds
+
+
+def save_fpr_ndjson(
+        d_fpr_arrays: Dict[str, np.ndarray],
+        geo_country_code: str,
+        path: str,
+) -> int:
+    """Stream FPR as newline-delimited JSON to a local path or GCS (gs://...).
+    For GCS, gcsfs uploads the file in blocks with a resumable upload.
+    """
+    # import here, fsspec comes with gcsfs
+    import fsspec
+
+    info(f"Saving FPR ndjson file to:\n  {path}")
+    with fsspec.open(path, 'w') as f_:
+        n_seeds = write_fpr_ndjson(f_, d_fpr_arrays, geo_country_code=geo_country_code)
+    info(f"  {n_seeds:,.0f} <- seeds saved. Upload complete!")
+    return n_seeds
+
+
 def get_geo_relevant_subreddits_and_cluster_labels(
         target_country: str,
         cluster_labels_table: str,
@@ -1321,44 +2067,150 @@ def get_geo_relevant_subreddits_and_cluster_labels(
         geo_min_users_percent_by_subreddit_l28: float = 0.14,
         geo_min_country_standardized_relevance: float = 2.4,
         partition_dt: str = "(CURRENT_DATE() - 2)",
-        project_name: str = None
+        project_name: str = None,
+        local_tables: Dict[str, str] = None,
 ) -> pd.DataFrame:
     """
     Query to get both:
     - geo-relevant subs for target country
     - cluster labels (df_labels)
+
+    To get multiple countries, use `get_geo_relevant_subreddits_and_cluster_labels_multi_country()`
+      so that we only read the labels, QA & geo-relevance tables once.
+    """
+    return get_geo_relevant_subreddits_and_cluster_labels_multi_country(
+        target_countries=[target_country],
+        cluster_labels_table=cluster_labels_table,
+        qa_table=qa_table,
+        qa_pt=qa_pt,
+        geo_relevance_table=geo_relevance_table,
+        geo_min_users_percent_by_subreddit_l28=geo_min_users_percent_by_subreddit_l28,
+        geo_min_country_standardized_relevance=geo_min_country_standardized_relevance,
+        partition_dt=partition_dt,
+        project_name=project_name,
+        local_tables=local_tables,
+    )[target_country]
+
+
+def get_geo_relevant_subreddits_and_cluster_labels_multi_country(
+        target_countries: List[str],
+        cluster_labels_table: str,
+        qa_table: str,
+        qa_pt: str,
+        geo_relevance_table: str,
+        geo_min_users_percent_by_subreddit_l28: float = 0.14,
+        geo_min_country_standardized_relevance: float = 2.4,
+        partition_dt: str = "(CURRENT_DATE() - 2)",
+        project_name: str = None,
+        local_tables: Dict[str, str] = None,
+) -> Dict[str, pd.DataFrame]:
+    """Run the geo-relevance + cluster labels query once for all target countries
+    & split the output by `geo_country_code`.
+
+    Args:
+        target_countries: list of country codes. Passed to BigQuery as an array parameter
+        local_tables:
+            Use it to run the query offline with DuckDB instead of BigQuery.
+            Map each BigQuery table name to a local parquet file or glob, e.g.:
+            {qa_table: 'fixtures/qa/*.parquet', TABLE_SUBREDDIT_LOOKUP: 'fixtures/slo.parquet', ...}
+            The parquet files need the same columns as the BigQuery tables.
+
+    Returns:
+        dict: {country_code: df_labels_target}. Countries without subreddits get an empty df
+    """
+    target_countries = list(target_countries)
+    dialect = 'bigquery' if local_tables is None else 'duckdb'
+    sql_query = get_geo_relevant_subreddits_sql(
+        cluster_labels_table=cluster_labels_table,
+        qa_table=qa_table,
+        qa_pt=qa_pt,
+        geo_relevance_table=geo_relevance_table,
+        geo_min_users_percent_by_subreddit_l28=geo_min_users_percent_by_subreddit_l28,
+        geo_min_country_standardized_relevance=geo_min_country_standardized_relevance,
+        partition_dt=partition_dt,
+        local_tables=local_tables,
+    )
+
+    info(f"Querying geo-relevant subreddits for {len(target_countries)} countries ({dialect})...")
+    if dialect == 'bigquery':
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter('target_countries', 'STRING', target_countries),
+                bigquery.ArrayQueryParameter('sensitive_topics', 'STRING', L_SENSITIVE_TOPICS_FOR_FPRS),
+            ]
+        )
+        bq_client = bigquery.Client(project=project_name)
+        df_ = bq_client.query(sql_query, job_config=job_config).to_dataframe()
+    else:
+        # import here so that duckdb is only required to run the query locally
+        import duckdb
+
+        con = duckdb.connect()
+        con.register('param_target_countries', pd.DataFrame({'value': target_countries}))
+        con.register('param_sensitive_topics', pd.DataFrame({'value': L_SENSITIVE_TOPICS_FOR_FPRS}))
+        df_ = con.execute(sql_query).fetchdf()
+        con.close()
+    info(f" {df_.shape}  <- df_shape (all countries)")
+
+    d_df_by_country = {
+        k_: df_g.reset_index(drop=True)
+        for k_, df_g in df_.groupby('geo_country_code', sort=False)
+    }
+    for country_code_ in target_countries:
+        if country_code_ not in d_df_by_country:
+            logging.warning(f"  No geo-relevant subreddits found for: {country_code_}")
+            d_df_by_country[country_code_] = df_.iloc[:0].copy()
+        info(f"  {d_df_by_country[country_code_].shape} <- {country_code_} df_shape")
+
+    return {c_: d_df_by_country[c_] for c_ in target_countries}
+
+
+def get_geo_relevant_subreddits_sql(
+        cluster_labels_table: str,
+        qa_table: str,
+        qa_pt: str,
+        geo_relevance_table: str,
+        geo_min_users_percent_by_subreddit_l28: float = 0.14,
+        geo_min_country_standardized_relevance: float = 2.4,
+        partition_dt: str = "(CURRENT_DATE() - 2)",
+        local_tables: Dict[str, str] = None,
+) -> str:
+    """SQL for geo-relevant subreddits & cluster labels for multiple countries.
+
+    The BigQuery SQL uses array parameters: @target_countries & @sensitive_topics.
+    If `local_tables` is set, create DuckDB SQL that reads parquet files instead.
+      DuckDB reads the params from tables: param_target_countries & param_sensitive_topics
     """
-    if not partition_dt.startswith("(CURRENT_DATE("):
-        # Add quote marks in case we pass a string that needs to be converted to DATE
-        partition_dt = fr"'{partition_dt}'"
+    if local_tables is None:
+        def tbl_(table_name: str) -> str:
+            return f"`{table_name}`"
+        star_except = 'EXCEPT'
+        in_target_countries = 'IN UNNEST(@target_countries)'
+        not_in_sensitive_topics = 'NOT IN UNNEST(@sensitive_topics)'
+    else:
+        def tbl_(table_name: str) -> str:
+            if table_name not in local_tables:
+                raise KeyError(f"Missing local parquet file for table: {table_name}")
+            return f"read_parquet('{local_tables[table_name]}')"
+        star_except = 'EXCLUDE'
+        in_target_countries = 'IN (SELECT value FROM param_target_countries)'
+        not_in_sensitive_topics = 'NOT IN (SELECT value FROM param_sensitive_topics)'
+
+    if partition_dt.startswith("(CURRENT_DATE("):
+        partition_dt_ = partition_dt
+    else:
+        # Convert string to DATE
+        partition_dt_ = f"DATE '{partition_dt}'"
 
     sql_query = f"""
     -- Get country-relevant subreddits for FPRs + flags from CA QA
-    DECLARE TARGET_COUNTRY_CODE STRING DEFAULT '{target_country}';
-    DECLARE MIN_COUNTRY_STANDARDIZED_RELEVANCE NUMERIC DEFAULT 2.3;
-    DECLARE MIN_USERS_PCT_L28_REL NUMERIC DEFAULT 0.14;
-    
-    DECLARE PARTITION_DT DATE DEFAULT {partition_dt};
-    
-    -- Check sensitive topics in case labels have changed since CA QA step
-    DECLARE SENSITIVE_TOPICS DEFAULT [
-        'Addiction Support'
-        , 'Activism'
-        # , 'Culture, Race, and Ethnicity'
-        , 'Fitness and Nutrition'
-        , 'Gender', 'Mature Themes and Adult Content', 'Medical and Mental Health'
-        , 'Military'
-        , "Men's Health", 'Politics', 'Sexual Orientation'
-        , 'Trauma Support', "Women's Health"
-    ];
-    
     WITH
     target_geo_subs AS (
         SELECT
-            PARTITION_DT AS pt
-            , "{qa_pt}" as qa_pt
-            , "{qa_table}" AS qa_table
-            , "{geo_relevance_table}" AS geo_relevance_table
+            {partition_dt_} AS pt
+            , '{qa_pt}' as qa_pt
+            , '{qa_table}' AS qa_table
+            , '{geo_relevance_table}' AS geo_relevance_table
             , geo.subreddit_id
             , ars.users_l7
             , geo.geo_country_code
@@ -1383,39 +2235,39 @@ def get_geo_relevant_subreddits_and_cluster_labels(
             , geo.relevance_percent_by_subreddit
             , geo.relevance_percent_by_country_standardized
     
-        FROM `{qa_table}` AS qa
+        FROM {tbl_(qa_table)} AS qa
             LEFT JOIN (
                 SELECT *
-                FROM `{geo_relevance_table}`
-                WHERE geo_country_code = TARGET_COUNTRY_CODE
+                FROM {tbl_(geo_relevance_table)}
+                WHERE geo_country_code {in_target_countries}
             ) AS geo
                 ON geo.subreddit_id = qa.subreddit_id
     
             LEFT JOIN (
                 SELECT *
-                FROM `data-prod-165221.all_reddit.all_reddit_subreddits`
-                WHERE DATE(pt) = PARTITION_DT
+                FROM {tbl_(TABLE_ALL_REDDIT_SUBREDDITS)}
+                WHERE CAST(pt AS DATE) = {partition_dt_}
             ) AS ars
                 ON qa.subreddit_name = LOWER(ars.subreddit_name)
     
             LEFT JOIN (
-                SELECT * FROM `data-prod-165221.cnc.shredded_crowdsource_topic_and_rating`
-                WHERE pt = PARTITION_DT
+                SELECT * FROM {tbl_(TABLE_TOPIC_AND_RATING)}
+                WHERE pt = {partition_dt_}
             ) AS nt
                 ON qa.subreddit_id = nt.subreddit_id
             LEFT JOIN (
                 SELECT *
-                FROM `data-prod-165221.ds_v2_postgres_tables.subreddit_lookup`
+                FROM {tbl_(TABLE_SUBREDDIT_LOOKUP)}
                 -- Get latest partition
-                WHERE dt = PARTITION_DT
+                WHERE dt = {partition_dt_}
             ) AS slo
                 ON qa.subreddit_id = slo.subreddit_id
     
         WHERE 1=1
-            AND qa.pt = "{qa_pt}"
-            -- Pick subreddits relevant to target country under at least one metric/threshold
+            AND qa.pt = '{qa_pt}'
+            -- Pick subreddits relevant to target countries under at least one metric/threshold
             --   Use the numeric values in case the defined threshold change
-            AND geo.geo_country_code = TARGET_COUNTRY_CODE
+            AND geo.geo_country_code {in_target_countries}
             AND (
                 geo_relevance_default = TRUE
                 OR users_percent_by_subreddit_l28 >= {geo_min_users_percent_by_subreddit_l28}
@@ -1458,17 +2310,15 @@ def get_geo_relevant_subreddits_and_cluster_labels(
             AND COALESCE(slo.is_spam, FALSE) = FALSE
             AND COALESCE(slo.over_18, 'f') = 'f'
             AND COALESCE(slo.quarantine, FALSE) = FALSE
-            AND COALESCE(nt.rating_short, '') = "E"
-            AND COALESCE(nt.primary_topic, '') NOT IN UNNEST(SENSITIVE_TOPICS)
-    
-        ORDER BY geo.relevance_combined_score DESC, geo.users_percent_by_subreddit_l28 DESC
+            AND COALESCE(nt.rating_short, '') = 'E'
+            AND COALESCE(nt.primary_topic, '') {not_in_sensitive_topics}
     )
     , cluster_labels AS (
         SELECT
             sc.subreddit_id
     
             -- Exclude clusters that are overly broad... these don't provide meaningful recommendations
-            , sc.* EXCEPT(
+            , sc.* {star_except}(
                 subreddit_id, subreddit_name, primary_topic, __index_level_0__
                 , k_0010_label, k_0012_label, k_0020_label, k_0025_label, k_0030_label, k_0040_label
                 , k_0049_label
@@ -1476,24 +2326,20 @@ def get_geo_relevant_subreddits_and_cluster_labels(
                 , k_0025_majority_primary_topic, k_0030_majority_primary_topic, k_0040_majority_primary_topic
                 , k_0049_majority_primary_topic
             )
-        FROM `{cluster_labels_table}` sc
+        FROM {tbl_(cluster_labels_table)} sc
     )
     
     SELECT
         geo.*
-        , lbl.* EXCEPT(subreddit_id)
+        , lbl.* {star_except}(subreddit_id)
     FROM target_geo_subs AS geo
         -- inner join so that we only have subs that are BOTH relevant & in model
         INNER JOIN cluster_labels AS lbl
             ON geo.subreddit_id = lbl.subreddit_id
+    ORDER BY geo.geo_country_code, geo.relevance_combined_score DESC, geo.users_percent_by_subreddit_l28 DESC
     ;
     """
-
-    bq_client = bigquery.Client(project=project_name)
-    df_ = bq_client.query(sql_query).to_dataframe()
-
-    info(f" {df_.shape}  <- df_shape")
-    return df_
+    return sql_query
 
 
 def get_table_for_optimal_dynamic_cluster_params(
@@ -1509,6 +2355,7 @@ def get_table_for_optimal_dynamic_cluster_params(
         return_optimal_min_subs_in_cluster: bool = False,
         verbose: bool = False,
         tqdm_log_col_iterations: bool = False,
+        n_jobs: int = 1,
 ) -> Union[pd.DataFrame, Tuple[pd.DataFrame, int]]:
     """We want to balance two things:
     - prevent orphan subreddits
@@ -1516,6 +2363,10 @@ def get_table_for_optimal_dynamic_cluster_params(
 
     In order to do this at a country level, we'll be better off starting with smallest clusters
     and rolling up until we have at least N subreddits in one cluster.
+
+    We used to call `create_dynamic_clusters()` for each value of N. Now we use
+    `sweep_dynamic_cluster_params()`, which encodes the nested labels once & only re-runs
+    the roll-up for each N. The summary table is the same.
     """
     if min_subs_in_cluster_list is None:
         min_subs_in_cluster_list = [4, 5, 6, 7, 8, 9, 10]
@@ -1529,54 +2380,147 @@ def get_table_for_optimal_dynamic_cluster_params(
         # [1:]  # use all the columns! helps prevent a orphan subs
     )
 
-    l_iteration_results = list()
-    n_subs_in_target = df_labels_target['subreddit_id'].nunique()
-
-    for n_ in tqdm(min_subs_in_cluster_list):
-        d_run_clean = dict()
-        d_run_clean['subs_to_cluster_count'] = n_subs_in_target
-        d_run_clean['min_subreddits_in_cluster'] = n_
-
-        df_clusters_dynamic_ = create_dynamic_clusters(
-            df_labels_target,
-            agg_strategy='aggregate_small_clusters',
-            min_subreddits_in_cluster=n_,
-            l_cols_labels_input=l_cols_labels,
-            col_new_cluster_val=col_new_cluster_val,
-            col_new_cluster_name=col_new_cluster_name,
-            col_new_cluster_prim_topic=col_new_cluster_prim_topic,
-            col_new_cluster_topic_mix=col_new_cluster_topic_mix,
-            verbose=verbose,
-            tqdm_log_col_iterations=tqdm_log_col_iterations,
-        )
-        d_run_clean = {
-            **d_run_clean,
-            **get_dynamic_cluster_summary(
-                    df_dynamic_labels=df_clusters_dynamic_,
-                    col_new_cluster_val=col_new_cluster_val,
-                    col_new_cluster_name=col_new_cluster_name,
-                    col_new_cluster_prim_topic=col_new_cluster_prim_topic,
-                    col_num_orph_subs=col_num_orph_subs,
-                    col_num_subs_mean=col_num_subs_mean,
-                    col_num_subs_median=col_num_subs_median,
-                    return_dict=True,
-            )
-        }
-
-        l_iteration_results.append(d_run_clean)
-
-    del df_clusters_dynamic_, d_run_clean
-    gc.collect()
+    df_out = sweep_dynamic_cluster_params(
+        df_labels_target,
+        min_subs_in_cluster_list=min_subs_in_cluster_list,
+        l_cols_labels_input=l_cols_labels,
+        col_num_orph_subs=col_num_orph_subs,
+        col_num_subs_mean=col_num_subs_mean,
+        col_num_subs_median=col_num_subs_median,
+        n_jobs=n_jobs,
+        verbose=verbose,
+    )
 
     if return_optimal_min_subs_in_cluster:
-        df_out = pd.DataFrame(l_iteration_results)
         optimal_min = df_out.loc[
             df_out['num_orphan_subreddits'] == df_out['num_orphan_subreddits'].min(),
             'min_subreddits_in_cluster'
         ].values[0]
         return df_out, optimal_min
     else:
-        return pd.DataFrame(l_iteration_results)
+        return df_out
+
+
+def sweep_dynamic_cluster_params(
+        df_labels_target: pd.DataFrame,
+        min_subs_in_cluster_list: iter,
+        l_cols_labels_input: List[str] = None,
+        agg_strategy: str = 'aggregate_small_clusters',
+        suffix_label_col: str = '_label',
+        suffix_primary_topic_col: str = '_majority_primary_topic',
+        col_num_orph_subs: str = 'num_orphan_subreddits',
+        col_num_subs_mean: str = 'num_subreddits_per_cluster_mean',
+        col_num_subs_median: str = 'num_subreddits_per_cluster_median',
+        n_jobs: int = 1,
+        verbose: bool = False,
+) -> pd.DataFrame:
+    """Get the `get_dynamic_cluster_summary()` stats for multiple values of
+    `min_subreddits_in_cluster` without running `create_dynamic_clusters()` for each one.
+
+    Work that doesn't depend on the threshold is done once:
+    - nested labels as int codes & strings (`get_nested_cluster_label_codes()`)
+    - majority primary topic for each level
+    - order to roll-up levels
+    Then each threshold only needs the roll-up (`get_dynamic_cluster_levels()`) & the summary.
+    Topic mix columns are skipped because the summary doesn't use them.
+
+    Args:
+        n_jobs: processes to spread thresholds over. n_jobs=1 runs in this process
+
+    Returns:
+        df with one row per threshold, same columns as the loop over `create_dynamic_clusters()`
+    """
+    if l_cols_labels_input is None:
+        l_cols_labels_input = [c for c in df_labels_target.columns if c.endswith(suffix_label_col)]
+
+    if verbose:
+        info(f"  Encoding nested labels for {len(l_cols_labels_input)} label columns...")
+    arr_groups, l_arr_nested_labels = get_nested_cluster_label_codes(
+        df_labels_target[l_cols_labels_input].to_numpy()
+    )
+    d_sweep_inputs = {
+        'arr_groups': arr_groups,
+        'arr_nested_labels': np.column_stack(l_arr_nested_labels),
+        'arr_primary_topics': df_labels_target[
+            [c.replace(suffix_label_col, suffix_primary_topic_col) for c in l_cols_labels_input]
+        ].to_numpy(dtype=object),
+        'l_levels_by_name': sorted(range(len(l_cols_labels_input)), key=lambda j: l_cols_labels_input[j]),
+        'agg_strategy': agg_strategy,
+        'col_num_orph_subs': col_num_orph_subs,
+        'col_num_subs_mean': col_num_subs_mean,
+        'col_num_subs_median': col_num_subs_median,
+    }
+    n_subs_in_target = df_labels_target['subreddit_id'].nunique()
+
+    fxn_summary = partial(_get_dynamic_cluster_summary_for_threshold, d_sweep_inputs=d_sweep_inputs)
+    min_subs_in_cluster_list = list(min_subs_in_cluster_list)
+    if (n_jobs is None) or (n_jobs <= 1):
+        l_summaries = [fxn_summary(n_) for n_ in min_subs_in_cluster_list]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            l_summaries = list(executor.map(fxn_summary, min_subs_in_cluster_list))
+
+    return pd.DataFrame([
+        {
+            'subs_to_cluster_count': n_subs_in_target,
+            'min_subreddits_in_cluster': n_,
+            **d_summary_,
+        }
+        for n_, d_summary_ in zip(min_subs_in_cluster_list, l_summaries)
+    ])
+
+
+def _get_dynamic_cluster_summary_for_threshold(
+        min_subreddits_in_cluster: int,
+        d_sweep_inputs: dict,
+) -> dict:
+    """Roll-up clusters for one threshold & summarize them with arrays.
+    Same output as `get_dynamic_cluster_summary(create_dynamic_clusters(...))`.
+    Module-level so it can be pickled & sent to a process pool.
+    """
+    arr_groups = d_sweep_inputs['arr_groups']
+    n_rows, n_levels = arr_groups.shape
+    l_levels_by_name = d_sweep_inputs['l_levels_by_name']
+    if d_sweep_inputs['agg_strategy'] == 'aggregate_small_clusters':
+        start_level = n_levels - 1
+        l_levels_to_check = [j for j in l_levels_by_name[::-1] if j != start_level]
+    else:
+        start_level = 1
+        l_levels_to_check = [j for j in l_levels_by_name if j >= 1]
+
+    arr_level = get_dynamic_cluster_levels(
+        arr_groups,
+        l_levels_to_check=l_levels_to_check,
+        start_level=start_level,
+        min_subreddits_in_cluster=min_subreddits_in_cluster,
+        agg_strategy=d_sweep_inputs['agg_strategy'],
+    )
+    ix_rows = np.arange(n_rows)
+    # one int key per (level, nested label)
+    arr_key = arr_level * (arr_groups.max() + 1) + arr_groups[ix_rows, arr_level]
+    keys_uniq, ix_first_row, key_codes, cluster_sizes = np.unique(
+        arr_key, return_index=True, return_inverse=True, return_counts=True,
+    )
+    mask_orphan_rows = cluster_sizes[key_codes.reshape(-1)] <= 1
+
+    col_num_subs_mean = d_sweep_inputs['col_num_subs_mean']
+    d_run = dict()
+    d_run['cluster_count'] = len(keys_uniq)
+    d_run[d_sweep_inputs['col_num_orph_subs']] = int(mask_orphan_rows.sum())
+    d_run[col_num_subs_mean.replace('_mean', '_min')] = cluster_sizes.min()
+    d_run[col_num_subs_mean] = cluster_sizes.mean()
+    d_run[d_sweep_inputs['col_num_subs_median']] = np.median(cluster_sizes)
+    d_run[col_num_subs_mean.replace('_mean', '_max')] = cluster_sizes.max()
+
+    # primary topic of the first row in each cluster (same as drop_duplicates)
+    arr_prim_topics_ = d_sweep_inputs['arr_primary_topics'][ix_first_row, arr_level[ix_first_row]]
+    d_run['num_clusters_with_mature_primary_topic'] = sum(
+        [('mature' in t_.lower()) for t_ in arr_prim_topics_ if isinstance(t_, str)]
+    )
+    d_run['cluster_ids_with_orphans'] = ', '.join(sorted(
+        d_sweep_inputs['arr_nested_labels'][ix_rows[mask_orphan_rows], arr_level[mask_orphan_rows]]
+    ))
+    return d_run
 
 
 def get_dynamic_cluster_summary(
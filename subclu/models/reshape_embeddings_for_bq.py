@@ -35,6 +35,9 @@ def reshape_embeddings_to_ndjson(
 
     We return the GCS path for the mlflow artifact so that we can use it downstream
     to upload that file to create a BigQuery table from it.
+
+    If `embedding_cols` is a single column with one array per row (fixed_size_list
+    storage format), we use it as is instead of reshaping wide columns into lists.
     """
     local_f_name = f"{f_name_prefix}_{datetime.utcnow().strftime('%Y-%m-%d_%H%M%S')}.json"
     d_paths = {
@@ -65,8 +68,12 @@ def reshape_embeddings_to_ndjson(
         [c for c in df_new.columns if c not in l_cols_to_front]
     )
     df_new = df_new[l_new_col_order]
-    info(f"Converting embeddings to repeated format...")
-    df_new['embeddings'] = df_embeddings[embedding_cols].values.tolist()
+    if (len(embedding_cols) == 1) and (df_embeddings[embedding_cols[0]].dtype == object):
+        info(f"Embeddings already in repeated format")
+        df_new['embeddings'] = df_embeddings[embedding_cols[0]].to_numpy()
+    else:
+        info(f"Converting embeddings to repeated format...")
+        df_new['embeddings'] = df_embeddings[embedding_cols].values.tolist()
 
     info(f"{df_new.shape} <- Shape of new df before converting to JSON")
     info(f"df output cols:\n  {list(df_new.columns)}")
@@ -138,6 +145,9 @@ def reshape_embeddings_and_upload_to_bq(
             Path(save_path_local_root) / f"{dict_reshape_config['embeddings_artifact_path']}_ndjson"
     )
     l_embedding_cols = [c for c in df_embeddings.columns if c.startswith(embedding_col_prefix)]
+    if (len(l_embedding_cols) == 0) and (embedding_col_prefix.rstrip('_') in df_embeddings.columns):
+        # nested embeddings (fixed_size_list storage format)
+        l_embedding_cols = [embedding_col_prefix.rstrip('_')]
     info(f"{len(l_embedding_cols):,.0f} <- # embedding columns found")
 
     d_paths = reshape_embeddings_to_ndjson(
@@ -0,0 +1,223 @@
+"""
+Completion manifest for batch vectorization jobs.
+
+`vectorize_text_to_embeddings` processes comment files one at a time. When a VM dies
+(OOM, preemption, GPU errors) we used to re-run the job with
+`n_comment_files_slice_start/end` to only process the missing files. The manifest
+automates that:
+- One JSON entry per input file with: input file, output file, row count & checksums
+- An entry is only written AFTER the output parquet is on disk, so a job that died
+  mid-file leaves no entry (or a stale one) and the file gets re-processed
+- Each worker claims a file with a non-blocking `fcntl.flock()` on a lock file. The
+  OS releases the lock when the process exits (even if it crashes or gets killed)
+  so we don't need to clean up stale claims.
+
+The manifest folder needs to be on a file system that's shared by all workers
+(e.g., a local disk for multiple processes in the same VM, or an NFS/filestore mount).
+"""
+from datetime import datetime
+import fcntl
+import hashlib
+import json
+import logging
+from logging import info
+import os
+from pathlib import Path
+from typing import Optional, Union
+
+
+log = logging.getLogger(__name__)
+
+
+def get_file_md5(
+        path: Union[str, Path],
+        chunk_size: int = 2 ** 20,
+) -> str:
+    """Get MD5 hex-digest of a local file, reading it in chunks to keep memory flat"""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f_:
+        for chunk in iter(lambda: f_.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class VectorizeManifest:
+    """Track which input files have been vectorized so restarted jobs can skip them.
+
+    Layout inside `manifest_path`:
+        <file_root>.json    completion entry, written atomically after output is saved
+        <file_root>.lock    lock file used by workers to claim an input file
+
+    Example:
+        manifest = VectorizeManifest(path)
+        for blob in blobs:
+            if manifest.is_complete(blob.name, blob.md5_hash):
+                continue
+            if not manifest.claim(blob.name):
+                continue  # another worker is processing this file
+            try:
+                if manifest.is_complete(blob.name, blob.md5_hash):
+                    continue  # another worker finished it before we claimed it
+                ...vectorize & save output...
+                manifest.mark_complete(blob.name, ...)
+            finally:
+                manifest.release(blob.name)
+    """
+    def __init__(
+            self,
+            manifest_path: Union[str, Path],
+            verify_output_checksum: bool = True,
+    ):
+        self.manifest_path = Path(manifest_path)
+        self.verify_output_checksum = verify_output_checksum
+        Path.mkdir(self.manifest_path, exist_ok=True, parents=True)
+
+        # Keep open file handles for claimed locks: {input_file: file_object}
+        self._d_locks = dict()
+
+    @staticmethod
+    def get_file_root(input_file: str) -> str:
+        """Use the same root name we use for output files, e.g.:
+        'path/to/000000000012.parquet' -> '000000000012'
+        """
+        return input_file.split('/')[-1].split('.')[0]
+
+    def _f_entry(self, input_file: str) -> Path:
+        return self.manifest_path / f"{self.get_file_root(input_file)}.json"
+
+    def _f_lock(self, input_file: str) -> Path:
+        return self.manifest_path / f"{self.get_file_root(input_file)}.lock"
+
+    def get_entry(self, input_file: str) -> Optional[dict]:
+        """Return the completion entry for a file, or None if it's missing or unreadable"""
+        f_entry = self._f_entry(input_file)
+        if not f_entry.is_file():
+            return None
+        try:
+            with open(f_entry, 'r') as f_:
+                return json.load(f_)
+        except (json.JSONDecodeError, OSError) as e:
+            logging.warning(f"  Could not read manifest entry {f_entry.name}, file will be re-processed\n{e}")
+            return None
+
+    def is_complete(
+            self,
+            input_file: str,
+            input_checksum: str = None,
+    ) -> bool:
+        """A file is complete only if:
+        - it has an entry in the manifest
+        - the input checksum hasn't changed (if we have one)
+        - the output file exists and its checksum matches the entry
+        """
+        d_entry = self.get_entry(input_file)
+        if d_entry is None:
+            return False
+
+        if (input_checksum is not None) and (d_entry.get('input_checksum') != input_checksum):
+            info(f"  Input checksum changed for {input_file}, file will be re-processed")
+            return False
+
+        if d_entry.get('output_rows', 0) == 0:
+            # Files with no rows left after filtering don't have an output file
+            return True
+
+        f_output = Path(d_entry['output_file'])
+        if not f_output.is_file():
+            info(f"  Output file missing for {input_file}, file will be re-processed")
+            return False
+
+        if self.verify_output_checksum:
+            if get_file_md5(f_output) != d_entry.get('output_checksum'):
+                info(f"  Output checksum mismatch for {input_file}, file will be re-processed")
+                return False
+
+        return True
+
+    def claim(self, input_file: str) -> bool:
+        """Try to get an exclusive lock for an input file.
+        Returns False (without waiting) if another worker already holds the lock.
+        """
+        if input_file in self._d_locks:
+            return True
+
+        f_lock = open(self._f_lock(input_file), 'a')
+        try:
+            fcntl.flock(f_lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (BlockingIOError, OSError):
+            f_lock.close()
+            return False
+
+        f_lock.seek(0)
+        f_lock.truncate()
+        f_lock.write(f"{os.getpid()}\n")
+        f_lock.flush()
+        self._d_locks[input_file] = f_lock
+        return True
+
+    def release(self, input_file: str) -> None:
+        """Release the lock for an input file (closing the file releases the flock)"""
+        f_lock = self._d_locks.pop(input_file, None)
+        if f_lock is not None:
+            fcntl.flock(f_lock.fileno(), fcntl.LOCK_UN)
+            f_lock.close()
+
+    def remove_partial_outputs(
+            self,
+            input_file: str,
+            output_folder: Union[str, Path],
+    ) -> None:
+        """Delete output files left by a job that died before writing the manifest entry.
+        Output files are named: `<file_root>-<rows>_by_<cols>.parquet`
+        """
+        for f_ in Path(output_folder).glob(f"{self.get_file_root(input_file)}-*.parquet"):
+            info(f"  Removing partial output: {f_.name}")
+            f_.unlink()
+
+    def mark_complete(
+            self,
+            input_file: str,
+            output_file: Optional[Union[str, Path]],
+            output_rows: int,
+            input_checksum: str = None,
+            input_rows: int = None,
+    ) -> dict:
+        """Write the completion entry. Write to a temp file first & rename it so that
+        a crash while writing can't leave a truncated entry that looks complete.
+        """
+        d_entry = {
+            'input_file': input_file,
+            'input_checksum': input_checksum,
+            'input_rows': input_rows,
+            'output_file': None if output_file is None else str(output_file),
+            'output_checksum': None if output_file is None else get_file_md5(output_file),
+            'output_rows': output_rows,
+            'completed_utc': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'host_pid': os.getpid(),
+        }
+        f_entry = self._f_entry(input_file)
+        f_tmp = f_entry.with_suffix(f".tmp{os.getpid()}")
+        with open(f_tmp, 'w') as f_:
+            json.dump(d_entry, f_)
+            f_.flush()
+            os.fsync(f_.fileno())
+        os.replace(f_tmp, f_entry)
+        return d_entry
+
+    def summary(self) -> dict:
+        """Count completed files & rows. Useful for logging to mlflow at the end of a job"""
+        n_files = 0
+        n_rows = 0
+        for f_ in self.manifest_path.glob('*.json'):
+            try:
+                with open(f_, 'r') as f_entry:
+                    n_rows += json.load(f_entry).get('output_rows', 0)
+                n_files += 1
+            except (json.JSONDecodeError, OSError):
+                continue
+        return {'manifest_files_complete': n_files, 'manifest_rows_complete': n_rows}
+
+
+#
+# ~ fin
+#
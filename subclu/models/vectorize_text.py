@@ -5,6 +5,7 @@ For FSE (uSIF & SIF), we might also need to "train" a model, but the focus
 of these models is just to vectorize without fine-tuning or retraining a language
 model. That'll be a separate job/step.
 """
+from concurrent.futures import ThreadPoolExecutor
 import gc
 import logging
 from datetime import datetime, timedelta
@@ -61,6 +62,9 @@ def vectorize_text_to_embeddings(
         tf_batch_inference_rows: int = 1800,
         tf_limit_first_n_chars: int = 1200,
 
+        fse_inference_chunk_rows: int = None,
+        fse_inference_n_jobs: int = 1,
+
         n_sample_posts: int = None,
         n_sample_comments: int = None,
 ) -> Tuple[callable, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
@@ -102,6 +106,8 @@ def vectorize_text_to_embeddings(
 
         'tf_batch_inference_rows': tf_batch_inference_rows,
         'tf_limit_first_n_chars': tf_limit_first_n_chars,
+        'fse_inference_chunk_rows': fse_inference_chunk_rows,
+        'fse_inference_n_jobs': fse_inference_n_jobs,
         'n_sample_posts': n_sample_posts,
         'n_sample_comments': n_sample_comments,
     }
@@ -373,6 +379,8 @@ def vectorize_text_to_embeddings(
                 dict_index_to_id=d_ix_to_id,
                 col_id_to_map=col_post_id,
                 cols_index='post_default',
+                inference_chunk_rows=fse_inference_chunk_rows,
+                inference_n_jobs=fse_inference_n_jobs,
             )
             save_df_and_log_to_mlflow(
                 df=df_vect,
@@ -392,7 +400,9 @@ def vectorize_text_to_embeddings(
                 dict_index_to_id=d_ix_to_id,
                 col_id_to_map=col_subreddit_id,
                 cols_index='subreddit_default',
-                verbose=True
+                verbose=True,
+                inference_chunk_rows=fse_inference_chunk_rows,
+                inference_n_jobs=fse_inference_n_jobs,
             )
             save_df_and_log_to_mlflow(
                 df=df_vect_subs,
@@ -414,9 +424,6 @@ def vectorize_text_to_embeddings(
                     lowercase=tokenize_lowercase
                 ),
             )
-            # TODO(djb): instead of passing a dict, pass a df that has same 0-index
-            #  and merge on index to avoid expensive lookup using dictionary
-            #  to map IDs to index
             df_vect_comments = vectorize_text_with_fse(
                 model=model,
                 fse_processed_text=indexed_comments,
@@ -424,6 +431,8 @@ def vectorize_text_to_embeddings(
                 dict_index_to_id=d_ix_to_id_c,
                 col_id_to_map=col_comment_id,
                 cols_index='comment_default',
+                inference_chunk_rows=fse_inference_chunk_rows,
+                inference_n_jobs=fse_inference_n_jobs,
             )
             elapsed_time(t_start_comment_vec, log_label='Inference time for COMMENTS', verbose=True)
             save_df_and_log_to_mlflow(
@@ -689,6 +698,49 @@ def process_text_for_fse(
 #     """TODO, move filtering logic to a function, instead of a big block of code"""
 
 
+def infer_fse_in_chunks(
+        model,
+        fse_processed_text,
+        chunk_rows: int = 50000,
+        n_jobs: int = 1,
+        verbose: bool = True,
+) -> np.ndarray:
+    """Run fse inference in chunks & write each chunk into one pre-allocated array.
+
+    fse's inner loops are cython `nogil` functions, so threads can run inference in
+    parallel without pickling the model (a fastText model can take 10+ GB of RAM,
+    so a process pool would need one copy per worker).
+
+    Each item in `fse_processed_text` is a tuple: (tokens, custom_index). We re-index
+    the items in each chunk to 0..n-1 (the shape fse expects) and write the output
+    back to the rows of the original custom_index.
+    """
+    n_rows = len(fse_processed_text)
+    n_chunks = 1 + (n_rows - 1) // chunk_rows if n_rows > 0 else 0
+
+    def _infer_chunk(i_chunk: int) -> Tuple[np.ndarray, np.ndarray]:
+        l_tokens = list()
+        l_ix = list()
+        for i_local, i_row in enumerate(range(i_chunk * chunk_rows, min((i_chunk + 1) * chunk_rows, n_rows))):
+            tokens_, ix_ = fse_processed_text[i_row]
+            l_tokens.append((tokens_, i_local))
+            l_ix.append(ix_)
+        return np.asarray(l_ix), model.infer(l_tokens)
+
+    arr_vectors = None
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        for arr_ix, arr_chunk in tqdm(
+                executor.map(_infer_chunk, range(n_chunks)),
+                total=n_chunks, disable=not verbose, ascii=True, ncols=80,
+        ):
+            if arr_vectors is None:
+                arr_vectors = np.zeros((n_rows, arr_chunk.shape[1]), dtype=np.float32)
+            if arr_ix.max() >= n_rows:
+                raise ValueError(f"Custom index {arr_ix.max()} is out of bounds for {n_rows} rows")
+            arr_vectors[arr_ix] = arr_chunk[:len(arr_ix)]
+    return arr_vectors
+
+
 def vectorize_text_with_fse(
         model,
         fse_processed_text,
@@ -699,28 +751,36 @@ def vectorize_text_with_fse(
         col_embeddings_prefix: str = 'embeddings',
         cols_index: Union[str, List[str]] = 'post_default',
         verbose: bool = True,
+        inference_chunk_rows: int = None,
+        inference_n_jobs: int = 1,
 ) -> pd.DataFrame:
     """
-    It looks like a lot of time was wasted looking up the post/comment-id
-    to map it back to the
-    Note that converting vectors to df can take a long time, for 111k posts:
+    Note that converting vectors to df used to take a long time, for 111k posts:
         model.infer() could take 30 seconds
-        but converting vectors to df & joining to df can take 4 minutes
-    Even then, the added time is worth it because it makes it easy to
-    be able add an index and join the data to the original post/comment
+        but converting vectors to df & joining to df could take 4 minutes
+
+    `process_text_for_fse()` sets each row's index to its position in the input df,
+    so row `i` of the inference output belongs to row `i` of `df_to_merge`. We use that
+    positional alignment to set the index instead of building a df from
+    `dict_index_to_id` and merging it twice.
 
     Args:
-        model:
-        fse_processed_text:
-        df_to_merge:
-        dict_index_to_id:
-        index_to_id_array:
+        model: trained fse model
+        fse_processed_text: output from process_text_for_fse()
+        df_to_merge: df used to create `fse_processed_text`, used to get `cols_index`
+        dict_index_to_id: only used when `df_to_merge` is None
+        index_to_id_array: only used when `df_to_merge` & `dict_index_to_id` are None
         col_id_to_map:
         col_embeddings_prefix:
         cols_index:
         verbose:
+        inference_chunk_rows:
+            If not None, run inference in chunks of this size (see `infer_fse_in_chunks()`)
+        inference_n_jobs:
+            Number of threads to run chunks in parallel
 
     Returns:
+        df with one row per document, `cols_index` as index & one column per dimension
     """
     # wrapper to vectorize posts/comments AND merge back to df (if not None)
     if cols_index == 'post_default':
@@ -730,47 +790,54 @@ def vectorize_text_with_fse(
     if cols_index == 'subreddit_default':
         cols_index = ['subreddit_name', 'subreddit_id']
 
-    # go straight into df, maybe that can cut down time
-    # vectorized_posts = model.infer(fse_processed_text)
-    # info(f"{vectorized_posts.shape} <- Raw vectorized text shape")
+    if df_to_merge is not None:
+        # Duplicated IDs share one custom index in `process_text_for_fse()`, so the output
+        #  would still have one row per input row, but the vectors would be misaligned
+        if not df_to_merge[col_id_to_map].is_unique:
+            n_dupes_ = df_to_merge[col_id_to_map].duplicated().sum()
+            raise ValueError(
+                f"Can't align vectors by position: {n_dupes_:,.0f} duplicated IDs in {col_id_to_map}."
+                f" Drop duplicates before calling process_text_for_fse()"
+            )
 
     t_start_vec_to_df = datetime.utcnow()
-    info(f"  Inference + convert to df...")
-    df_vect = pd.DataFrame(model.infer(fse_processed_text))
-    elapsed_time(t_start_vec_to_df, log_label='Raw inference+df only', verbose=True)
-    info(f"    {df_vect.shape} <- Raw vectorized text shape")
-
-    info(f"  Creating df from dict_index_to_id...")
-    df_ix_to_id = pd.DataFrame(list(dict_index_to_id.items()),
-                               columns=['index', col_id_to_map]
-                               ).set_index('index')
-
-    info(f"  Setting {col_id_to_map} as index...")
-    df_vect = (
-        df_vect
-        .rename(columns={c: f"{col_embeddings_prefix}_{c}" for c in df_vect.columns})
-        .merge(
-            df_ix_to_id,
-            how='left',
-            left_index=True,
-            right_index=True,
+    info(f"  Inference...")
+    if inference_chunk_rows is None:
+        arr_vectors = model.infer(fse_processed_text)
+    else:
+        arr_vectors = infer_fse_in_chunks(
+            model,
+            fse_processed_text,
+            chunk_rows=inference_chunk_rows,
+            n_jobs=inference_n_jobs,
+            verbose=verbose,
         )
-    ).set_index(col_id_to_map)
+    elapsed_time(t_start_vec_to_df, log_label='Raw inference only', verbose=True)
+    info(f"    {arr_vectors.shape} <- Raw vectorized text shape")
 
     if df_to_merge is not None:
-        info(f"  Merging df_vectors with df to get new index columns...")
-        t_start_merging = datetime.utcnow()
-        df_vect = (
-            df_to_merge[cols_index]
-            .merge(
-                df_vect,
-                how='right',
-                left_on=[col_id_to_map],
-                right_index=True,
+        if len(df_to_merge) != len(arr_vectors):
+            raise ValueError(
+                f"Can't align vectors by position: {len(arr_vectors):,.0f} vectors"
+                f" vs {len(df_to_merge):,.0f} rows in df_to_merge"
             )
-            .set_index(cols_index)
+        index_output = pd.MultiIndex.from_frame(df_to_merge[cols_index])
+    elif dict_index_to_id is not None:
+        index_output = pd.Index(
+            [dict_index_to_id.get(i) for i in range(len(arr_vectors))],
+            name=col_id_to_map
         )
-        elapsed_time(t_start_merging, log_label=' Merging df_vect with ID columns', verbose=True)
+    elif index_to_id_array is not None:
+        index_output = pd.Index(index_to_id_array, name=col_id_to_map)
+    else:
+        index_output = None
+
+    df_vect = pd.DataFrame(
+        arr_vectors,
+        index=index_output,
+        columns=[f"{col_embeddings_prefix}_{c}" for c in range(arr_vectors.shape[1])],
+        copy=False,
+    )
     if verbose:
         elapsed_time(t_start_vec_to_df, log_label='Converting vectors to df FULL', verbose=True)
 
@@ -778,7 +845,6 @@ def vectorize_text_with_fse(
 
 
 
-
 #
 # ~ fin
 #
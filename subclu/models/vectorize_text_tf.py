@@ -14,8 +14,9 @@ from pathlib import Path
 from typing import Union, List, Optional, Tuple
 
 import mlflow
+import numpy as np
 import pandas as pd
-# import numpy as np
+import pyarrow as pa
 # from sklearn.pipeline import Pipeline
 from tqdm import tqdm
 
@@ -23,8 +24,13 @@ import tensorflow_hub as hub
 from tensorflow import errors
 
 from .registry_tf_hub import D_MODELS_TF_HUB
+from .vectorize_manifest import VectorizeManifest
 from ..utils import get_project_subfolder
 from ..utils.eda import elapsed_time
+from ..utils.embeddings_storage import (
+    STORAGE_FORMAT_WIDE, STORAGE_FORMAT_FIXED_SIZE_LIST,
+    save_embeddings_to_parquet, save_embeddings_to_parquet_in_chunks,
+)
 from ..utils.mlflow_logger import (
     MlflowLogger, save_pd_df_to_parquet_in_chunks,
     save_and_log_config,
@@ -79,6 +85,8 @@ def vectorize_text_to_embeddings(
         n_sample_comments: int = None,
         get_embeddings_verbose: bool = False,
         log_each_batch_df_to_mlflow_invididually: bool = False,
+        comments_manifest_path: str = None,
+        embeddings_storage_format: str = STORAGE_FORMAT_WIDE,
 ) -> None:
     """
     Take files in GCS as input and run them through selected model to extract embeddings.
@@ -87,6 +95,17 @@ def vectorize_text_to_embeddings(
     - posts_path[col_text_post]
     - posts_path[col_text_post_url] (TODO: djb)
     - comments_path[col_text_comment]
+
+    If `comments_manifest_path` is set (and `batch_comment_files=True`), comment outputs
+    are saved under that folder instead of the new timestamped model folder & each
+    completed file is recorded in a manifest (see `VectorizeManifest`).
+    A restarted job with the same `comments_manifest_path` skips completed files and only
+    re-processes missing or partial ones. Multiple workers can point to the same folder
+    because each input file is claimed with a file lock.
+
+    `embeddings_storage_format`:
+        'wide':             one column per dimension (embeddings_0 ... embeddings_511)
+        'fixed_size_list':  one FixedSizeList<float32> column (embeddings)
     """
     # TODO(djb): is there a way to just log all the inputs to the fxn?
     d_params_to_log = {
@@ -127,6 +146,8 @@ def vectorize_text_to_embeddings(
         'batch_comment_files': batch_comment_files,
         'n_sample_posts': n_sample_posts,
         'n_sample_comments': n_sample_comments,
+        'comments_manifest_path': comments_manifest_path,
+        'embeddings_storage_format': embeddings_storage_format,
     }
 
     # load only columns needed for joining & inference
@@ -253,6 +274,7 @@ def vectorize_text_to_embeddings(
             df=df_vect_subs.reset_index(),
             local_path=path_this_model,
             name_for_metric_and_artifact_folder='df_vect_subreddits_description',
+            storage_format=embeddings_storage_format,
         )
         del df_subs, df_vect_subs
         gc.collect()
@@ -300,6 +322,7 @@ def vectorize_text_to_embeddings(
             df=df_vect.reset_index(),
             local_path=path_this_model,
             name_for_metric_and_artifact_folder='df_vect_posts',
+            storage_format=embeddings_storage_format,
         )
         del df_vect
         # We shouldn't delete df_posts because we need the IDs to check comments,
@@ -321,7 +344,17 @@ def vectorize_text_to_embeddings(
             # Use this var to track how many comments we've processed
             total_comments_count = 0
             total_time_comms_vect = 0
-            local_comms_subfolder_full = Path(path_this_model) / local_comms_subfolder_relative
+            count_comms_files_skipped = 0
+            if comments_manifest_path is None:
+                manifest = None
+                path_comms_output = path_this_model
+            else:
+                # Use a stable output folder so that outputs from previous (crashed) runs
+                #  are still there when we restart the job
+                manifest = VectorizeManifest(Path(comments_manifest_path) / '_manifest')
+                path_comms_output = comments_manifest_path
+                info(f"  Using comments manifest:\n  {manifest.manifest_path}")
+            local_comms_subfolder_full = Path(path_comms_output) / local_comms_subfolder_relative
 
             # # TODO(djb): check whether list of blobs is sorted alphabetically
             # #  or force sorting it so that we can apply slices
@@ -342,7 +375,11 @@ def vectorize_text_to_embeddings(
             #     l_comment_files_to_process = l_comment_files_sorted[:n_sample_comment_files]
             # print(f"List of files to process: \n  {l_comment_files_to_process}")
 
-            l_comment_files_to_process = list(bucket.list_blobs(prefix=comments_path))[:n_sample_comment_files]
+            l_comment_files_to_process = list(bucket.list_blobs(prefix=comments_path))
+            if manifest is not None:
+                # Sort so that all workers & restarts see the same order (and slices)
+                l_comment_files_to_process = sorted(l_comment_files_to_process, key=lambda b: b.name)
+            l_comment_files_to_process = l_comment_files_to_process[:n_sample_comment_files]
             if n_comment_files_slice_end is not None:
                 if n_comment_files_slice_start is None:
                     n_comment_files_slice_start = 0
@@ -370,150 +407,183 @@ def vectorize_text_to_embeddings(
                 gc.collect()
                 # Use this name to map old files to new files
                 f_comment_name_root = blob.name.split('/')[-1].split('.')[0]
-                info(f"Processing: {blob.name}")
-
-                # TODO(djb): instead of reading each file from GCS, cache them locally first!
-                df_comments = pd.read_parquet(
-                    path=f"gs://{bucket_name}/{blob.name}",
-                    columns=l_cols_comments
-                )
-                # info(f"  {df_comments.shape} <- df_comments shape")
-                if len(df_comments) > df_comments[col_comment_id].nunique():
-                    logging.warning(f"Found duplicate IDs in col: {col_comment_id}")
-                    info(f"Keeping only one row_per ID")
-                    df_comments = df_comments.drop_duplicates(subset=l_cols_ix_comments, keep='first')
-                    info(f"  {df_comments.shape} <- df_comments.shape AFTER removing duplicates")
-
-                gc.collect()
-
+                if manifest is not None:
+                    if manifest.is_complete(blob.name, input_checksum=blob.md5_hash):
+                        info(f"Skipping, already complete in manifest: {blob.name}")
+                        count_comms_files_skipped += 1
+                        continue
+                    if not manifest.claim(blob.name):
+                        info(f"Skipping, file claimed by another worker: {blob.name}")
+                        count_comms_files_skipped += 1
+                        continue
                 try:
-                    # reduce logging b/c we'll go through 30+ files
-                    # info(f"Keep only comments that match posts IDs in df_posts...")
-                    if df_posts is not None:
-                        df_comments = df_comments[df_comments[col_post_id].isin(df_posts[col_post_id])]
-                        info(f"  {df_comments.shape} <- df_comments.shape AFTER removing orphan comments (w/o post)")
-                except (TypeError, UnboundLocalError) as e:
-                    pass
+                    if manifest is not None:
+                        # Another worker might have finished the file between is_complete() & claim()
+                        if manifest.is_complete(blob.name, input_checksum=blob.md5_hash):
+                            info(f"Skipping, completed by another worker: {blob.name}")
+                            count_comms_files_skipped += 1
+                            continue
+                        manifest.remove_partial_outputs(blob.name, local_comms_subfolder_full)
+                    info(f"Processing: {blob.name}")
+
+                    # TODO(djb): instead of reading each file from GCS, cache them locally first!
+                    df_comments = pd.read_parquet(
+                        path=f"gs://{bucket_name}/{blob.name}",
+                        columns=l_cols_comments
+                    )
+                    n_comments_input_file = len(df_comments)
+                    # info(f"  {df_comments.shape} <- df_comments shape")
+                    if len(df_comments) > df_comments[col_comment_id].nunique():
+                        logging.warning(f"Found duplicate IDs in col: {col_comment_id}")
+                        info(f"Keeping only one row_per ID")
+                        df_comments = df_comments.drop_duplicates(subset=l_cols_ix_comments, keep='first')
+                        info(f"  {df_comments.shape} <- df_comments.shape AFTER removing duplicates")
 
-                if df_subs_exclude is not None:
-                    info(f"  Excluding posts for subs to exclude...")
-                    df_comments = df_comments[~df_comments['subreddit_id'].isin(df_subs_exclude['subreddit_id'])]
-                    info(f"  {df_comments.shape} <- df_comments.shape AFTER excluding subreddits")
-
-                if n_sample_comments is not None:
-                    n_sample_comments_per_file = 1 + int(n_sample_comments / total_comms_file_count)
-                    info(f"  Sampling COMMENTS down to: {n_sample_comments:,.0f}"
-                         f"     Samples PER FILE: {n_sample_comments_per_file:,.0f}")
-                    df_comments = df_comments.sample(n=n_sample_comments_per_file)
-                    info(f"  {df_comments.shape} <- df_comments.shape AFTER sampling")
-
-                if len(df_comments) == 0:
-                    info(f"  No comments left to vectorize after filtering, moving to next file...")
-                    continue
-
-                # only add the comment len AFTER sampling, otherwise we can get the wrong values
-                total_comments_count += len(df_comments)
-
-                if cols_comment_text_to_concat is not None:
-                    info(f"Create merged text column")
-                    df_comments[col_comment_text_to_concat] = ''
-
-                    for col_ in LogTQDM(
-                            cols_comment_text_to_concat, ascii=True,
-                            logger=log
-                            ):
-                        mask_c_not_null = ~df_comments[col_].isnull()
-                        df_comments.loc[
-                            mask_c_not_null,
-                            col_comment_text_to_concat
-                        ] = (
-                            df_comments[mask_c_not_null][col_comment_text_to_concat] + '. ' +
-                            df_comments[mask_c_not_null][col_]
-                        )
+                    gc.collect()
 
-                    # remove the first 3 characters because they'll always be '. '
-                    df_comments[col_comment_text_to_concat] = df_comments[col_comment_text_to_concat].str[2:]
-
-                t_start_comms_vect = datetime.utcnow()
-                # Reset index right away so we don't forget to do it later
-                col_text_ = col_text_comment if cols_comment_text_to_concat is None else col_comment_text_to_concat
-                cols_index_ = 'comment_default_' if cols_index_comment is None else cols_index_comment
-                # In general, we want a high batch_size because that'll complete faster, but we need to reduce
-                #  it when we deal with long text b/c it can overflow the GPU's memory and result in OOM errors.
-                # If a batch (n-rows in a file) fails, get_embeddings_as_df() will retry with
-                #  a lower `limit_first_n_chars` value. However, that may not be enough if too many comments
-                #  in a batch are really long. In that case, I have 2 try/excepts to reduce the `batch_size`
-                #  which should make it more likely for a job to complete even if the input batch_size was too high.
-                try:
-                    df_vect_comments = get_embeddings_as_df(
-                        model=model,
-                        df=df_comments,
-                        col_text=col_text_,
-                        cols_index=cols_index_,
-                        lowercase_text=tokenize_lowercase,
-                        batch_size=tf_batch_inference_rows,
-                        limit_first_n_chars=tf_limit_first_n_chars,
-                        verbose_init=get_embeddings_verbose,
-                    ).reset_index()
-                except Exception as e:
                     try:
-                        logging.error(f"Failed to vectorize comments")
-                        logging.error(e)
-                        new_batch_size = int(tf_batch_inference_rows * 0.8)
-                        info(f"*** Retrying with smaller batch size {new_batch_size}***")
-                        df_vect_comments = get_embeddings_as_df(
-                            model=model,
-                            df=df_comments,
-                            col_text=col_text_,
-                            cols_index=cols_index_,
-                            lowercase_text=tokenize_lowercase,
-                            batch_size=new_batch_size,
-                            limit_first_n_chars=tf_limit_first_n_chars,
-                            verbose_init=get_embeddings_verbose,
-                        ).reset_index()
-                    except Exception as er:
-                        logging.error(f"Failed to vectorize comments")
-                        logging.error(er)
-                        new_batch_size = int(tf_batch_inference_rows * 0.6)
-                        info(f"*** Retrying with smaller batch size {new_batch_size}***")
+                        # reduce logging b/c we'll go through 30+ files
+                        # info(f"Keep only comments that match posts IDs in df_posts...")
+                        if df_posts is not None:
+                            df_comments = df_comments[df_comments[col_post_id].isin(df_posts[col_post_id])]
+                            info(f"  {df_comments.shape} <- df_comments.shape AFTER removing orphan comments (w/o post)")
+                    except (TypeError, UnboundLocalError) as e:
+                        pass
+
+                    if df_subs_exclude is not None:
+                        info(f"  Excluding posts for subs to exclude...")
+                        df_comments = df_comments[~df_comments['subreddit_id'].isin(df_subs_exclude['subreddit_id'])]
+                        info(f"  {df_comments.shape} <- df_comments.shape AFTER excluding subreddits")
+
+                    if n_sample_comments is not None:
+                        n_sample_comments_per_file = 1 + int(n_sample_comments / total_comms_file_count)
+                        info(f"  Sampling COMMENTS down to: {n_sample_comments:,.0f}"
+                             f"     Samples PER FILE: {n_sample_comments_per_file:,.0f}")
+                        df_comments = df_comments.sample(n=n_sample_comments_per_file)
+                        info(f"  {df_comments.shape} <- df_comments.shape AFTER sampling")
+
+                    if len(df_comments) == 0:
+                        info(f"  No comments left to vectorize after filtering, moving to next file...")
+                        if manifest is not None:
+                            manifest.mark_complete(
+                                blob.name, output_file=None, output_rows=0,
+                                input_checksum=blob.md5_hash, input_rows=n_comments_input_file,
+                            )
+                        continue
+
+                    # only add the comment len AFTER sampling, otherwise we can get the wrong values
+                    total_comments_count += len(df_comments)
+
+                    if cols_comment_text_to_concat is not None:
+                        info(f"Create merged text column")
+                        df_comments[col_comment_text_to_concat] = ''
+
+                        for col_ in LogTQDM(
+                                cols_comment_text_to_concat, ascii=True,
+                                logger=log
+                                ):
+                            mask_c_not_null = ~df_comments[col_].isnull()
+                            df_comments.loc[
+                                mask_c_not_null,
+                                col_comment_text_to_concat
+                            ] = (
+                                df_comments[mask_c_not_null][col_comment_text_to_concat] + '. ' +
+                                df_comments[mask_c_not_null][col_]
+                            )
+
+                        # remove the first 3 characters because they'll always be '. '
+                        df_comments[col_comment_text_to_concat] = df_comments[col_comment_text_to_concat].str[2:]
+
+                    t_start_comms_vect = datetime.utcnow()
+                    # Reset index right away so we don't forget to do it later
+                    col_text_ = col_text_comment if cols_comment_text_to_concat is None else col_comment_text_to_concat
+                    cols_index_ = 'comment_default_' if cols_index_comment is None else cols_index_comment
+                    # In general, we want a high batch_size because that'll complete faster, but we need to reduce
+                    #  it when we deal with long text b/c it can overflow the GPU's memory and result in OOM errors.
+                    # If a batch (n-rows in a file) fails, get_embeddings_as_df() will retry with
+                    #  a lower `limit_first_n_chars` value. However, that may not be enough if too many comments
+                    #  in a batch are really long. In that case, I have 2 try/excepts to reduce the `batch_size`
+                    #  which should make it more likely for a job to complete even if the input batch_size was too high.
+                    try:
                         df_vect_comments = get_embeddings_as_df(
                             model=model,
                             df=df_comments,
                             col_text=col_text_,
                             cols_index=cols_index_,
                             lowercase_text=tokenize_lowercase,
-                            batch_size=new_batch_size,
+                            batch_size=tf_batch_inference_rows,
                             limit_first_n_chars=tf_limit_first_n_chars,
                             verbose_init=get_embeddings_verbose,
                         ).reset_index()
+                    except Exception as e:
+                        try:
+                            logging.error(f"Failed to vectorize comments")
+                            logging.error(e)
+                            new_batch_size = int(tf_batch_inference_rows * 0.8)
+                            info(f"*** Retrying with smaller batch size {new_batch_size}***")
+                            df_vect_comments = get_embeddings_as_df(
+                                model=model,
+                                df=df_comments,
+                                col_text=col_text_,
+                                cols_index=cols_index_,
+                                lowercase_text=tokenize_lowercase,
+                                batch_size=new_batch_size,
+                                limit_first_n_chars=tf_limit_first_n_chars,
+                                verbose_init=get_embeddings_verbose,
+                            ).reset_index()
+                        except Exception as er:
+                            logging.error(f"Failed to vectorize comments")
+                            logging.error(er)
+                            new_batch_size = int(tf_batch_inference_rows * 0.6)
+                            info(f"*** Retrying with smaller batch size {new_batch_size}***")
+                            df_vect_comments = get_embeddings_as_df(
+                                model=model,
+                                df=df_comments,
+                                col_text=col_text_,
+                                cols_index=cols_index_,
+                                lowercase_text=tokenize_lowercase,
+                                batch_size=new_batch_size,
+                                limit_first_n_chars=tf_limit_first_n_chars,
+                                verbose_init=get_embeddings_verbose,
+                            ).reset_index()
+
+                    total_time_comms_vect += (
+                        elapsed_time(t_start_comms_vect, log_label='df_comms-batch vectorizing', verbose=False) /
+                        timedelta(minutes=1)
+                    )
 
-                total_time_comms_vect += (
-                    elapsed_time(t_start_comms_vect, log_label='df_comms-batch vectorizing', verbose=False) /
-                    timedelta(minutes=1)
-                )
-
-                # Save single file locally & log to mlflow right away
-                #  this might take longer to upload than uploading as a batch but makes the code easier to follow
-                #  than having a giant try/except
-                save_df_and_log_to_mlflow(
-                    df=df_vect_comments,
-                    local_path=path_this_model,
-                    name_for_metric_and_artifact_folder=local_comms_subfolder_relative,
-                    log_to_mlflow=log_each_batch_df_to_mlflow_invididually,
-                    save_in_chunks=False,
-                    df_single_file_name=f_comment_name_root,
-                )
-                del df_comments
-                # Log partial metrics to mlflow so it's easier to know whether a job is still alive
-                #  or dead
-                count_comms_files_processed = count_comms_files_processed + 1
-                mlflow.log_metrics(
-                    {
-                        local_comms_subfolder_relative: total_comments_count,
-                        'total_comment_files_processed': count_comms_files_processed
-                     }
-                )
-                gc.collect()
+                    # Save single file locally & log to mlflow right away
+                    #  this might take longer to upload than uploading as a batch but makes the code easier to follow
+                    #  than having a giant try/except
+                    f_vect_comments = save_df_and_log_to_mlflow(
+                        df=df_vect_comments,
+                        local_path=path_comms_output,
+                        name_for_metric_and_artifact_folder=local_comms_subfolder_relative,
+                        log_to_mlflow=log_each_batch_df_to_mlflow_invididually,
+                        save_in_chunks=False,
+                        df_single_file_name=f_comment_name_root,
+                        storage_format=embeddings_storage_format,
+                    )
+                    if manifest is not None:
+                        # Only mark as complete AFTER the output is on disk
+                        manifest.mark_complete(
+                            blob.name, output_file=f_vect_comments, output_rows=len(df_vect_comments),
+                            input_checksum=blob.md5_hash, input_rows=n_comments_input_file,
+                        )
+                    del df_comments
+                    # Log partial metrics to mlflow so it's easier to know whether a job is still alive
+                    #  or dead
+                    count_comms_files_processed = count_comms_files_processed + 1
+                    mlflow.log_metrics(
+                        {
+                            local_comms_subfolder_relative: total_comments_count,
+                            'total_comment_files_processed': count_comms_files_processed
+                         }
+                    )
+                    gc.collect()
+                finally:
+                    if manifest is not None:
+                        manifest.release(blob.name)
 
             mlflow.log_metrics(
                 {local_comms_subfolder_relative: total_comments_count,
@@ -521,6 +591,10 @@ def vectorize_text_to_embeddings(
                  'total_comment_files_processed': count_comms_files_processed
                  }
             )
+            if manifest is not None:
+                mlflow.log_metric('total_comment_files_skipped', count_comms_files_skipped)
+                mlflow.log_metrics(manifest.summary())
+                mlflow.log_artifacts(str(manifest.manifest_path), f"{local_comms_subfolder_relative}_manifest")
 
             if total_comments_count == 0:
                 logging.warning(f"No comments to process, can't log artifacts to mlflow")
@@ -591,6 +665,7 @@ def vectorize_text_to_embeddings(
                 df=df_vect_comments.reset_index(),
                 local_path=path_this_model,
                 name_for_metric_and_artifact_folder=mlflow_comments_folder,
+                storage_format=embeddings_storage_format,
             )
 
     # finish logging total time + end mlflow run
@@ -617,7 +692,8 @@ def get_embeddings_as_df(
         limit_first_n_chars_retry: int = 600,
         verbose: bool = True,
         verbose_init: bool = False,
-) -> pd.DataFrame:
+        output_format: str = 'pandas',
+) -> Union[pd.DataFrame, pa.Table]:
     """Get output of TF model as a dataframe.
     Besides batching we can get OOM (out of memory) errors if the text is too long,
     so we'll be adding a limit to only embed the first N-characters in a column.
@@ -628,8 +704,15 @@ def get_embeddings_as_df(
     - ~2 seconds:   on list
     - ~1 minute:    on text column df['text'].apply(model)
 
-    TODO(djb):  For each recursive call, use try/except!!
-      That way if one batch fails, the rest of the batches can proceed!
+    Each batch is written into a slice of a single pre-allocated float32 array
+    (see `get_embeddings_as_array()`). The output wraps that buffer without copying it,
+    so we no longer need to concat one df per batch, `set_index()` & rename 512 columns
+    (which doubled peak memory for large files).
+
+    output_format:
+        'pandas': df with `cols_index` as index & one column per embedding dimension
+        'arrow':  pyarrow Table with `cols_index` columns + a single
+                  FixedSizeList<float32> column named `col_embeddings_prefix`
     """
     if cols_index == 'comment_default_':
         cols_index = ['subreddit_name', 'subreddit_id', 'post_id', 'comment_id']
@@ -640,108 +723,125 @@ def get_embeddings_as_df(
     else:
         pass
 
-    if cols_index is not None:
-        index_output = df[cols_index]
-    else:
-        index_output = None
-
-    if batch_size is None:
-        iteration_chunks = None
-    elif batch_size >= len(df):
-        iteration_chunks = None
-    else:
-        iteration_chunks = range(1 + len(df) // batch_size)
-
     if verbose_init:
         info(f"cols_index: {cols_index}")
         info(f"col_text: {col_text}")
         info(f"lowercase_text: {lowercase_text}")
         info(f"limit_first_n_chars: {limit_first_n_chars}")
         info(f"limit_first_n_chars_retry: {limit_first_n_chars_retry}")
+        info(f"output_format: {output_format}")
+
+    arr_embeddings = get_embeddings_as_array(
+        model=model,
+        series_text=df[col_text],
+        lowercase_text=lowercase_text,
+        batch_size=batch_size,
+        limit_first_n_chars=limit_first_n_chars,
+        limit_first_n_chars_retry=limit_first_n_chars_retry,
+        verbose=verbose,
+    )
 
-    gc.collect()
-    if iteration_chunks is None:
-        if lowercase_text:
-            series_text = df[col_text].str.lower().str[:limit_first_n_chars]
-        else:
-            series_text = df[col_text].str[:limit_first_n_chars]
-
-        # In tf 2.3.4 it's faster to NOT use a list comprehension
-        #  These seem equivalent:
-        #   - np.array(model(series_text.to_list()))
-        #   - model(series_text.to_list()).numpy()
-        # df_vect = pd.DataFrame(
-        #     np.array([emb.numpy() for emb in model(series_text.to_list())])
-        # )
-        df_vect = pd.DataFrame(
-            model(series_text.to_list()).numpy()
+    if output_format == 'arrow':
+        col_embeddings_ = 'embeddings' if col_embeddings_prefix is None else col_embeddings_prefix
+        # A C-contiguous 2D array flattens to a view, so the list column shares the buffer
+        arr_list_embeddings = pa.FixedSizeListArray.from_arrays(
+            pa.array(arr_embeddings.reshape(-1)),
+            arr_embeddings.shape[1],
         )
-        if index_output is not None:
-            # Remember to reset the index of the output!
-            #   Because pandas will do an inner join based on index
-            df_vect = pd.concat(
-                [df_vect, index_output.reset_index(drop=True)],
-                axis=1,
-            ).set_index(cols_index)
+        if cols_index is None:
+            return pa.table({col_embeddings_: arr_list_embeddings})
+        return pa.Table.from_pandas(
+            df[cols_index], preserve_index=False,
+        ).append_column(col_embeddings_, arr_list_embeddings)
 
+    elif output_format == 'pandas':
         if col_embeddings_prefix is not None:
-            # renaming can be expensive when we're calling the function recursively
-            # so only rename after all individual dfs are created
-            return df_vect.rename(
-                columns={c: f"{col_embeddings_prefix}_{c}" for c in df_vect.columns}
-            )
+            l_cols_embeddings = [f"{col_embeddings_prefix}_{c}" for c in range(arr_embeddings.shape[1])]
+        else:
+            l_cols_embeddings = None
+
+        if cols_index is not None:
+            # Build the index directly instead of concat + set_index()
+            if isinstance(cols_index, str):
+                index_output = pd.Index(df[cols_index].to_numpy(), name=cols_index)
+            else:
+                index_output = pd.MultiIndex.from_frame(df[cols_index])
         else:
-            return df_vect
+            index_output = None
+
+        return pd.DataFrame(
+            arr_embeddings,
+            index=index_output,
+            columns=l_cols_embeddings,
+            copy=False,
+        )
 
     else:
-        gc.collect()
-        # This seems like a good place for recursion(!)
-        # Renaming can be expensive when we're calling the function recursively
-        #   so only rename after all individual dfs are created
+        raise NotImplementedError(f"output_format not implemented: {output_format}")
+
+
+def get_embeddings_as_array(
+        model: callable,
+        series_text: pd.Series,
+        lowercase_text: bool = False,
+        batch_size: int = None,
+        limit_first_n_chars: int = 1000,
+        limit_first_n_chars_retry: int = 600,
+        verbose: bool = True,
+) -> np.ndarray:
+    """Run inference in batches & write each batch into a slice of one float32 array.
+
+    The array is allocated after the first batch (that's when we know the
+    embedding dimensions). If a batch runs out of GPU memory, we retry that batch
+    with `limit_first_n_chars_retry` and write it to the same slice.
+
+    TODO(djb):  For each batch, use try/except!!
+      That way if one batch fails, the rest of the batches can proceed!
+    """
+    n_rows = len(series_text)
+    if (batch_size is None) or (batch_size >= n_rows):
+        batch_size = max(n_rows, 1)
+        iteration_chunks = range(1)
+    else:
+        iteration_chunks = range(1 + (n_rows - 1) // batch_size)
         if verbose:
             info(f"Getting embeddings in batches of size: {batch_size}")
-        l_df_embeddings = list()
-        for i in LogTQDM(
-                iteration_chunks, mininterval=11, ascii=True,  ncols=80,  # position=0, leave=True,
-                logger=log
-                ):
-            try:
-                l_df_embeddings.append(
-                    get_embeddings_as_df(
-                        model=model,
-                        df=df.iloc[i * batch_size:(i + 1) * batch_size],
-                        col_text=col_text,
-                        cols_index=cols_index,
-                        col_embeddings_prefix=None,
-                        lowercase_text=lowercase_text,
-                        batch_size=None,
-                        limit_first_n_chars=limit_first_n_chars,
-                    )
-                )
-                gc.collect()
-            except errors.ResourceExhaustedError as e:
-                logging.warning(f"\nResourceExhausted, lowering character limit\n{e}\n")
-                l_df_embeddings.append(
-                    get_embeddings_as_df(
-                        model=model,
-                        df=df.iloc[i * batch_size:(i + 1) * batch_size],
-                        col_text=col_text,
-                        cols_index=cols_index,
-                        col_embeddings_prefix=None,
-                        lowercase_text=lowercase_text,
-                        batch_size=None,
-                        limit_first_n_chars=limit_first_n_chars_retry,
-                    )
-                )
-                gc.collect()
-        if col_embeddings_prefix is not None:
-            df_vect = pd.concat(l_df_embeddings, axis=0, ignore_index=False)
-            return df_vect.rename(
-                columns={c: f"{col_embeddings_prefix}_{c}" for c in df_vect.columns}
-            )
+
+    def _get_text(series_: pd.Series, n_chars: int) -> list:
+        if lowercase_text:
+            return series_.str.lower().str[:n_chars].to_list()
         else:
-            gc.collect()
-            return pd.concat(l_df_embeddings, axis=0, ignore_index=False)
+            return series_.str[:n_chars].to_list()
+
+    gc.collect()
+    arr_embeddings = None
+    for i in LogTQDM(
+            iteration_chunks, mininterval=11, ascii=True,  ncols=80,  # position=0, leave=True,
+            logger=log, disable=len(iteration_chunks) == 1,
+    ):
+        ix_start = i * batch_size
+        ix_end = min((i + 1) * batch_size, n_rows)
+        series_batch = series_text.iloc[ix_start:ix_end]
+        # In tf 2.3.4 it's faster to NOT use a list comprehension
+        #  These seem equivalent:
+        #   - np.array(model(series_text.to_list()))
+        #   - model(series_text.to_list()).numpy()
+        try:
+            arr_batch = model(_get_text(series_batch, limit_first_n_chars)).numpy()
+        except errors.ResourceExhaustedError as e:
+            logging.warning(f"\nResourceExhausted, lowering character limit\n{e}\n")
+            arr_batch = model(_get_text(series_batch, limit_first_n_chars_retry)).numpy()
+
+        if arr_embeddings is None:
+            arr_embeddings = np.empty((n_rows, arr_batch.shape[1]), dtype=np.float32)
+        arr_embeddings[ix_start:ix_end] = arr_batch
+        del arr_batch
+    gc.collect()
+
+    if arr_embeddings is None:
+        # Empty input, we can't know the model's dimensions without calling it
+        arr_embeddings = model([]).numpy().astype(np.float32, copy=False)
+    return arr_embeddings
 
 
 def save_df_and_log_to_mlflow(
@@ -754,7 +854,8 @@ def save_df_and_log_to_mlflow(
         save_in_chunks: bool = True,
         df_single_file_name: str = 'df',  # append parquet extension later
         verbose: bool = True,
-) -> None:
+        storage_format: str = STORAGE_FORMAT_WIDE,
+) -> Optional[Path]:
     """
     Convenience function for vectorized dfs: save & log them to mlflow.
     Args:
@@ -781,8 +882,12 @@ def save_df_and_log_to_mlflow(
         df_single_file_name:
             If we're saving files in batch, we'll only save one output file per input file.
             Use this name to map input file to output file.
+        storage_format:
+            'wide' (one column per embedding dimension) or
+            'fixed_size_list' (one FixedSizeList<float32> column)
 
-    Returns: None
+    Returns:
+        Path to the single parquet file when `save_in_chunks=False`, otherwise None
     """
     local_subfolder = Path(local_path) / name_for_metric_and_artifact_folder
     Path.mkdir(local_subfolder, exist_ok=True, parents=True)
@@ -796,6 +901,7 @@ def save_df_and_log_to_mlflow(
         mlflow.log_metric(f'{name_for_metric_and_artifact_folder}_rows', r)
         mlflow.log_metric(f'{name_for_metric_and_artifact_folder}_cols', c)
 
+    f_df_vect_posts = None
     if save_in_chunks:
         # save text file with metadata, because dask doesn't let us configure naming parquet files
         f_meta = f"_manual_meta-{r}_by_{c}.txt"
@@ -803,21 +909,31 @@ def save_df_and_log_to_mlflow(
             f_.write(f"Original dataframe info\n===\nrows: {r:,.0f}\ncolumns: {c:,.0f}\n")
             f_.write(f"\nColumn list:\n{list(df.columns)}")
 
-        save_pd_df_to_parquet_in_chunks(
-            df=df,
-            path=local_subfolder,
-            target_mb_size=target_mb_size,
-            write_index=write_index,
-        )
+        if storage_format == STORAGE_FORMAT_FIXED_SIZE_LIST:
+            save_embeddings_to_parquet_in_chunks(
+                df=df,
+                path=local_subfolder,
+                target_mb_size=target_mb_size,
+                index=write_index,
+            )
+        else:
+            save_pd_df_to_parquet_in_chunks(
+                df=df,
+                path=local_subfolder,
+                target_mb_size=target_mb_size,
+                write_index=write_index,
+            )
     else:
         # save as single parquet file using pandas
         f_df_vect_posts = Path(local_subfolder) / f'{df_single_file_name}-{r}_by_{c}.parquet'
-        df.to_parquet(f_df_vect_posts)
+        save_embeddings_to_parquet(df, f_df_vect_posts, storage_format=storage_format)
 
     if log_to_mlflow:
         info(f"  Logging to mlflow...")
         mlflow.log_artifacts(str(local_subfolder), name_for_metric_and_artifact_folder)
 
+    return f_df_vect_posts
+
 
 #
 # ~ fin
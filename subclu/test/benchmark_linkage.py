@@ -0,0 +1,167 @@
+"""
+Benchmark `create_linkage_for_dendrogram()` in `clustering_utils.py`
+
+Compares:
+- nested_loop:  previous implementation, nested python loop over `model.children_`
+- numpy:        leaf counts with `get_linkage_counts()` (array indexing in waves)
+- scipy_ward:   linkage straight from `scipy.cluster.hierarchy.ward(X)`. This one also
+                clusters the vectors (needs an N^2 distance matrix), so we only run it
+                for N <= `--max-rows-scipy`
+
+Random merge trees are used for the counts benchmarks so we can test 100k+ leaves
+without fitting a model first.
+
+Run from CLI:
+    python -m subclu.test.benchmark_linkage
+    python -m subclu.test.benchmark_linkage --n-leaves 10000 50000 100000 --max-rows-scipy 10000
+"""
+import argparse
+from datetime import datetime
+import logging
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from ..models.clustering_utils import create_linkage_for_dendrogram
+
+
+log = logging.getLogger(__name__)
+
+
+def _create_linkage_for_dendrogram_nested_loop(model) -> pd.DataFrame:
+    """Copy of the previous implementation"""
+    counts = np.zeros(model.children_.shape[0])
+    n_samples = len(model.labels_)
+    for i, merge in enumerate(model.children_):
+        current_count = 0
+        for child_idx in merge:
+            if child_idx < n_samples:
+                current_count += 1  # leaf node
+            else:
+                current_count += counts[child_idx - n_samples]
+        counts[i] = current_count
+
+    return pd.DataFrame(
+        np.column_stack(
+            [model.children_,
+             model.distances_,
+             counts]
+        ),
+        columns=['children_0', 'children_1', 'distance', 'count'],
+    ).astype({
+        'children_0': int,
+        'children_1': int,
+        'distance': float,
+        'count': int,
+    })
+
+
+def get_random_merge_tree(
+        n_leaves: int,
+        seed: int = 42,
+) -> SimpleNamespace:
+    """Create a fake fitted model with a valid random merge tree:
+    each merge joins 2 random active nodes (leaves or earlier merges)
+    """
+    rng = np.random.default_rng(seed)
+    l_active = list(range(n_leaves))
+    children = np.empty((n_leaves - 1, 2), dtype=np.int64)
+    for i in range(n_leaves - 1):
+        for j in range(2):
+            ix_ = rng.integers(len(l_active))
+            # swap-remove to keep pops O(1)
+            l_active[ix_], l_active[-1] = l_active[-1], l_active[ix_]
+            children[i, j] = l_active.pop()
+        l_active.append(n_leaves + i)
+
+    return SimpleNamespace(
+        children_=children,
+        distances_=np.sort(rng.random(n_leaves - 1)),
+        labels_=np.zeros(n_leaves, dtype=int),
+    )
+
+
+def benchmark_linkage(
+        l_n_leaves: list = None,
+        max_rows_scipy: int = 10000,
+        n_dimensions: int = 50,
+) -> pd.DataFrame:
+    """Time each implementation & check that outputs match the previous implementation"""
+    if l_n_leaves is None:
+        l_n_leaves = [10000, 50000, 100000]
+
+    l_results = list()
+    for n_leaves in l_n_leaves:
+        log.info(f"-- {n_leaves:,.0f} leaves --")
+        model_ = get_random_merge_tree(n_leaves)
+
+        d_fxns = {
+            'nested_loop': lambda: _create_linkage_for_dendrogram_nested_loop(model_),
+            'numpy': lambda: create_linkage_for_dendrogram(model_, method='numpy'),
+        }
+        df_baseline = None
+        for name_, fxn_ in d_fxns.items():
+            t_start = datetime.utcnow()
+            df_linkage = fxn_()
+            seconds_ = (datetime.utcnow() - t_start).total_seconds()
+
+            if df_baseline is None:
+                df_baseline = df_linkage
+            l_results.append({
+                'implementation': name_,
+                'n_leaves': n_leaves,
+                'seconds': seconds_,
+                'output_matches_baseline': df_linkage.equals(df_baseline),
+            })
+            log.info(f"  {name_:>12}: {seconds_:8.3f} sec")
+
+        if n_leaves <= max_rows_scipy:
+            X = np.random.default_rng(42).normal(size=(n_leaves, n_dimensions))
+            t_start = datetime.utcnow()
+            df_linkage = create_linkage_for_dendrogram(None, X=X, method='scipy_ward')
+            seconds_ = (datetime.utcnow() - t_start).total_seconds()
+
+            # Different tree, so check that the scipy counts match the numpy counts
+            model_scipy = SimpleNamespace(
+                children_=df_linkage[['children_0', 'children_1']].to_numpy(),
+                distances_=df_linkage['distance'].to_numpy(),
+                labels_=np.zeros(n_leaves, dtype=int),
+            )
+            l_results.append({
+                'implementation': 'scipy_ward (incl. clustering)',
+                'n_leaves': n_leaves,
+                'seconds': seconds_,
+                'output_matches_baseline': create_linkage_for_dendrogram(
+                    model_scipy, method='numpy'
+                ).equals(df_linkage),
+            })
+            log.info(f"  {'scipy_ward':>12}: {seconds_:8.3f} sec (includes clustering)")
+
+    df_results = pd.DataFrame(l_results)
+    df_results['speedup_vs_nested_loop'] = (
+        df_results
+        .groupby('n_leaves')['seconds']
+        .transform('first') / df_results['seconds']
+    )
+    return df_results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(message)s')
+    parser = argparse.ArgumentParser(description='Benchmark linkage matrix creation')
+    parser.add_argument('--n-leaves', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--max-rows-scipy', type=int, default=10000)
+    args = parser.parse_args()
+
+    print(
+        benchmark_linkage(
+            l_n_leaves=args.n_leaves,
+            max_rows_scipy=args.max_rows_scipy,
+        ).to_string(index=False)
+    )
+
+
+#
+# ~ fin
+#
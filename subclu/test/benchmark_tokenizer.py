@@ -0,0 +1,154 @@
+"""
+Benchmark tokenizer throughput (tokens/second) for `preprocess_text.py`
+
+Compares:
+- recompile_apply:  previous implementation, recompile D_REGEX on every call + Series.apply()
+- compiled_apply:   transform_and_tokenize_text() with module-level regexes + Series.apply()
+- tokenize_series:  vectorized Series.str.findall()
+- tokenize_series_nX: vectorized + process pool with X workers
+
+Run from CLI:
+    python -m subclu.test.benchmark_tokenizer
+    python -m subclu.test.benchmark_tokenizer --n-rows 1000000 --n-jobs 4 8
+
+Use `--parquet` & `--col-text` to benchmark on real posts/comments instead of synthetic text.
+"""
+import argparse
+from datetime import datetime
+from functools import partial
+import logging
+import re
+import string
+
+import numpy as np
+import pandas as pd
+
+from ..models.preprocess_text import transform_and_tokenize_text, tokenize_series
+
+
+log = logging.getLogger(__name__)
+
+
+def _transform_and_tokenize_text_recompile(
+        doc: str,
+        tokenizer: str,
+        lowercase: bool = False,
+):
+    """Copy of the previous implementation: builds & compiles the regex dict on every call"""
+    D_REGEX = {
+        'sklearn': re.compile(r"(?u)\b\w\w+\b"),
+        'sklearn_acronyms': re.compile(r"(?u)\b\w\w+\b|\b\w\.\w\.\w|\b\w\.\w"),
+        'sklearn_emoji': re.compile(fr"(?u)\b\w\w+\b|[^\w\s\\{string.punctuation}]"),
+        'sklearn_acronyms_emoji': re.compile(fr"(?u)\b\w\w+\b|\b\w\.\w\.\w|\b\w\.\w|[^\w\s\\{string.punctuation}]"),
+    }
+    if lowercase:
+        return D_REGEX[tokenizer].findall(doc.lower())
+    else:
+        return D_REGEX[tokenizer].findall(doc)
+
+
+def get_synthetic_text(
+        n_rows: int = 200000,
+        words_per_doc: int = 40,
+        seed: int = 42,
+) -> pd.Series:
+    """Create random docs with words, acronyms, punctuation & emoji"""
+    rng = np.random.default_rng(seed)
+    vocab = np.array(
+        ['Reddit', 'subreddit', 'Fußball', 'Bundesliga', 'U.S.A', 'U.K.', 'the', 'a', 'I', "can't",
+         'München', 'Berlin', 'news', 'memes', '2021', 'post', 'comment', '🙂', '🔥', 'ok!', 'wow...']
+    )
+    n_words = rng.poisson(words_per_doc, size=n_rows) + 1
+    ix_words = rng.integers(0, len(vocab), size=n_words.sum())
+    offsets = np.concatenate([[0], np.cumsum(n_words)])
+    return pd.Series(
+        [' '.join(vocab[ix_words[offsets[i]:offsets[i + 1]]]) for i in range(n_rows)]
+    )
+
+
+def benchmark_tokenizers(
+        series_text: pd.Series,
+        tokenizer: str = 'sklearn_acronyms_emoji',
+        lowercase: bool = True,
+        l_n_jobs: list = None,
+        chunk_rows: int = 100000,
+) -> pd.DataFrame:
+    """Time each implementation & check that all outputs match the previous implementation"""
+    if l_n_jobs is None:
+        l_n_jobs = [4]
+
+    d_fxns = {
+        'recompile_apply': lambda s_: s_.apply(
+            partial(_transform_and_tokenize_text_recompile, tokenizer=tokenizer, lowercase=lowercase)
+        ),
+        'compiled_apply': lambda s_: s_.apply(
+            partial(transform_and_tokenize_text, tokenizer=tokenizer, lowercase=lowercase)
+        ),
+        'tokenize_series': partial(tokenize_series, tokenizer=tokenizer, lowercase=lowercase, n_jobs=1),
+    }
+    for n_ in l_n_jobs:
+        d_fxns[f"tokenize_series_n{n_}"] = partial(
+            tokenize_series, tokenizer=tokenizer, lowercase=lowercase, n_jobs=n_, chunk_rows=chunk_rows,
+        )
+
+    l_results = list()
+    series_baseline = None
+    for name_, fxn_ in d_fxns.items():
+        t_start = datetime.utcnow()
+        series_tokens = fxn_(series_text)
+        seconds_ = (datetime.utcnow() - t_start).total_seconds()
+        n_tokens = int(series_tokens.str.len().sum())
+
+        if series_baseline is None:
+            series_baseline = series_tokens
+            output_matches = True
+        else:
+            output_matches = bool((series_tokens == series_baseline).all())
+
+        l_results.append({
+            'implementation': name_,
+            'rows': len(series_text),
+            'tokens': n_tokens,
+            'seconds': seconds_,
+            'tokens_per_second': n_tokens / seconds_,
+            'output_matches_baseline': output_matches,
+        })
+        log.info(f"  {name_:>24}: {seconds_:7.2f} sec | {n_tokens / seconds_:13,.0f} tokens/sec")
+
+    df_results = pd.DataFrame(l_results)
+    df_results['speedup_vs_baseline'] = (
+        df_results['tokens_per_second'] / df_results['tokens_per_second'].iloc[0]
+    )
+    return df_results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(message)s')
+    parser = argparse.ArgumentParser(description='Benchmark tokenizer throughput')
+    parser.add_argument('--n-rows', type=int, default=200000)
+    parser.add_argument('--n-jobs', type=int, nargs='+', default=[4])
+    parser.add_argument('--chunk-rows', type=int, default=100000)
+    parser.add_argument('--tokenizer', type=str, default='sklearn_acronyms_emoji')
+    parser.add_argument('--parquet', type=str, default=None)
+    parser.add_argument('--col-text', type=str, default='text')
+    args = parser.parse_args()
+
+    if args.parquet is not None:
+        series_text_ = pd.read_parquet(args.parquet, columns=[args.col_text])[args.col_text].fillna('')
+        series_text_ = series_text_.iloc[:args.n_rows]
+    else:
+        series_text_ = get_synthetic_text(n_rows=args.n_rows)
+
+    print(
+        benchmark_tokenizers(
+            series_text_,
+            tokenizer=args.tokenizer,
+            l_n_jobs=args.n_jobs,
+            chunk_rows=args.chunk_rows,
+        ).to_string(index=False)
+    )
+
+
+#
+# ~ fin
+#
@@ -0,0 +1,226 @@
+"""
+Offline tests for the FPR geo-relevance query (v0.5.0).
+
+We run the same SQL as BigQuery with DuckDB on small parquet fixtures, see
+`get_geo_relevant_subreddits_and_cluster_labels_multi_country(local_tables=...)`.
+Requires the `laptop_dev` extras (duckdb).
+
+Run from the repo root:
+    python -m pytest subclu/test/test_fpr_geo_query_local.py
+
+To re-create the fixtures (e.g., after changing the query):
+    python -m subclu.test.test_fpr_geo_query_local
+"""
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from subclu.models import reshape_clusters_v050 as rc
+
+
+PATH_FIXTURES = Path(__file__).parent / 'fixtures' / 'fpr_geo_query'
+
+QA_TABLE = 'test.qa_flags'
+GEO_RELEVANCE_TABLE = 'test.geo_relevance'
+CLUSTER_LABELS_TABLE = 'test.cluster_labels'
+QA_PT = '2022-07-24'
+PARTITION_DT = '2022-07-20'
+
+D_FIXTURE_FILES = {
+    QA_TABLE: 'qa_flags.parquet',
+    GEO_RELEVANCE_TABLE: 'geo_relevance.parquet',
+    CLUSTER_LABELS_TABLE: 'cluster_labels.parquet',
+    rc.TABLE_ALL_REDDIT_SUBREDDITS: 'all_reddit_subreddits.parquet',
+    rc.TABLE_TOPIC_AND_RATING: 'topic_and_rating.parquet',
+    rc.TABLE_SUBREDDIT_LOOKUP: 'subreddit_lookup.parquet',
+}
+
+# Subreddits we expect for each country, sorted by relevance_combined_score (desc)
+#  MX: t5_3 = spam filter, t5_5 = not relevant
+#  BR: t5_7 = rated M, t5_8 = sensitive topic, t5_9 = over_18
+D_EXPECTED_SUB_IDS = {
+    'MX': ['t5_0', 't5_1', 't5_2', 't5_4'],
+    'BR': ['t5_0', 't5_6'],
+    'DE': [],
+}
+
+
+def get_local_tables() -> dict:
+    return {k_: str(PATH_FIXTURES / f_) for k_, f_ in D_FIXTURE_FILES.items()}
+
+
+def get_geo_query_kwargs() -> dict:
+    return dict(
+        cluster_labels_table=CLUSTER_LABELS_TABLE,
+        qa_table=QA_TABLE,
+        qa_pt=QA_PT,
+        geo_relevance_table=GEO_RELEVANCE_TABLE,
+        partition_dt=PARTITION_DT,
+        local_tables=get_local_tables(),
+    )
+
+
+def write_fixture_tables(
+        path: Path = PATH_FIXTURES,
+) -> None:
+    """Write the parquet fixtures. 10 subreddits, relevant to MX and/or BR"""
+    Path.mkdir(path, exist_ok=True, parents=True)
+    n_subs = 10
+    l_ids = [f"t5_{i}" for i in range(n_subs)]
+    l_names = [f"sub{i}" for i in range(n_subs)]
+    dt_ = date.fromisoformat(PARTITION_DT)
+
+    df_qa = pd.DataFrame({
+        'subreddit_id': l_ids,
+        'subreddit_name': l_names,
+        'pt': QA_PT,
+        'predicted_rating': 'E',
+        'predicted_topic': 'Gaming',
+        'primary_topic': 'Gaming',
+        'combined_filter_detail': 'recommend',
+        'combined_filter': 'recommend',
+        'combined_filter_reason': None,
+        'taxonomy_action': None,
+    })
+    df_qa.loc[3, ['combined_filter', 'combined_filter_reason']] = ['remove', 'spam']
+    df_qa.loc[4, ['combined_filter', 'combined_filter_reason']] = ['remove', 'allow_discovery_f']
+
+    l_geo_ix = {'MX': [0, 1, 2, 3, 4, 5], 'BR': [0, 6, 7, 8, 9]}
+    df_geo = pd.concat([
+        pd.DataFrame({
+            'subreddit_id': [l_ids[i] for i in l_ix_],
+            'subreddit_name': [l_names[i] for i in l_ix_],
+            'geo_country_code': c_,
+            'country_name': {'MX': 'Mexico', 'BR': 'Brazil'}[c_],
+            'geo_relevance_default': False,
+            # decreasing scores so the order of outputs is fixed
+            'relevance_combined_score': np.linspace(0.3, 0.2, len(l_ix_)),
+            'users_percent_by_subreddit_l28': 0.2,
+            'users_percent_by_country_standardized': 3.0,
+            'relevance_percent_by_subreddit': 0.5,
+            'relevance_percent_by_country_standardized': 3.0,
+        })
+        for c_, l_ix_ in l_geo_ix.items()
+    ], ignore_index=True)
+    # not relevant under any metric
+    df_geo.loc[df_geo['subreddit_id'] == 't5_5', [
+        'relevance_combined_score', 'users_percent_by_subreddit_l28', 'users_percent_by_country_standardized'
+    ]] = [0.01, 0.01, 0.1]
+
+    df_ars = pd.DataFrame({
+        'subreddit_name': [n_.upper() for n_ in l_names],
+        'users_l7': np.arange(n_subs) * 100,
+        'pt': pd.Timestamp(PARTITION_DT),
+    })
+
+    df_nt = pd.DataFrame({
+        'subreddit_id': l_ids,
+        'primary_topic': 'Gaming',
+        'rating_short': 'E',
+        'pt': dt_,
+    })
+    df_nt.loc[7, 'rating_short'] = 'M'
+    df_nt.loc[8, 'primary_topic'] = rc.L_SENSITIVE_TOPICS_FOR_FPRS[0]
+
+    df_slo = pd.DataFrame({
+        'subreddit_id': l_ids,
+        'allow_discovery': 't',
+        'over_18': 'f',
+        'type': 'public',
+        'verdict': None,
+        'is_spam': False,
+        'quarantine': False,
+        'dt': dt_,
+    })
+    df_slo.loc[4, 'allow_discovery'] = 'f'
+    df_slo.loc[9, 'over_18'] = 't'
+
+    # The query drops the broad clusters (k < 50)
+    l_k = [10, 12, 20, 25, 30, 40, 49, 50, 60, 70, 100]
+    df_labels = pd.DataFrame({
+        'subreddit_id': l_ids,
+        'subreddit_name': l_names,
+        'primary_topic': 'Gaming',
+        '__index_level_0__': np.arange(n_subs),
+    })
+    for k_ in l_k:
+        df_labels[f"k_{k_:04d}_label"] = np.arange(n_subs) % max(2, k_ // 25)
+        df_labels[f"k_{k_:04d}_majority_primary_topic"] = 'Gaming'
+
+    for table_, df_ in [
+        (QA_TABLE, df_qa),
+        (GEO_RELEVANCE_TABLE, df_geo),
+        (CLUSTER_LABELS_TABLE, df_labels),
+        (rc.TABLE_ALL_REDDIT_SUBREDDITS, df_ars),
+        (rc.TABLE_TOPIC_AND_RATING, df_nt),
+        (rc.TABLE_SUBREDDIT_LOOKUP, df_slo),
+    ]:
+        df_.to_parquet(path / D_FIXTURE_FILES[table_], index=False)
+
+
+def test_geo_query_multi_country():
+    pytest.importorskip('duckdb')
+    d_df = rc.get_geo_relevant_subreddits_and_cluster_labels_multi_country(
+        target_countries=list(D_EXPECTED_SUB_IDS.keys()),
+        **get_geo_query_kwargs(),
+    )
+    assert set(d_df.keys()) == set(D_EXPECTED_SUB_IDS.keys())
+    for country_code_, l_expected_ in D_EXPECTED_SUB_IDS.items():
+        assert d_df[country_code_]['subreddit_id'].to_list() == l_expected_
+        assert (d_df[country_code_]['geo_country_code'] == country_code_).all()
+
+    # broad clusters are excluded, the rest of the labels are included
+    assert 'k_0010_label' not in d_df['MX'].columns
+    assert 'k_0050_label' in d_df['MX'].columns
+    # countries without subreddits have the same columns
+    assert list(d_df['DE'].columns) == list(d_df['MX'].columns)
+
+
+def test_geo_query_single_country_matches_multi_country():
+    pytest.importorskip('duckdb')
+    d_df = rc.get_geo_relevant_subreddits_and_cluster_labels_multi_country(
+        target_countries=['MX', 'BR'],
+        **get_geo_query_kwargs(),
+    )
+    df_br = rc.get_geo_relevant_subreddits_and_cluster_labels(
+        target_country='BR',
+        **get_geo_query_kwargs(),
+    )
+    # all-null columns can get a different dtype (& null value) depending on the rows in the query
+    def nulls_to_none(df: pd.DataFrame) -> pd.DataFrame:
+        return df.astype(object).where(df.notna(), None)
+
+    pd.testing.assert_frame_equal(nulls_to_none(d_df['BR']), nulls_to_none(df_br))
+
+
+def test_batch_query_error_falls_back_to_one_query_per_country(monkeypatch):
+    pytest.importorskip('duckdb')
+    fxn_query = rc.get_geo_relevant_subreddits_and_cluster_labels_multi_country
+
+    def query_fails_for_batch(target_countries, **kwargs):
+        if len(target_countries) > 1:
+            raise RuntimeError('Batch query failed')
+        return fxn_query(target_countries=target_countries, **kwargs)
+
+    monkeypatch.setattr(rc, 'get_geo_relevant_subreddits_and_cluster_labels_multi_country', query_fails_for_batch)
+    fpr = rc.CreateFPRs(
+        target_countries=['MX', 'BR'],
+        output_bucket='test-bucket',
+        gcs_output_path='test/fpr',
+        batch_geo_query=True,
+        **get_geo_query_kwargs(),
+    )
+    assert fpr.get_df_labels_target_all_countries_() is None
+    assert fpr.get_df_labels_target_('MX')['subreddit_id'].to_list() == D_EXPECTED_SUB_IDS['MX']
+
+
+if __name__ == "__main__":
+    write_fixture_tables()
+
+
+#
+# ~ fin
+#
@@ -2,12 +2,16 @@
 Utilities to load & upload data from/to bigQuery
 """
 from datetime import datetime, timedelta
+from fnmatch import fnmatch
 import logging
 from logging import info
+import posixpath
 from typing import List
 
 from google.cloud import bigquery
 from google.api_core.exceptions import NotFound, Conflict
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 
 def table_exists(
@@ -175,3 +179,139 @@ def load_data_to_bq_table(
     info(
         f"  {destination_table.num_rows:,.0f} rows in table AFTER adding data"
     )
+
+
+class TableLoader:
+    """Interface to load parquet files into a table.
+    Use `BigQueryTableLoader` in production & `LocalTableLoader` for offline tests.
+    """
+    def load_parquet(
+            self,
+            uri: str,
+            table_id: str,
+            schema: List[bigquery.SchemaField] = None,
+            append: bool = True,
+    ) -> None:
+        """Load all files that match `uri` into `table_id` (one load job).
+        Like BigQuery, a `*` in the uri also matches sub-folders (e.g., country_code=MX/).
+        """
+        raise NotImplementedError
+
+    def get_num_rows(
+            self,
+            table_id: str,
+    ) -> int:
+        """Rows in the table. 0 if the table doesn't exist"""
+        raise NotImplementedError
+
+
+class BigQueryTableLoader(TableLoader):
+    def __init__(
+            self,
+            bq_client: bigquery.Client = None,
+            location: str = 'US',
+    ):
+        self.bq_client = bq_client
+        self.location = location
+
+    @property
+    def client(self) -> bigquery.Client:
+        if self.bq_client is None:
+            self.bq_client = bigquery.Client()
+        return self.bq_client
+
+    def load_parquet(
+            self,
+            uri: str,
+            table_id: str,
+            schema: List[bigquery.SchemaField] = None,
+            append: bool = True,
+    ) -> None:
+        job_config = bigquery.LoadJobConfig(
+            schema=schema,
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=(
+                bigquery.WriteDisposition.WRITE_APPEND if append else bigquery.WriteDisposition.WRITE_TRUNCATE
+            ),
+        )
+        load_job = self.client.load_table_from_uri(
+            uri,
+            table_id,
+            location=self.location,  # Must match the destination dataset location.
+            job_config=job_config,
+        )
+        load_job.result()  # Waits for the job to complete.
+
+    def get_num_rows(
+            self,
+            table_id: str,
+    ) -> int:
+        if not table_exists(table_id, bq_client=self.client):
+            return 0
+        return self.client.get_table(table_id).num_rows
+
+
+class LocalTableLoader(TableLoader):
+    """Stand-in for BigQuery: each table is a local folder with one parquet file per load:
+        {root_dir}/{table_id}/load-00000.parquet
+    """
+    def __init__(
+            self,
+            root_dir: str,
+    ):
+        self.root_dir = root_dir
+
+    def get_table_dir(self, table_id: str) -> str:
+        return posixpath.join(self.root_dir, table_id)
+
+    def load_parquet(
+            self,
+            uri: str,
+            table_id: str,
+            schema: List[bigquery.SchemaField] = None,
+            append: bool = True,
+    ) -> None:
+        # import here, fsspec comes with gcsfs
+        import fsspec
+
+        fs_, path_pattern = fsspec.core.url_to_fs(uri)
+        path_prefix = path_pattern.split('*')[0]
+        # fnmatch's `*` also matches `/`, same as BigQuery's wildcard
+        l_files = sorted(f_ for f_ in fs_.find(path_prefix) if fnmatch(f_, path_pattern))
+        if len(l_files) == 0:
+            raise FileNotFoundError(f"No files match: {uri}")
+
+        l_tables = list()
+        for f_ in l_files:
+            with fs_.open(f_, 'rb') as f_open:
+                l_tables.append(pq.read_table(f_open))
+        table = pa.concat_tables(l_tables)
+        if schema is not None:
+            l_missing = [sf_.name for sf_ in schema if sf_.name not in table.column_names]
+            if len(l_missing) > 0:
+                raise ValueError(f"Columns in schema missing from files: {l_missing}")
+            table = table.select([sf_.name for sf_ in schema])
+
+        fs_local = fsspec.filesystem('file')
+        table_dir = self.get_table_dir(table_id)
+        if (not append) and fs_local.exists(table_dir):
+            fs_local.rm(table_dir, recursive=True)
+        fs_local.makedirs(table_dir, exist_ok=True)
+        n_loads = len(fs_local.glob(posixpath.join(table_dir, 'load-*.parquet')))
+        pq.write_table(table, posixpath.join(table_dir, f"load-{n_loads:05d}.parquet"))
+        info(f"  {table.num_rows:,.0f} rows from {len(l_files)} files loaded to: {table_dir}")
+
+    def get_num_rows(
+            self,
+            table_id: str,
+    ) -> int:
+        import fsspec
+
+        fs_local = fsspec.filesystem('file')
+        l_files = fs_local.glob(posixpath.join(self.get_table_dir(table_id), 'load-*.parquet'))
+        return sum(pq.ParquetFile(f_).metadata.num_rows for f_ in l_files)
+
+
+#
+# ~ fin
+#
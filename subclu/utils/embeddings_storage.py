@@ -0,0 +1,457 @@
+"""
+Utils to read & write embeddings in two parquet layouts:
+- 'wide':               one float column per dimension (embeddings_0, ..., embeddings_511)
+- 'fixed_size_list':    one FixedSizeList<float32> column (embeddings)
+
+The wide layout bloats parquet metadata (512+ column chunks per row group) and slows
+down `read_parquet(columns=...)`. The nested layout stores all dimensions in one
+contiguous buffer, so we can get a 2D numpy view of it without copying.
+
+Readers in this module accept both layouts, so older artifacts are still readable.
+"""
+from contextlib import nullcontext
+from logging import info
+from pathlib import Path
+import re
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+STORAGE_FORMAT_WIDE = 'wide'
+STORAGE_FORMAT_FIXED_SIZE_LIST = 'fixed_size_list'
+L_EMBEDDINGS_STORAGE_FORMATS = [STORAGE_FORMAT_WIDE, STORAGE_FORMAT_FIXED_SIZE_LIST]
+
+
+def get_wide_embedding_cols(
+        columns: iter,
+        col_embeddings: str = 'embeddings',
+) -> List[str]:
+    """Get wide embedding columns (e.g., embeddings_0, embeddings_1) in dimension order"""
+    prefix_ = f"{col_embeddings}_"
+    l_cols = [c for c in columns if str(c).startswith(prefix_) and str(c)[len(prefix_):].isdigit()]
+    return sorted(l_cols, key=lambda c: int(str(c)[len(prefix_):]))
+
+
+def is_fixed_size_list_field(
+        schema: pa.Schema,
+        col_embeddings: str = 'embeddings',
+) -> bool:
+    """Check whether a parquet/arrow schema stores embeddings as a single nested column"""
+    if col_embeddings not in schema.names:
+        return False
+    type_ = schema.field(col_embeddings).type
+    return pa.types.is_fixed_size_list(type_) or pa.types.is_list(type_)
+
+
+def arrow_embeddings_to_array(
+        arr: Union[pa.Array, pa.ChunkedArray],
+) -> np.ndarray:
+    """Get a 2D float32 numpy array from a (Fixed)List<float32> arrow column.
+
+    When the column has a single chunk & no nulls the output is a view of
+    the arrow buffer (no copy). Multiple chunks need to be combined first (one copy).
+    Raises ValueError if any row is null or, for variable-size lists, if rows have different sizes.
+    """
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.chunk(0) if arr.num_chunks == 1 else arr.combine_chunks()
+
+    if pa.types.is_fixed_size_list(arr.type):
+        n_dim = arr.type.list_size
+        if arr.null_count > 0:
+            raise ValueError(f"Can't convert embeddings to an array: {arr.null_count:,.0f} null rows")
+    else:
+        # Variable-size lists (e.g., from BigQuery) can still be reshaped if all rows have the same size
+        arr_lengths = pc.list_value_length(arr)
+        if arr_lengths.null_count > 0:
+            raise ValueError(f"Can't convert embeddings to an array: {arr_lengths.null_count:,.0f} null rows")
+        l_lengths = pc.unique(arr_lengths).to_pylist()
+        if len(l_lengths) > 1:
+            raise ValueError(f"Can't convert embeddings to an array, rows have different sizes: {sorted(l_lengths)}")
+        n_dim = l_lengths[0] if len(l_lengths) else 0
+
+    # flatten() respects slice offsets, `.values` doesn't
+    arr_values = arr.flatten().to_numpy(zero_copy_only=False)
+    return arr_values.reshape(len(arr), n_dim).astype(np.float32, copy=False)
+
+
+def wide_df_to_arrow_table(
+        df: pd.DataFrame,
+        col_embeddings: str = 'embeddings',
+        embedding_cols: List[str] = None,
+        preserve_index: bool = True,
+) -> pa.Table:
+    """Convert a df with wide embedding columns into an arrow table with
+    one FixedSizeList<float32> column.
+    """
+    if embedding_cols is None:
+        embedding_cols = get_wide_embedding_cols(df.columns, col_embeddings)
+
+    arr_embeddings = np.ascontiguousarray(df[embedding_cols].to_numpy(dtype=np.float32))
+    arr_list_embeddings = pa.FixedSizeListArray.from_arrays(
+        pa.array(arr_embeddings.reshape(-1)),
+        arr_embeddings.shape[1],
+    )
+    return pa.Table.from_pandas(
+        df.drop(embedding_cols, axis=1),
+        preserve_index=preserve_index,
+    ).append_column(col_embeddings, arr_list_embeddings)
+
+
+def array_to_wide_df(
+        arr_embeddings: np.ndarray,
+        col_embeddings: str = 'embeddings',
+        index: pd.Index = None,
+        dims: List[int] = None,
+) -> pd.DataFrame:
+    """Wrap a 2D array as a wide df WITHOUT copying it.
+    `dims`: dimension number of each column in the array, if it's a subset of dimensions
+    """
+    if dims is None:
+        dims = range(arr_embeddings.shape[1])
+    return pd.DataFrame(
+        arr_embeddings,
+        index=index,
+        columns=[f"{col_embeddings}_{i}" for i in dims],
+        copy=False,
+    )
+
+
+def select_embedding_dims(
+        arr_embeddings: np.ndarray,
+        dims: List[int] = None,
+) -> np.ndarray:
+    """Keep a subset of dimensions (columns). If dims is None, keep all of them"""
+    if dims is None:
+        return arr_embeddings
+    return arr_embeddings[:, dims]
+
+
+def arrow_table_to_wide_df(
+        table: pa.Table,
+        col_embeddings: str = 'embeddings',
+        dims: List[int] = None,
+) -> pd.DataFrame:
+    """Convert an arrow table with a nested embeddings column to a df with wide columns.
+    The embedding columns share memory with the arrow buffer when possible
+    (when `dims` is None, selecting a subset of dimensions creates a copy).
+    """
+    if not is_fixed_size_list_field(table.schema, col_embeddings):
+        return table.to_pandas()
+
+    df_meta = table.drop([col_embeddings]).to_pandas()
+    df_embeddings = array_to_wide_df(
+        select_embedding_dims(arrow_embeddings_to_array(table.column(col_embeddings)), dims),
+        col_embeddings=col_embeddings,
+        index=df_meta.index,
+        dims=dims,
+    )
+    # copy=False keeps the embedding block as a view of the arrow buffer
+    return pd.concat([df_meta, df_embeddings], axis=1, copy=False)
+
+
+def expand_nested_embeddings(
+        df: pd.DataFrame,
+        col_embeddings: str = 'embeddings',
+) -> pd.DataFrame:
+    """Expand an object column of arrays (what pandas/dask create when reading
+    a nested column) into wide columns. Use it with `dask.map_partitions()`.
+    """
+    if col_embeddings not in df.columns:
+        return df
+    if len(df) == 0:
+        arr_embeddings = np.empty((0, 0), dtype=np.float32)
+    else:
+        arr_embeddings = np.stack(df[col_embeddings].to_numpy()).astype(np.float32, copy=False)
+    return pd.concat(
+        [
+            df.drop([col_embeddings], axis=1),
+            array_to_wide_df(arr_embeddings, col_embeddings=col_embeddings, index=df.index)
+        ],
+        axis=1, copy=False,
+    )
+
+
+def get_embeddings_array(
+        df: pd.DataFrame,
+        col_embeddings: str = 'embeddings',
+        embedding_cols: List[str] = None,
+) -> np.ndarray:
+    """Get a 2D numpy array of embeddings from a df in either layout.
+    If `embedding_cols` is None, we use all wide columns that match `col_embeddings`,
+    or the nested column if there are no wide columns.
+    """
+    if embedding_cols is None:
+        embedding_cols = get_wide_embedding_cols(df.columns, col_embeddings)
+        if (len(embedding_cols) == 0) and (col_embeddings in df.columns):
+            embedding_cols = [col_embeddings]
+
+    if (len(embedding_cols) == 1) and (df[embedding_cols[0]].dtype == object):
+        return np.stack(df[embedding_cols[0]].to_numpy())
+    return df[embedding_cols].to_numpy()
+
+
+def save_embeddings_to_parquet(
+        df: pd.DataFrame,
+        path: Union[str, Path],
+        storage_format: str = STORAGE_FORMAT_WIDE,
+        col_embeddings: str = 'embeddings',
+        index: bool = True,
+        row_group_size: int = None,
+) -> None:
+    """Save df with wide embedding columns in the selected storage format"""
+    if storage_format == STORAGE_FORMAT_WIDE:
+        df.to_parquet(path, index=index)
+    elif storage_format == STORAGE_FORMAT_FIXED_SIZE_LIST:
+        pq.write_table(
+            wide_df_to_arrow_table(df, col_embeddings=col_embeddings, preserve_index=index),
+            str(path),
+            row_group_size=row_group_size,
+        )
+    else:
+        raise NotImplementedError(
+            f"storage_format not implemented: {storage_format}."
+            f"\n  Supported formats: {L_EMBEDDINGS_STORAGE_FORMATS}"
+        )
+
+
+def save_embeddings_to_parquet_in_chunks(
+        df: pd.DataFrame,
+        path: Union[str, Path],
+        col_embeddings: str = 'embeddings',
+        index: bool = True,
+        target_mb_size: int = None,
+) -> None:
+    """Save df in the fixed_size_list layout split into multiple files.
+    Similar to `save_pd_df_to_parquet_in_chunks()` but without dask because dask
+    can't write a FixedSizeList column from pandas.
+    """
+    if target_mb_size is None:
+        target_mb_size = 350
+    n_files = 1 + int((df.memory_usage(index=index, deep=True).sum() / 1048576) // target_mb_size)
+    n_rows_per_file = 1 + (len(df) // n_files)
+    info(f"  {n_files:6,.0f}\t<- target files\t {target_mb_size:6,.1f} <- target MB file size")
+
+    Path(path).mkdir(exist_ok=True, parents=True)
+    for i in range(n_files):
+        # Convert each chunk instead of slicing one table: pyarrow 5 can't write
+        #  a sliced FixedSizeList column (it checks the length of the un-sliced values)
+        pq.write_table(
+            wide_df_to_arrow_table(
+                df.iloc[i * n_rows_per_file:(i + 1) * n_rows_per_file],
+                col_embeddings=col_embeddings, preserve_index=index,
+            ),
+            str(Path(path) / f"part.{i}.parquet"),
+        )
+
+
+def get_nested_columns_and_dims(
+        columns: List[str] = None,
+        col_embeddings: str = 'embeddings',
+) -> Tuple[Optional[List[str]], Optional[List[int]]]:
+    """Map wide embedding columns (embeddings_0...) in `columns` to the nested column.
+
+    Returns:
+        columns to read from the nested layout & the dimensions to keep
+        (None = all dimensions, e.g., when `columns` has the nested column itself)
+    """
+    if columns is None:
+        return None, None
+    l_cols_wide = get_wide_embedding_cols(columns, col_embeddings)
+    columns_ = [c for c in columns if c not in l_cols_wide]
+    if (len(l_cols_wide) == 0) or (col_embeddings in columns_):
+        return columns_, None
+
+    columns_.append(col_embeddings)
+    prefix_ = f"{col_embeddings}_"
+    # keep the order of the input columns, same as reading wide columns
+    return columns_, [int(str(c)[len(prefix_):]) for c in columns if c in l_cols_wide]
+
+
+def get_fixed_size_list_dimensions(
+        path: Union[str, Path, List[Union[str, Path]]],
+        col_embeddings: str = 'embeddings',
+) -> Optional[int]:
+    """Get number of embedding dimensions from the schema (without reading any data)"""
+    l_files = get_parquet_files(path)
+    if len(l_files) == 0:
+        return None
+    type_ = read_parquet_schema(l_files[0]).field(col_embeddings).type
+    return type_.list_size if pa.types.is_fixed_size_list(type_) else None
+
+
+def get_fsspec_filesystem(
+        path: Union[str, Path],
+) -> tuple:
+    """Get the fsspec filesystem & path (without protocol) for a URI (e.g., gs://...)
+    Returns (None, path) for local paths.
+    """
+    if '://' not in str(path):
+        return None, str(path)
+    # import here, fsspec comes with gcsfs
+    import fsspec
+    return fsspec.core.url_to_fs(str(path))
+
+
+def read_parquet_schema(
+        path: Union[str, Path],
+) -> pa.Schema:
+    """Read the arrow schema of a local file or URI (without reading any data)"""
+    fs_, path_ = get_fsspec_filesystem(path)
+    if fs_ is None:
+        return pq.read_schema(path_)
+    with fs_.open(path_, 'rb') as f_:
+        return pq.read_schema(f_)
+
+
+def natural_sort_key(
+        path: Union[str, Path],
+) -> list:
+    """Sort key so that numbered files are in numeric order, e.g., part.2 before part.10"""
+    return [int(t_) if t_.isdigit() else t_ for t_ in re.split(r'(\d+)', str(path))]
+
+
+def get_parquet_files(
+        path: Union[str, Path, List[Union[str, Path]]],
+) -> List[str]:
+    """Get sorted list of parquet files from a folder, a single file or a list of files.
+    `path` can be local or a URI (e.g., gs://...). Files are sorted in numeric order
+    (part.2 before part.10) so rows are read in the order they were written.
+    """
+    if isinstance(path, (list, tuple)):
+        return sorted([str(f_) for f_ in path], key=natural_sort_key)
+
+    fs_, path_ = get_fsspec_filesystem(path)
+    if fs_ is None:
+        if Path(path).is_dir():
+            return sorted([str(f_) for f_ in Path(path).glob('*.parquet')], key=natural_sort_key)
+        return [str(path)]
+
+    if fs_.isdir(path_):
+        # glob() drops the protocol, add it back so each file is a full URI
+        protocol_ = str(path).split('://')[0]
+        return sorted(
+            [f"{protocol_}://{f_}" for f_ in fs_.glob(f"{path_.rstrip('/')}/*.parquet")],
+            key=natural_sort_key,
+        )
+    return [str(path)]
+
+
+def is_fixed_size_list_parquet(
+        path: Union[str, Path, List[Union[str, Path]]],
+        col_embeddings: str = 'embeddings',
+) -> bool:
+    """Check the schema of the first parquet file to find the storage layout"""
+    l_files = get_parquet_files(path)
+    if len(l_files) == 0:
+        return False
+    return is_fixed_size_list_field(read_parquet_schema(l_files[0]), col_embeddings)
+
+
+def read_embeddings_parquet(
+        path: Union[str, Path, List[Union[str, Path]]],
+        columns: List[str] = None,
+        col_embeddings: str = 'embeddings',
+        as_array: bool = False,
+        verbose: bool = False,
+) -> Union[pd.DataFrame, Tuple[pd.DataFrame, np.ndarray]]:
+    """Read embeddings saved in either layout.
+
+    Args:
+        path: folder, single file, or list of parquet files. Local or URIs (gs://...)
+        columns: columns to read. Wide embedding columns (embeddings_0...) are mapped to
+            the nested column when the files use the fixed_size_list layout & we only
+            keep the selected dimensions
+        col_embeddings: name (or prefix for wide layout) of embedding columns
+        as_array: if True, return (df_meta, 2D embeddings array)
+            otherwise, return a single df with wide embedding columns
+
+    Returns:
+        df with wide embeddings columns OR tuple of (df_meta, np.ndarray)
+    """
+    l_files = get_parquet_files(path)
+    nested_ = is_fixed_size_list_parquet(l_files, col_embeddings)
+    if verbose:
+        info(f"  Reading {len(l_files)} files, nested embeddings layout: {nested_}")
+
+    if not nested_:
+        if len(l_files) == 1:
+            df_ = pd.read_parquet(l_files[0], columns=columns)
+        else:
+            df_ = pd.concat(
+                [pd.read_parquet(f_, columns=columns) for f_ in l_files],
+                axis=0, ignore_index=False,
+            )
+        if not as_array:
+            return df_
+        l_emb_cols = get_wide_embedding_cols(df_.columns, col_embeddings)
+        return df_.drop(l_emb_cols, axis=1), df_[l_emb_cols].to_numpy(dtype=np.float32)
+
+    columns, l_dims = get_nested_columns_and_dims(columns, col_embeddings)
+
+    # all files are in the same filesystem, so use the first one to get it
+    fs_, _ = get_fsspec_filesystem(l_files[0])
+    table_ = pq.ParquetDataset(
+        [get_fsspec_filesystem(f_)[1] for f_ in l_files],
+        filesystem=fs_,
+    ).read(columns=columns, use_pandas_metadata=True)
+    if not as_array:
+        return arrow_table_to_wide_df(table_, col_embeddings=col_embeddings, dims=l_dims)
+
+    if col_embeddings not in table_.column_names:
+        return table_.to_pandas(), None
+    return (
+        table_.drop([col_embeddings]).to_pandas(),
+        select_embedding_dims(arrow_embeddings_to_array(table_.column(col_embeddings)), l_dims),
+    )
+
+
+def iter_embeddings_parquet_chunks(
+        path: Union[str, Path, List[Union[str, Path]]],
+        chunk_rows: int = 100000,
+        columns: List[str] = None,
+        col_embeddings: str = 'embeddings',
+) -> Iterator[Tuple[pd.DataFrame, np.ndarray]]:
+    """Read embeddings in either layout one chunk (parquet batch) at a time.
+    Use it when the embeddings don't fit in memory (e.g., post-level or user-level).
+
+    Args:
+        path: folder, single file, or list of parquet files. Local or URIs (gs://...)
+        chunk_rows: max rows per chunk. Chunks don't cross file boundaries
+        columns: columns to read (same as `read_embeddings_parquet()`)
+        col_embeddings: name (or prefix for wide layout) of embedding columns
+
+    Yields:
+        tuple of (df_meta, 2D float32 embeddings array) for each chunk
+    """
+    for f_ in get_parquet_files(path):
+        fs_, path_ = get_fsspec_filesystem(f_)
+        # local files are read by pyarrow directly, URIs with an fsspec file object
+        with (nullcontext(path_) if fs_ is None else fs_.open(path_, 'rb')) as source_:
+            file_ = pq.ParquetFile(source_)
+            nested_ = is_fixed_size_list_field(file_.schema_arrow, col_embeddings)
+
+            columns_, l_dims = columns, None
+            if nested_:
+                columns_, l_dims = get_nested_columns_and_dims(columns, col_embeddings)
+
+            for batch_ in file_.iter_batches(batch_size=chunk_rows, columns=columns_):
+                table_ = pa.Table.from_batches([batch_])
+                if nested_:
+                    yield (
+                        table_.drop([col_embeddings]).to_pandas(),
+                        select_embedding_dims(arrow_embeddings_to_array(table_.column(col_embeddings)), l_dims),
+                    )
+                else:
+                    df_ = table_.to_pandas()
+                    l_emb_cols = get_wide_embedding_cols(df_.columns, col_embeddings)
+                    yield df_.drop(l_emb_cols, axis=1), df_[l_emb_cols].to_numpy(dtype=np.float32)
+
+
+#
+# ~ fin
+#
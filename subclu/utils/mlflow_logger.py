@@ -36,6 +36,12 @@ from mlflow.utils import mlflow_tags
 from mlflow.exceptions import MlflowException
 from tqdm import tqdm
 
+from .embeddings_storage import (
+    read_embeddings_parquet, is_fixed_size_list_parquet,
+    get_fixed_size_list_dimensions, expand_nested_embeddings,
+    get_parquet_files,
+)
+
 
 class MlflowLogger:
     """
@@ -453,6 +459,7 @@ class MlflowLogger:
             n_sample_files: int = None,
             verbose: bool = False,
             read_csv_kwargs: dict = None,
+            col_embeddings: str = 'embeddings',
     ):
         """
         Example:
@@ -470,6 +477,14 @@ class MlflowLogger:
          output will include:
               - df_sub_level__sub_desc_similarity (expected)
               - df_sub_level__sub_desc_similarity_pair (DO NOT WANT!)
+
+        Embeddings saved as a single FixedSizeList column (`col_embeddings`) are
+        returned with wide columns (embeddings_0, embeddings_1...) so downstream code
+        works with both layouts. Use read_function='pa_embeddings' to read them with
+        pyarrow (the embedding columns are a view of the arrow buffer, no copy).
+
+        Use read_function='parquet_files' to only download the files & get a list of
+        local parquet files, e.g., to read them in chunks with `iter_embeddings_parquet_chunks()`
         """
         # set some defaults for common file types so we don't have to load them
         d_read_functions_ = {
@@ -477,6 +492,8 @@ class MlflowLogger:
             'pd_csv': pd.read_csv,
             'dask_parquet': dd.read_parquet,
             'json': json.load,
+            'pa_embeddings': read_embeddings_parquet,
+            'parquet_files': get_parquet_files,
         }
         if isinstance(read_function, str):
             if read_function in d_read_functions_.keys():
@@ -596,12 +613,38 @@ class MlflowLogger:
             try:
                 if verbose:
                     print(f"Loading files in list:\n{l_parquet_files_downloaded[:n_sample_files]}")
-                return read_function(l_parquet_files_downloaded[:n_sample_files], columns=columns)
+                ddf_ = read_function(l_parquet_files_downloaded[:n_sample_files], columns=columns)
             except OSError:
                 path_glob_parquet_ = f"{path_to_load}/*.parquet"
                 if verbose:
                     print(f"Loading file list failed, trying glob: \n{path_glob_parquet_}")
-                return read_function(path_glob_parquet_, columns=columns)
+                ddf_ = read_function(path_glob_parquet_, columns=columns)
+
+            if (
+                    (col_embeddings in ddf_.columns) and
+                    (len(l_parquet_files_downloaded) > 0) and
+                    is_fixed_size_list_parquet(l_parquet_files_downloaded, col_embeddings)
+            ):
+                info(f"  Expanding nested `{col_embeddings}` column to wide columns...")
+                n_dim_ = get_fixed_size_list_dimensions(l_parquet_files_downloaded, col_embeddings)
+                meta_ = ddf_._meta.drop([col_embeddings], axis=1).assign(
+                    **{f"{col_embeddings}_{i}": pd.Series(dtype='float32') for i in range(n_dim_)}
+                )
+                ddf_ = ddf_.map_partitions(expand_nested_embeddings, col_embeddings, meta=meta_)
+            return ddf_
+
+        if read_function == read_embeddings_parquet:
+            return read_function(
+                l_parquet_files_downloaded[:n_sample_files] if cache_locally else path_to_load,
+                columns=columns,
+                col_embeddings=col_embeddings,
+                verbose=verbose,
+            )
+
+        if read_function == get_parquet_files:
+            return read_function(
+                l_parquet_files_downloaded[:n_sample_files] if cache_locally else path_to_load
+            )
 
         if read_function == pd.read_csv:
             if verbose:
@@ -613,6 +656,14 @@ class MlflowLogger:
         elif pd.read_parquet == read_function:
             if n_sample_files is not None:
                 logging.warning(f"Loading ALL files to pandas df. File sampling NOT implemented.")
+            if (
+                    (len(l_parquet_files_downloaded) > 0) and
+                    is_fixed_size_list_parquet(l_parquet_files_downloaded, col_embeddings)
+            ):
+                info(f"  Reading nested `{col_embeddings}` column with pyarrow...")
+                return read_embeddings_parquet(
+                    l_parquet_files_downloaded, columns=columns, col_embeddings=col_embeddings,
+                )
             try:
                 if verbose:
                     info(f"Loading path to pandas:\n  {path_to_load}")